@@ -1,14 +1,13 @@
-from importlib import reload
 import classes
-reload(classes)
 
-import os
 import json
 import csv
 from collections import deque
 import heapq
 import datetime as dt
-import random
+import simconfig
+import loaders
+import geo
 import math
 import time
 
@@ -18,21 +17,16 @@ NODES = {} # <node_id: Node_Object>
 NODE_COORDS = {} # <(lat, lon): Node_Object>
 DRIVERS = []
 PASSENGERS = []
+CONFIG = simconfig.SimConfig() # Seeded driver drop out, same rides on every run
 
 ### Preprocessed information about network
 AVG_MPH = 0
 NUM_ROADS = 0
 
-### Based on sampling two points in NYC and calculating lat/lon mile distance
-LON2MI = 45.5
-LAT2MI = 60.0
-
 def initialize():
 
-    rootpath = os.path.dirname(os.getcwd())
-    
     ### Initialize nodes
-    with open(rootpath + '/data/node_data.json', 'r') as v:
+    with open(loaders.data_path('node_data.json'), 'r') as v:
         n_reader = json.load(v)
 
     # Generate Node objects
@@ -42,7 +36,7 @@ def initialize():
         NODE_COORDS[(n_reader[node_id]['lat'], n_reader[node_id]['lon'])] = node
 
     ### Initialize edges
-    with open(rootpath + '/data/edges.csv', 'r') as e:
+    with open(loaders.data_path('edges.csv'), 'r') as e:
         _ = e.readline()
         e_reader = csv.reader(e)
 
@@ -70,7 +64,7 @@ def initialize():
             NUM_ROADS += 1
 
     ### Initialize drivers
-    with open(rootpath + '/data/drivers.csv', 'r') as d:
+    with open(loaders.data_path('drivers.csv'), 'r') as d:
         _ = d.readline()
         d_reader = csv.reader(d)
         
@@ -83,7 +77,7 @@ def initialize():
             id += 1
 
     ### Initialize passengers
-    with open(rootpath + '/data/passengers.csv', 'r') as p:
+    with open(loaders.data_path('passengers.csv'), 'r') as p:
         _ = p.readline()
         p_reader = csv.reader(p)
 
@@ -99,15 +93,13 @@ def initialize():
     AVG_MPH /= NUM_ROADS
     print(f'Average MPH: {AVG_MPH}')
 
-def manhattan_est_time(start_coords, end_coords):
+def manhattan_est_time(start_xy, end_xy):
     '''
     Estimate of time needed to travel path (based on Manhattan distance and average speed limit across network)
+        - start_xy, end_xy: planar mile coordinates (e.g. driver.xy, passenger.end_xy, see geo)
     '''
 
-    lat_dist = abs(start_coords[0] - end_coords[0])
-    lon_dist = abs(start_coords[1] - end_coords[1])
-    
-    mi_dist = lat_dist * LAT2MI + lon_dist * LON2MI
+    mi_dist = geo.manhattan(start_xy, end_xy)
     approx_drive_time = mi_dist / AVG_MPH * 60
     
     return approx_drive_time
@@ -115,6 +107,7 @@ def manhattan_est_time(start_coords, end_coords):
 def main():
 
     initialize()
+    CONFIG.draw_dropouts(DRIVERS) # Number of rides of every driver, decided up front
 
     # Metrics
     passenger_wait_times, driver_idle_times = [], []
@@ -151,15 +144,14 @@ def main():
             passenger_wait_time += wait.total_seconds() / 60
             
         # Approximate wait and driving time
-        approx_arrival_time = manhattan_est_time(driver.coords, passenger.coords) # Time for driver to pick up
-        approx_drive_time = manhattan_est_time(passenger.coords, passenger.end_coords) # Time for driver to drop off
+        approx_arrival_time = manhattan_est_time(driver.xy, passenger.xy) # Time for driver to pick up
+        approx_drive_time = manhattan_est_time(passenger.xy, passenger.end_xy) # Time for driver to drop off
         total_ride_profit += approx_drive_time - approx_arrival_time # Ride profit
         passenger_wait_time += approx_arrival_time + approx_drive_time # Passenger wait time (time for match + time for pickup)
         passenger_wait_times.append(passenger_wait_time)
         driver_idle_times.append(driver_idle_time)
 
-        p = random.randint(1, 15)
-        if p > 1: # Geometric random variable, expect every driver to do 10 rides per night            
+        if CONFIG.keeps_driving(driver): # Geometric number of rides, expect every driver to do 15 rides per night
             driver.time += dt.timedelta(minutes = approx_arrival_time + approx_drive_time)
             driver.coords = passenger.end_coords
             heapq.heappush(driver_queue, (driver, driver.time))
@@ -1,14 +1,12 @@
-from importlib import reload
 import classes
-reload(classes)
+from datastructures import OngoingRides
 
-import os
 import json
 import csv
 from collections import deque
-import heapq
 import datetime as dt
-import random
+import simconfig
+import loaders
 import time
 import multiprocessing
 import math
@@ -18,6 +16,7 @@ NODES = {} # <node_id: Node_Object>
 NODE_COORDS = {} # <(lat, lon): Node_Object>
 DRIVERS = []
 PASSENGERS = []
+CONFIG = simconfig.SimConfig() # Seeded driver drop out, same rides on every run
 
 ### Preprocessed information about network
 AVG_MPH = 0
@@ -31,10 +30,8 @@ GRID_PARAMS = []
 
 def initialize():
 
-    rootpath = os.path.dirname(os.getcwd())
-    
     ### Initialize nodes
-    with open(rootpath + '/data/node_data.json', 'r') as v:
+    with open(loaders.data_path('node_data.json'), 'r') as v:
         n_reader = json.load(v)
 
     # Generate Node objects
@@ -61,7 +58,7 @@ def initialize():
         node.partition(GRID, GRID_PARAMS)
 
     ### Initialize edges
-    with open(rootpath + '/data/edges.csv', 'r') as e:
+    with open(loaders.data_path('edges.csv'), 'r') as e:
         _ = e.readline()
         e_reader = csv.reader(e)
 
@@ -89,7 +86,7 @@ def initialize():
             NUM_ROADS += 1
 
     ### Initialize drivers
-    with open(rootpath + '/data/drivers.csv', 'r') as d:
+    with open(loaders.data_path('drivers.csv'), 'r') as d:
         _ = d.readline()
         d_reader = csv.reader(d)
         
@@ -103,7 +100,7 @@ def initialize():
             id += 1
 
     ### Initialize passengers
-    with open(rootpath + '/data/passengers.csv', 'r') as p:
+    with open(loaders.data_path('passengers.csv'), 'r') as p:
         _ = p.readline()
         p_reader = csv.reader(p)
 
@@ -233,6 +230,7 @@ def main():
 
     init_start = time.time()
     initialize()
+    CONFIG.draw_dropouts(DRIVERS) # Number of rides of every driver, decided up front
     init_end = time.time()
     print(f'Finished initialization, total time {init_end - init_start} seconds')
 
@@ -240,27 +238,21 @@ def main():
     passenger_wait_times, driver_idle_times = [], [] 
     total_ride_profit = 0
 
-    driver_queue = [] # Priority queue for driver by available time
+    ongoing_rides = OngoingRides() # Drivers on a ride (or not started yet) by available time
     for driver in DRIVERS:
-        heapq.heappush(driver_queue, (driver, driver.time))
+        ongoing_rides.push(driver)
+    available_drivers = [] # Idle drivers, only the assigned driver leaves between requests
     passenger_queue = deque(PASSENGERS) # Priority queue for passenger by ride request time (already sorted and no pushes so we use deque)
 
     while passenger_queue:
         print(len(passenger_queue))
 
-        available_drivers = [] # Available drivers when passenger makes request
-
         # Match passenger and driver
         passenger = passenger_queue.popleft() # Current passenger request
-        try: # Drivers available
-            if driver_queue[0][0].time > passenger.time: # If no available drivers
-                driver, _ = heapq.heappop(driver_queue)
-                available_drivers.append(driver)
-            else:
-                while driver_queue and driver_queue[0][0].time <= passenger.time: # Get all available drivers at current time
-                    driver, _ = heapq.heappop(driver_queue)
-                    available_drivers.append(driver)
-        except:
+        available_drivers.extend(ongoing_rides.pop_completed(passenger.time)) # Drivers whose rides ended before request
+        if not available_drivers and ongoing_rides: # If no available drivers, wait for next driver
+            available_drivers.append(ongoing_rides.pop())
+        if not available_drivers:
             print(f'No more drivers available. Remaining passengers: {len(passenger_queue)} minutes')
             print(f'Average Passenger Wait Time: {sum(passenger_wait_times) / len(passenger_wait_times)} minutes')
             print(f'Average Driver Idle Time: {sum(driver_idle_times) / len(driver_idle_times)} minutes')
@@ -303,14 +295,10 @@ def main():
         passenger_wait_times.append(passenger_wait_time)
         driver_idle_times.append(driver_idle_time)
         
-        # Add drivers back to queue, simulating potential driver drop out
-        p = random.randint(1, 15)
-        for driver in available_drivers:
-            if driver == assigned_driver:
-                if p > 1: # Geometric random variable, expect every driver to do 15 rides per night
-                    heapq.heappush(driver_queue, (driver, driver.time))
-                    continue        
-            heapq.heappush(driver_queue, (driver, driver.time))
+        # Assigned driver is busy until drop off, simulating potential driver drop out
+        available_drivers.remove(assigned_driver)
+        if CONFIG.keeps_driving(assigned_driver): # Geometric number of rides, expect every driver to do 15 rides per night
+            ongoing_rides.push(assigned_driver)
 
         if len(passenger_queue) % 50 == 0:
             print(f'Average Passenger Wait Time: {sum(passenger_wait_times) / len(passenger_wait_times)} minutes')
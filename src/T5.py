@@ -1,22 +1,22 @@
 
-from importlib import reload
 import classes
-reload(classes)
 
 import os
-import json
 import csv
 from collections import deque
-import heapq
 import datetime as dt
-import random
-import math
 import time
+import queue
 
-import datastructures
-reload(datastructures)
 from datastructures import Grid
 from datastructures import KDTree
+from datastructures import QuadTree
+from datastructures import OngoingRides
+import loaders
+import traffic
+import simconfig
+
+# Optional subsystems (spatial indexes, tables, kernels, checkpoints, tracing) are imported where they are used
 
 
 ### Data Objects
@@ -24,74 +24,102 @@ NODES = {} # <node_id: Node_Object>
 NODE_COORDS = {} # <(lat, lon): Node_Object>
 DRIVERS = []
 PASSENGERS = []
+CONFIG = simconfig.SimConfig() # Seeded driver drop out, same rides on every run
+DRIVERS_FILE = 'drivers.csv' # In data directory, or a generated workload (generator.py, .csv or .npy)
+PASSENGERS_FILE = 'passengers.csv'
 
 ### Preprocessed information about network
 AVG_MPH = 0
 NUM_ROADS = 0
+HOURLY_AVG_MPH = None # Average MPH on network in each hour bucket
 
-### Based on sampling two points in NYC and calculating lat/lon mile distance
-LON2MI = 45.5
-LAT2MI = 60.0
 
+### Spatial index parameters
+USE_QUADTREE = True # Adaptive quadtree for node snapping and driver lookups, otherwise KDTree and Grid
+BUCKET_CAPACITY = 32 # Max objects per quadtree leaf
 
-KDTREE = None
-PARTITION = None
+GRAPH = None # Array representation of network
+NODE_INDEX = None # Nearest node lookups
+EDGE_INDEX = None # Nearest road segment lookups, people are placed mid-edge and routes start and end there
+USE_EDGE_SNAPPING = True
+PARTITION = None # Grid with edges and average speeds
+DRIVER_INDEX = None # Available drivers
 
+### En-route dispatch
+EN_ROUTE_WINDOW = 2 # Minutes, drivers finishing a ride within this long after a request can be matched to it (0 to disable)
 
-def initialize():
+### Live traffic
+TRAFFIC_FILE = None # Optional csv of speed updates (start_id,end_id,bucket,mph), stand-in for a live feed
+TRAFFIC_UPDATES = queue.Queue() # Batches of speed updates, applied between ride requests
+ROUTE_CACHE = traffic.RouteCache()
+TRAFFIC_UPDATER = None
 
-    rootpath = os.path.dirname(os.getcwd())
-    rootpath = os.path.join(rootpath, 'NotUber')
-    
-    global PARTITION
-    PARTITION = Grid()
-    
-    ### Initialize nodes
-    with open(rootpath + '/data/node_data.json', 'r') as v:
-        n_reader = json.load(v)
+### Checkpoints
+NETWORK_FILE = 'network.npz' # Compiled network in data directory (graph.ArrayGraph.save), loaded instead of node_data.json and edges.csv if present
+CHECKPOINT_FILE = None # Dynamic simulation state is saved here every CHECKPOINT_EVERY passengers (None to disable)
+CHECKPOINT_EVERY = 1000
+TRACE_FILE = None # Every routing query is recorded to this file (see routetrace, replayed offline against other routers)
 
-    # Generate Node objects
-    for node_id in n_reader:
-        node = classes.Node(id = int(node_id), lat = n_reader[node_id]['lat'], lon = n_reader[node_id]['lon'])
-        NODES[int(node_id)] = node
-        NODE_COORDS[(n_reader[node_id]['lat'], n_reader[node_id]['lon'])] = node
-        PARTITION.add_node(node)
-    
-    global KDTREE
-    KDTREE = KDTree(NODES.values(), 0, 100)
-
-    ### Initialize edges
-    with open(rootpath + '/data/edges.csv', 'r') as e:
-        _ = e.readline()
-        e_reader = csv.reader(e)
-
-        # Generate Edge objects
-        for edge in e_reader:
-            start_node = NODES[int(edge[0])]
-            end_node = NODES[int(edge[1])]
-            length = edge[2]
-            weekday_speeds = dict(zip([*range(0, 24)], edge[3:27]))
-            weekend_speeds = dict(zip([*range(0, 24)], edge[27:]))
-            neighbor = classes.Edge(start_node, end_node, length, weekday_speeds, weekend_speeds)
-            NODES[int(edge[0])].neighbors.append(neighbor) # Add edge to neighbors of start node
-        
-            # Network data (preprocessing)
-            avg_speed = 0
-            for _, val in weekday_speeds.items():
-                avg_speed += float(val)
-            for _, val in weekend_speeds.items():
-                avg_speed += float(val)
-            avg_speed /= len(weekday_speeds) + len(weekend_speeds)
-            
-            global AVG_MPH
-            global NUM_ROADS
-            AVG_MPH += avg_speed
-            NUM_ROADS += 1
-        
-            PARTITION.add_edge(neighbor)
 
-    ### Initialize drivers
-    with open(rootpath + '/data/drivers.csv', 'r') as d:
+def main_component_node(node_id: int) -> classes.Node:
+    '''
+    Node object of node_id if it is in the main strongly connected component, else None
+    '''
+
+    node = NODES[node_id]
+    return node if node.component == GRAPH.main_component else None
+
+
+def snap_to_edges(drivers: list, passengers: list) -> None:
+    '''
+    Place people on their nearest road segment with one batch R-tree query. Their node is the end node of that edge
+    (where they leave it), so node based code keeps working. Pickups and drop offs that already have a node (generated
+    .npy workloads carry theirs) are left as they are and routed from that node
+    '''
+
+    starts = [person for person in drivers + passengers if person.node is None]
+    ends = [passenger for passenger in passengers if passenger.end_node is None]
+    points = [person.coords for person in starts] + [passenger.end_coords for passenger in ends]
+    if not points:
+        return
+    edges, offsets, _ = EDGE_INDEX.nearest_batch(points)
+    for i, (person, edge, offset) in enumerate(zip(starts + ends, edges.tolist(), offsets.tolist())):
+        if i < len(starts):
+            person.edge_point = (edge, offset)
+            person.node = GRAPH.edges[edge].end_node
+        else:
+            person.end_edge_point = (edge, offset)
+            person.end_node = GRAPH.edges[edge].end_node
+
+
+def snap_nodes(points: list) -> list:
+    '''
+    Node a trip from each of points (lat, lon) is routed from, snapped like people are: the end node of the nearest
+    road segment with edge snapping, otherwise the nearest node
+    '''
+
+    if EDGE_INDEX is not None:
+        edges, _, _ = EDGE_INDEX.nearest_batch(points)
+        return [GRAPH.edges[edge].end_node for edge in edges.tolist()]
+    return [NODE_INDEX.get_kNN(1, coords)[0][1] for coords in points]
+
+
+def load_drivers(path: str) -> list:
+    '''
+    Driver objects from drivers.csv, or from a generated .npy workload (already snapped to nodes,
+    nodes outside the main component are snapped again in main)
+    '''
+    
+    drivers = []
+    if path.endswith('.npy'):
+        import generator
+        for id, (time, lat, lon, node_id) in enumerate(generator.load_records(path).tolist(), start = 1):
+            driver = classes.Driver(id = id, timestamp = loaders.epoch_to_datetime(time), lat = lat, lon = lon)
+            driver.node = main_component_node(node_id)
+            drivers.append(driver)
+        return drivers
+    
+    with open(path, 'r') as d:
         _ = d.readline()
         d_reader = csv.reader(d)
         
@@ -100,11 +128,28 @@ def initialize():
         for d in d_reader:
             time, lat, lon = d
             driver = classes.Driver(id = id, timestamp = time, lat = float(lat), lon = float(lon))
-            DRIVERS.append(driver)
+            drivers.append(driver)
             id += 1
+    return drivers
+
 
-    ### Initialize passengers
-    with open(rootpath + '/data/passengers.csv', 'r') as p:
+def load_passengers(path: str) -> list:
+    '''
+    Passenger objects from passengers.csv, or from a generated .npy workload (already snapped to nodes,
+    nodes outside the main component are snapped again in main)
+    '''
+    
+    passengers = []
+    if path.endswith('.npy'):
+        import generator
+        for id, (time, start_lat, start_lon, end_lat, end_lon, node_id, end_node_id) in enumerate(generator.load_records(path).tolist(), start = 1):
+            passenger = classes.Passenger(id = id, timestamp = loaders.epoch_to_datetime(time), start_lat = start_lat, start_lon = start_lon, end_lat = end_lat, end_lon = end_lon)
+            passenger.node = main_component_node(node_id)
+            passenger.end_node = main_component_node(end_node_id)
+            passengers.append(passenger)
+        return passengers
+    
+    with open(path, 'r') as p:
         _ = p.readline()
         p_reader = csv.reader(p)
 
@@ -113,26 +158,224 @@ def initialize():
         for p in p_reader:
             time, start_lat, start_lon, end_lat, end_lon = p
             passenger = classes.Passenger(id = id, timestamp = time, start_lat = float(start_lat), start_lon = float(start_lon), end_lat = float(end_lat), end_lon = float(end_lon))
-            PASSENGERS.append(passenger)
+            passengers.append(passenger)
             id += 1
-            
+    return passengers
+
+
+def compile_network(path: str = None) -> str:
+    '''
+    Parse node_data.json and edges.csv into the arrays initialize loads instead (graph.ArrayGraph.save), without
+    building Node objects or loading people
+        - path: output file, default NETWORK_FILE in the data directory
+
+    Returns the path written
+    '''
+
+    path = path or loaders.data_path(NETWORK_FILE)
+    node_ids, node_lats, node_lons = loaders.load_nodes(loaders.data_path('node_data.json'))
+    network = loaders.load_edge_graph(node_ids, node_lats, node_lons, loaders.data_path('edges.csv'))
+    network.strongly_connected_components()
+    network.save(path)
+    return path
+
+
+def initialize():
+    import graph
+    import kernels
+    import memprofile
+
+    global PARTITION
+    PARTITION = Grid()
     
-    PARTITION.calc_avg_speeds()
+    ### Initialize nodes (streamed into arrays instead of json.load-ing the whole file, or from the compiled network)
+    global GRAPH
+    network_path = loaders.data_path(NETWORK_FILE)
+    if os.path.exists(network_path):
+        GRAPH = graph.ArrayGraph.load(network_path)
+        node_ids, node_lats, node_lons = GRAPH.node_ids, GRAPH.lat, GRAPH.lon
+    else:
+        node_ids, node_lats, node_lons = loaders.load_nodes(loaders.data_path('node_data.json'))
+
+    # Generate Node objects
+    for node_id, lat, lon in zip(node_ids.tolist(), node_lats.tolist(), node_lons.tolist()):
+        node = classes.Node(id = node_id, lat = lat, lon = lon)
+        NODES[node_id] = node
+        NODE_COORDS[(lat, lon)] = node
+        PARTITION.add_node(node)
+    memprofile.mark('nodes')
+
+    ### Initialize edges (bulk loaded into typed arrays, Edge objects share the speed table)
+    if not os.path.exists(network_path):
+        GRAPH = loaders.load_edge_graph(node_ids, node_lats, node_lons, loaders.data_path('edges.csv'))
+    GRAPH.make_edges(NODES)
+    GRAPH.strongly_connected_components(NODES) # Tags Node.component, unreachable pairs are rejected before searching
+    
+    # Network data (preprocessing)
+    global AVG_MPH, NUM_ROADS, HOURLY_AVG_MPH
+    AVG_MPH, HOURLY_AVG_MPH = loaders.network_speed_stats(GRAPH.speeds)
+    NUM_ROADS = GRAPH.num_edges
+    ROUTE_CACHE.router = kernels.Router(GRAPH) # A* over the edge arrays (Numba compiled if installed)
+    memprofile.mark('edges')
+
+    # Only nodes of the main component are snapped to, so every trip has a path
+    global NODE_INDEX
+    main_nodes = [node for node in NODES.values() if node.component == GRAPH.main_component]
+    if USE_QUADTREE:
+        NODE_INDEX = QuadTree(main_nodes, BUCKET_CAPACITY)
+    else:
+        NODE_INDEX = KDTree(main_nodes, 0, 100)
+    global EDGE_INDEX
+    if USE_EDGE_SNAPPING:
+        import rtree
+        main_edges = (GRAPH.component[GRAPH.edge_start] == GRAPH.main_component) & (GRAPH.component[GRAPH.edge_end] == GRAPH.main_component)
+        EDGE_INDEX = rtree.EdgeRTree(GRAPH, main_edges)
+    memprofile.mark('node index')
+
+    ### Initialize drivers and passengers (shipped csv files or a generated workload)
+    DRIVERS.extend(load_drivers(loaders.data_path(DRIVERS_FILE)))
+    PASSENGERS.extend(load_passengers(loaders.data_path(PASSENGERS_FILE)))
+    if EDGE_INDEX is not None:
+        snap_to_edges(DRIVERS, PASSENGERS)
+    memprofile.mark('people')
+    
+    PARTITION.calc_avg_speeds(GRAPH)
+    memprofile.mark('grid speeds')
+    
+    ### Precomputed cell travel times (generated offline by traveltimes.py)
+    import traveltimes
+    if os.path.exists(traveltimes.DEFAULT_PATH):
+        PARTITION.travel_times = traveltimes.CellTravelTimes.load(graph = GRAPH)
+        PARTITION.isochrones = traveltimes.CellIsochrones(PARTITION.travel_times) # Grid driver lookups skip cells too far from the pickup
+    
+    ### Precomputed hub travel time tables (generated offline by hubs.py)
+    import hubs
+    if os.path.exists(hubs.HubTables.paths(hubs.DEFAULT_DIR)[1]):
+        ROUTE_CACHE.hubs = hubs.HubTables.load(GRAPH)
+    memprofile.mark('tables')
     
     ### Average MPH on network
-    AVG_MPH /= NUM_ROADS
     print(f'Average MPH: {AVG_MPH}')
+    
+    global DRIVER_INDEX
+    DRIVER_INDEX = QuadTree(capacity = BUCKET_CAPACITY, avg_mph = AVG_MPH) if USE_QUADTREE else PARTITION
+    
+    global TRAFFIC_UPDATER
+    TRAFFIC_UPDATER = traffic.TrafficUpdater(GRAPH, PARTITION, ROUTE_CACHE, PARTITION.travel_times)
+    if TRAFFIC_FILE is not None:
+        traffic.feed_from_file(TRAFFIC_FILE, TRAFFIC_UPDATES)
+    if TRACE_FILE is not None:
+        import routetrace
+        ROUTE_CACHE.trace = routetrace.TraceRecorder(TRACE_FILE)
+    memprofile.mark('driver index')
+
+
+
+def serve(driver: classes.Driver, passenger: classes.Passenger, earliest: dt.datetime = None) -> tuple:
+    '''
+    Drive a matched driver to the passenger and the passenger to their destination: route both legs (snapping
+    driver and passenger to nodes first if needed) and, if the driver keeps driving, move the driver to the drop off
+    with the ride's route. The driver must already be out of the driver index
+        - earliest: optional time the driver can leave at the earliest (e.g. the request reached the driver late)
+
+    Returns (passenger wait time, driver idle time, ride profit, True if the driver takes more rides)
+    '''
+
+    # check if driver and passenger have assigned nodes
+    if driver.node == None:
+        dist, node = NODE_INDEX.get_kNN(1, driver.coords)[0]
+        driver.node = node
+    if passenger.node == None:
+        dist, node = NODE_INDEX.get_kNN(1, passenger.coords)[0]
+        passenger.node = node
+    if passenger.end_node == None:
+        dist, node = NODE_INDEX.get_kNN(1, passenger.end_coords)[0]
+        passenger.end_node = node
+
+    # en-route drivers leave for the passenger once they drop off their current ride
+    time_to_available = max(0, (driver.time - passenger.time).total_seconds() / 60)
+    if earliest is not None:
+        time_to_available = max(time_to_available, (earliest - passenger.time).total_seconds() / 60)
+    idle_time = max(0, (passenger.time - driver.time).total_seconds() / 60)
+    departure_time = passenger.time + dt.timedelta(minutes=time_to_available)
+    if driver.edge_point is not None and passenger.edge_point is not None: # routes start and end mid-edge
+        import rtree
+        route = lambda start_node, end_node, start_time: ROUTE_CACHE.shortest_path(start_node, end_node, start_time, AVG_MPH, return_path=True)
+        time_to_passenger, pickup_path = rtree.edge_point_path(route, GRAPH, driver.edge_point, passenger.edge_point, departure_time)
+        pickup_time = departure_time + dt.timedelta(minutes=time_to_passenger)
+        time_to_destination, dropoff_path = rtree.edge_point_path(route, GRAPH, passenger.edge_point, passenger.end_edge_point, pickup_time)
+        # the first edge of a leg is the one the driver (at its end node) or passenger is on
+        pickup_path, dropoff_path = pickup_path[1:], dropoff_path[1:]
+    else:
+        time_to_passenger, pickup_path = ROUTE_CACHE.shortest_path(driver.node, passenger.node, departure_time, AVG_MPH, return_path=True)
+        pickup_time = departure_time + dt.timedelta(minutes=time_to_passenger)
+        time_to_destination, dropoff_path = ROUTE_CACHE.shortest_path(passenger.node, passenger.end_node, pickup_time, AVG_MPH, return_path=True)
+
+    passenger_wait_time = time_to_available + time_to_passenger + time_to_destination
+    driver_start_node = driver.node
+
+    keeps_driving = CONFIG.keeps_driving(driver) # Geometric number of rides, expect every driver to do 15 rides per night
+    if keeps_driving:
+        # Update driver data
+        driver.coords = passenger.end_node.coords
+        driver.node = passenger.end_node
+        driver.edge_point = passenger.end_edge_point
+        driver.time = passenger.time + dt.timedelta(minutes=passenger_wait_time)
+        # timeline of the ride, so the driver's position can be looked up at any time before drop off
+        driver.route = classes.Route(departure_time, driver_start_node)
+        driver.route.add_leg(pickup_path, departure_time, time_to_passenger)
+        driver.route.add_leg(dropoff_path, pickup_time, time_to_destination)
+    return passenger_wait_time, idle_time, time_to_destination - time_to_passenger, keeps_driving
 
 
+def index_driver(driver_index, en_route: dict, driver: classes.Driver, time: dt.datetime) -> None:
+    '''
+    Add a driver taken out of the ongoing rides to the driver index. A driver dropping off within EN_ROUTE_WINDOW of time
+    is placed where it is along its route instead of at its drop off, and kept in en_route <driver id: Driver> to be
+    moved on. Drivers pulled in further ahead (no driver available) wait at their drop off, their ETA is mostly the
+    time until they are free
+    '''
 
-def main():
+    if time < driver.time <= time + dt.timedelta(minutes=EN_ROUTE_WINDOW):
+        driver.coords = driver.position_at(time)
+        en_route[driver.id] = driver
+    driver_index.add_driver(driver)
+
+
+def move_en_route(driver_index, en_route: dict, time: dt.datetime) -> None:
+    # Move the en-route drivers in the driver index to where they are at time, drivers free by then are at their drop off
+    for driver in list(en_route.values()):
+        position = driver.position_at(time)
+        if position != driver.coords:
+            driver_index.move_driver_to(driver, position)
+        if driver.time <= time:
+            del en_route[driver.id]
+
+
+def main(resume: str = None):
+    '''
+    Run the simulation over PASSENGERS
+        - resume: checkpoint file (see CHECKPOINT_FILE) to continue from, after initialize
+    '''
     
     # Metrics
     passenger_wait_times, driver_idle_times = [], []
     total_ride_profit = 0
     
-    driver_queue = deque(DRIVERS)
-    passenger_queue = deque(PASSENGERS) # Priority queue for passenger by ride request time (already sorted and no pushes so we use deque)
+    CONFIG.draw_dropouts(DRIVERS) # Number of rides of every driver, decided up front
+    ongoing_rides = OngoingRides() # Drivers on a ride (or not started yet) by time they become available
+    en_route = {} # Drivers in the index before their ride is over <driver id: Driver>
+    if resume is None:
+        cursor = 0 # Passengers matched so far
+        for driver in DRIVERS:
+            ongoing_rides.push(driver)
+    else:
+        import checkpoint
+        cursor, passenger_wait_times, driver_idle_times, total_ride_profit = checkpoint.restore(
+            resume, DRIVERS, NODES, len(PASSENGERS), GRAPH, ongoing_rides, DRIVER_INDEX, CONFIG, TRAFFIC_UPDATER, en_route)
+        print(f'Resumed from {resume} after {cursor} passengers')
+    resumed_at = cursor
+    passenger_queue = deque(PASSENGERS[cursor:]) # Priority queue for passenger by ride request time (already sorted and no pushes so we use deque)
 
     print('Running simulation...')
     i = 0
@@ -144,85 +387,76 @@ def main():
             start_time = time.time()
         i+= 1
 
+        if CHECKPOINT_FILE is not None and cursor % CHECKPOINT_EVERY == 0 and cursor != resumed_at:
+            import checkpoint
+            checkpoint.save(CHECKPOINT_FILE, DRIVERS, ongoing_rides, CONFIG, cursor, len(PASSENGERS), passenger_wait_times,
+                            driver_idle_times, total_ride_profit, GRAPH, TRAFFIC_UPDATER.applied, en_route)
+
+        # Apply any live traffic updates that arrived
+        TRAFFIC_UPDATER.poll(TRAFFIC_UPDATES)
+
         # Match passenger and driver
         passenger = passenger_queue.popleft()
+        cursor += 1
         
-        # add all drivers that became available between now and when passenger arrived
-        while len(driver_queue) > 0 and driver_queue[0].time < passenger.time:
-            PARTITION.add_driver(driver_queue.popleft())
+        # add all drivers whose rides ended between now and when passenger arrived,
+        # and drivers about to drop off (at their position along the ride, their ETA includes the time until they are free)
+        move_en_route(DRIVER_INDEX, en_route, passenger.time)
+        for driver in ongoing_rides.pop_completed(passenger.time + dt.timedelta(minutes=EN_ROUTE_WINDOW)):
+            index_driver(DRIVER_INDEX, en_route, driver, passenger.time)
             
         # check if there are drivers currently on grid
         # if no drivers, add next few drivers to grid
-        if PARTITION.driver_count == 0:
+        if DRIVER_INDEX.driver_count == 0:
             print('No drivers available, looking into future drivers...')
             print('No drivers at time', passenger.time)
-            print('Top driver at ', driver_queue[0].time)
+            print('Top driver at ', ongoing_rides.peek_time() if ongoing_rides else None)
             for i in range(10): # arbitrarily choose amount, we can tune for different results
                 # Higher number means more likely we notice if a driver will appear close to passenger
                 # But too high means we may need to do a lot more processing for future rides
-                if len(driver_queue) <= 0: break
-                PARTITION.add_driver(driver_queue.popleft())
+                if len(ongoing_rides) <= 0: break
+                index_driver(DRIVER_INDEX, en_route, ongoing_rides.pop(), passenger.time)
         
         # if there are no drivers left and no drivers to add, we quit
-        if PARTITION.driver_count == 0:
+        if DRIVER_INDEX.driver_count == 0:
             print(f'No more drivers available. Remaining passengers: {len(passenger_queue)} minutes')
             print(f'Average Passenger Wait Time: {sum(passenger_wait_times) / len(passenger_wait_times)} minutes')
             print(f'Average Driver Idle Time: {sum(driver_idle_times) / len(driver_idle_times)} minutes')
             print(f'Average Driver Profit: {total_ride_profit / len(DRIVERS)} minutes')
+            close_trace()
             return
 
         # match passenger with driver
-        eta, driver = PARTITION.get_closest_driver(passenger.coords, passenger.time)
+        eta, driver = DRIVER_INDEX.get_closest_driver(passenger.coords, passenger.time)
         if driver == None:
             print('Error, found no drivers.')
-            print(f'Available drivers: {PARTITION.driver_count}')
+            print(f'Available drivers: {DRIVER_INDEX.driver_count}')
             print(f'Querying {passenger.coords}')
         
-        # check if driver and passenger have assigned nodes
-        if driver.node == None:
-            dist, node = KDTREE.get_kNN(1, driver.coords)[0]
-            driver.node = node
-        if passenger.node == None:
-            dist, node = KDTREE.get_kNN(1, passenger.coords)[0]
-            passenger.node = node
-        if passenger.end_node == None:
-            dist, node = KDTREE.get_kNN(1, passenger.end_coords)[0]
-            passenger.end_node = node
-        
-        # calculate actual time to reach passenger and to arrive at destination
-        
-
-        time_to_available = max(0, (passenger.time - driver.time).total_seconds() / 60)
-        time_to_passenger = driver.node.shortest_path_a_star(passenger.node, passenger.time, AVG_MPH)
-        time_to_destination = passenger.node.shortest_path_a_star(passenger.end_node, passenger.time + dt.timedelta(minutes=time_to_passenger), AVG_MPH)
-
-        #print(f'Time to do graph search: {end_time - start_time} seconds')
-        
-        
-        passenger_wait_time = time_to_available + time_to_passenger + time_to_destination
-        total_ride_profit += time_to_destination - time_to_passenger
-        
+        # driver is busy until drop off, so it leaves the index until its ride is over
+        DRIVER_INDEX.remove_driver(driver)
+        en_route.pop(driver.id, None)
+        passenger_wait_time, idle_time, ride_profit, keeps_driving = serve(driver, passenger)
         passenger_wait_times.append(passenger_wait_time)
-        
-        
-
-        p = random.randint(1, 15)
-        if p > 1: # Geometric random variable, expect every driver to do 10 rides per night            
-            # Update driver data
-            PARTITION.move_driver_to(driver, passenger.end_node.coords)
-            
-            driver.node = passenger.end_node
-            driver.time = passenger.time + dt.timedelta(minutes=passenger_wait_time)
-        else:
-            PARTITION.remove_driver(driver)
+        driver_idle_times.append(idle_time)
+        total_ride_profit += ride_profit
+        if keeps_driving:
+            ongoing_rides.push(driver)
             
         
     
     print(f'Average Passenger Wait Time: {sum(passenger_wait_times) / len(passenger_wait_times)} minutes')
-    #print(f'Average Driver Idle Time: {sum(driver_idle_times) / len(driver_idle_times)} minutes')
+    print(f'Average Driver Idle Time: {sum(driver_idle_times) / len(driver_idle_times)} minutes')
     print(f'Total Driver Profit: {total_ride_profit} minutes')
     print(f'Average Driver Profit: {total_ride_profit / len(DRIVERS)} minutes')
+    close_trace()
+
 
+def close_trace() -> None:
+    # Write out the rest of the routing trace, if one is being recorded
+    if ROUTE_CACHE.trace is not None:
+        ROUTE_CACHE.trace.close()
+        print(f'Recorded {ROUTE_CACHE.trace.count} routing queries to {ROUTE_CACHE.trace.path}')
 
 
 if __name__ == '__main__':
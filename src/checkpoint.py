@@ -0,0 +1,150 @@
+import os
+import datetime as dt
+
+import numpy as np
+
+import classes
+import loaders
+
+VERSION = 3
+IN_INDEX, ON_RIDE, DROPPED, EN_ROUTE = 0, 1, 2, 3 # Where each driver is at a checkpoint (EN_ROUTE: in the index before its ride is over)
+MICROSECOND = dt.timedelta(microseconds = 1)
+
+
+def to_micros(time: dt.datetime) -> int:
+    return (time - loaders.EPOCH_DATETIME) // MICROSECOND
+
+
+def from_micros(micros: int) -> dt.datetime:
+    return loaders.EPOCH_DATETIME + dt.timedelta(microseconds = int(micros))
+
+
+def save(path: str, drivers: list, ongoing_rides, config, cursor: int, num_passengers: int, wait_times: list,
+         idle_times: list, total_profit: float, graph, traffic_updates: list = (), en_route: dict = None) -> None:
+    '''
+    Write the dynamic simulation state between two passengers to a .npz file (written to a temporary file first,
+    so a crash while saving leaves the previous checkpoint intact). The network and the people files are not saved,
+    they are loaded again by initialize (see graph.ArrayGraph.save for a compiled network)
+        - drivers: every Driver object, in id order as loaded
+        - ongoing_rides: datastructures.OngoingRides, drivers neither in it nor dropped out are in the driver index
+        - config: simconfig.SimConfig, seed and rides done are its whole random state
+        - cursor: number of passengers already matched
+        - traffic_updates: (start_id, end_id, bucket, mph) speed updates applied so far
+        - en_route: drivers in the driver index that are still finishing a ride <driver id: Driver>
+    '''
+
+    num_drivers = len(drivers)
+    on_ride = {driver.id for _, _, driver in ongoing_rides.heap}
+    state = np.full(num_drivers, IN_INDEX, dtype = np.int8)
+    times = np.empty(num_drivers, dtype = np.int64)
+    coords = np.empty((num_drivers, 2))
+    nodes = np.full(num_drivers, -1, dtype = np.int64)
+    edge_points = np.full(num_drivers, -1, dtype = np.int64)
+    offsets = np.zeros(num_drivers)
+    rides = np.zeros(num_drivers, dtype = np.int64)
+    route_ptr = np.zeros(num_drivers + 1, dtype = np.int64) # route of driver i is route_nodes[route_ptr[i]:route_ptr[i+1]]
+    route_starts = np.full(num_drivers, -1, dtype = np.int64)
+    route_nodes, route_times = [], []
+
+    for i, driver in enumerate(drivers):
+        rides[i] = config.rides.get(driver.id, 0)
+        if driver.id in on_ride:
+            state[i] = ON_RIDE
+        elif en_route is not None and driver.id in en_route:
+            state[i] = EN_ROUTE
+        elif driver.id in config.quota and rides[i] >= config.quota[driver.id]:
+            state[i] = DROPPED
+        times[i] = to_micros(driver.time)
+        coords[i] = driver.coords
+        if driver.node is not None:
+            nodes[i] = driver.node.id
+        if driver.edge_point is not None:
+            edge_points[i], offsets[i] = driver.edge_point
+        if driver.route is not None:
+            route_starts[i] = to_micros(driver.route.start_time)
+            route_nodes.extend(node.id for node in driver.route.nodes)
+            route_times.extend(driver.route.times)
+        route_ptr[i+1] = len(route_nodes)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, version = VERSION, seed = config.seed, dropout_p = config.dropout_p, cursor = cursor,
+                 shape = np.array([graph.num_nodes, graph.num_edges, num_drivers, num_passengers]),
+                 total_profit = total_profit, wait_times = np.array(wait_times), idle_times = np.array(idle_times),
+                 ids = np.array([driver.id for driver in drivers], dtype = np.int64), state = state, times = times,
+                 coords = coords, nodes = nodes, edge_points = edge_points, offsets = offsets, rides = rides,
+                 route_ptr = route_ptr, route_starts = route_starts, route_nodes = np.array(route_nodes, dtype = np.int64),
+                 route_times = np.array(route_times), traffic = np.array(traffic_updates, dtype = np.float64).reshape(-1, 4))
+    os.replace(tmp_path, path)
+
+
+def restore(path: str, drivers: list, nodes: dict, num_passengers: int, graph, ongoing_rides, driver_index, config,
+            traffic_updater = None, en_route: dict = None) -> tuple:
+    '''
+    Put a freshly initialized simulation back in the state saved by save: driver fields, routes, rides done,
+    the driver index, en-route drivers (added to en_route if given) and ongoing rides, and the speed updates applied so far
+
+    Returns (cursor, wait_times, idle_times, total_profit) to continue the passenger loop from
+    '''
+
+    with np.load(path) as saved:
+        if int(saved['version']) != VERSION:
+            raise ValueError(f'Checkpoint {path} has version {int(saved["version"])}, expected {VERSION}')
+        expected = [graph.num_nodes, graph.num_edges, len(drivers), num_passengers]
+        if saved['shape'].tolist() != expected:
+            raise ValueError(f'Checkpoint {path} was saved for (nodes, edges, drivers, passengers) {saved["shape"].tolist()}, not {expected}')
+        saved = {name: saved[name] for name in saved.files}
+
+    config.seed, config.dropout_p = int(saved['seed']), float(saved['dropout_p'])
+    config.draw_dropouts(drivers)
+    if traffic_updater is not None and len(saved['traffic']):
+        traffic_updater.apply([(int(start), int(end), int(bucket), mph) for start, end, bucket, mph in saved['traffic'].tolist()])
+
+    route_ptr, route_nodes, route_times = saved['route_ptr'].tolist(), saved['route_nodes'].tolist(), saved['route_times'].tolist()
+    columns = zip(drivers, saved['ids'].tolist(), saved['state'].tolist(), saved['times'].tolist(), saved['coords'].tolist(),
+                  saved['nodes'].tolist(), saved['edge_points'].tolist(), saved['offsets'].tolist(), saved['rides'].tolist(),
+                  saved['route_starts'].tolist())
+    for i, (driver, id, state, time, coords, node_id, edge, offset, rides, route_start) in enumerate(columns):
+        if driver.id != id:
+            raise ValueError(f'Checkpoint {path} has driver {id} where driver {driver.id} was loaded')
+        driver.time = from_micros(time)
+        driver.coords = tuple(coords)
+        driver.node = nodes[node_id] if node_id >= 0 else None
+        driver.edge_point = (edge, offset) if edge >= 0 else None
+        config.rides[driver.id] = rides
+        driver.route = None
+        if route_start >= 0:
+            driver.route = classes.Route(from_micros(route_start))
+            driver.route.nodes = [nodes[node_id] for node_id in route_nodes[route_ptr[i]:route_ptr[i+1]]]
+            driver.route.times = route_times[route_ptr[i]:route_ptr[i+1]]
+
+        if state == ON_RIDE:
+            ongoing_rides.push(driver)
+        elif state in (IN_INDEX, EN_ROUTE):
+            driver_index.add_driver(driver)
+            if state == EN_ROUTE and en_route is not None:
+                en_route[driver.id] = driver
+
+    return int(saved['cursor']), saved['wait_times'].tolist(), saved['idle_times'].tolist(), float(saved['total_profit'])
+
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    import T5
+
+    parser = argparse.ArgumentParser(description = 'Compile the T5 network, or resume a T5 simulation from a checkpoint')
+    parser.add_argument('--compile-network', action = 'store_true', help = f'save the network to data/{T5.NETWORK_FILE} and exit')
+    parser.add_argument('--resume', default = None, help = 'checkpoint file to continue from')
+    parser.add_argument('--checkpoint', default = None, help = 'file to keep saving checkpoints to (default: the resumed file)')
+    args = parser.parse_args()
+
+    START = time.time()
+    if args.compile_network:
+        print(f'Saved network to {T5.compile_network()} in {time.time() - START} seconds')
+    else:
+        T5.initialize()
+        T5.CHECKPOINT_FILE = args.checkpoint or args.resume
+        print(f'Initialized in {time.time() - START} seconds')
+        T5.main(args.resume)
+        print(f'Simulation Runtime: {time.time() - START} seconds')
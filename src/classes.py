@@ -1,10 +1,45 @@
 import datetime as dt
-import heapq
 import math
+from bisect import bisect_right
+from functools import lru_cache
 
-### Based on sampling two points in NYC and calculating lat/lon mile distance
-LON2MI = 45.5
-LAT2MI = 60.0
+import pqueue
+import geo
+
+### Based on sampling two points in NYC and calculating lat/lon mile distance (see geo)
+LON2MI = geo.LON2MI
+LAT2MI = geo.LAT2MI
+
+### Timestamp format of drivers.csv and passengers.csv
+TIMESTAMP_FORMAT = "%m/%d/%Y %H:%M:%S"
+
+@lru_cache(maxsize = 1 << 16)
+def parse_timestamp(timestamp: str) -> dt.datetime:
+    '''
+    Fixed-format parser for MM/DD/YYYY HH:MM:SS timestamps, much faster than strptime.
+    Timestamps are minute-granular and heavily repeated, so results are memoized (datetimes are immutable)
+    '''
+
+    return dt.datetime(int(timestamp[6:10]), int(timestamp[0:2]), int(timestamp[3:5]),
+                       int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]))
+
+### Hour buckets: 0-23 are weekday hours, 24-47 are weekend hours (same order as the edges.csv speed columns)
+NUM_BUCKETS = 48
+
+def hour_bucket(time: dt.datetime) -> int:
+    '''
+    Return hour bucket (0-47) of a datetime
+    '''
+
+    return time.hour + (24 if time.weekday() > 4 else 0)
+
+def bucket_start_time(bucket: int) -> dt.datetime:
+    '''
+    Return a representative datetime at the start of an hour bucket (a weekday or weekend day in the data's week)
+    '''
+
+    day = dt.datetime(2014, 4, 26) if bucket >= 24 else dt.datetime(2014, 4, 25)
+    return day + dt.timedelta(hours = bucket % 24)
 
 
 class NotUberObject:
@@ -15,6 +50,16 @@ class NotUberObject:
 
         self.node = None
 
+    @property
+    def coords(self) -> tuple:
+        return self._coords
+
+    @coords.setter
+    def coords(self, coords: tuple) -> None:
+        # planar mile coordinates (geo.project) are kept in sync, distance kernels and spatial indexes use them
+        self._coords = coords
+        self.xy = geo.project(*coords) if coords[0] is not None else None
+
     def __eq__(self, other) -> bool:
         return isinstance(self, NotUberObject) and isinstance(other, NotUberObject) and self.id == other.id
     
@@ -23,15 +68,15 @@ class NotUberObject:
 
     def euclidean_dist(self, other, *args, **kwargs) -> float:
         '''
-        Return distance between latitude/longitude coordinates
+        Return straight line distance in miles between objects
             - Object must have coords attribute
         '''
 
-        if not self.coords or not other.coords:
+        if self.xy is None or other.xy is None:
             print('Missing latitude/longitude coordinates')
             return
         
-        return math.sqrt((self.coords[0] - other.coords[0])**2 + (self.coords[1] - other.coords[1])**2)
+        return geo.euclidean(self.xy, other.xy)
 
     def network_dist(self, other, time) -> float:
         '''
@@ -57,6 +102,7 @@ class Node(NotUberObject):
 
         self.neighbors = [] # Edge objects to node neighbors
         self.drivers = [] # Driver objects at node
+        self.component = None # Strongly connected component id (graph.ArrayGraph.strongly_connected_components)
 
     def __eq__(self, other) -> bool:
         return isinstance(self, Node) and isinstance(other, Node) and self.id == other.id
@@ -64,19 +110,32 @@ class Node(NotUberObject):
     def __hash__(self) -> int:
         return self.id if self.id is not None else super().__hash__() 
 
-    def shortest_path(self, end_node, start_time: dt.datetime) -> float:
+    def may_reach(self, other) -> bool:
+        '''
+        False if there is certainly no path to other: component ids are in reverse topological order, so a node
+        can't reach a higher component id. Always True if components were not computed
+        '''
+
+        return self.component is None or other.component is None or self.component >= other.component
+
+    def shortest_path(self, end_node, start_time: dt.datetime, queue = None) -> float:
         '''
         Dijkstra's Algorithm to find shortest travel time between two nodes
+            - queue: priority queue to use (see pqueue.make_queue), binary heap by default
 
         Returns -1 if no path is found
         '''
 
+        if not self.may_reach(end_node):
+            return -1
+
         distances = {}
         distances[self.id] = 0
-        pq = [(0, self)]
+        pq = pqueue.make_queue(queue)
+        pq.push(0, self)
 
         while pq:
-            current_dist, current_node = heapq.heappop(pq)
+            current_dist, current_node = pq.pop()
             
             if current_node == end_node:
                 return current_dist
@@ -89,46 +148,81 @@ class Node(NotUberObject):
                 new_dist = current_dist + edge.travel_time(start_time) # Heuristic - finding path with shortest time to destination at start time (without accounting for changes during travel)
                 if neighbor.id not in distances or new_dist < distances[neighbor.id]:
                     distances[neighbor.id] = new_dist
-                    heapq.heappush(pq, (new_dist, neighbor))
+                    pq.push(new_dist, neighbor)
                     
         return -1
+
+    def shortest_path_tree(self, start_time: dt.datetime, queue = None) -> dict:
+        '''
+        Dijkstra's Algorithm without a target: shortest travel time from this node to every reachable node
+            - queue: priority queue to use (see pqueue.make_queue), binary heap by default
+
+        Returns dictionary <node_id: travel time in minutes>
+        '''
+
+        distances = {}
+        distances[self.id] = 0
+        pq = pqueue.make_queue(queue)
+        pq.push(0, self)
+
+        while pq:
+            current_dist, current_node = pq.pop()
+
+            if current_dist > distances[current_node.id]:
+                continue
+
+            for edge in current_node.neighbors:
+                neighbor = edge.end_node
+                new_dist = current_dist + edge.travel_time(start_time)
+                if neighbor.id not in distances or new_dist < distances[neighbor.id]:
+                    distances[neighbor.id] = new_dist
+                    pq.push(new_dist, neighbor)
+
+        return distances
     
-    def shortest_path_a_star(self, end_node, start_time: dt.datetime, AVG_MPH) -> float:
+    def shortest_path_a_star(self, end_node, start_time: dt.datetime, AVG_MPH, return_path: bool = False, queue = None) -> float:
         '''
         A* pathfinding algorithm to find shortest travel time between two nodes. Prioritizes paths that seem to be leading closer to the end_node.
+            - return_path: also return the list of Edge objects on the path, i.e. (time, edges)
+            - queue: priority queue to use (see pqueue.make_queue), binary heap by default
 
         Returns -1 if no path is found
         '''
 
-        def heuristic(start: Node, end: Node):
+        target = end_node.xy
+        minutes_per_mile = 60 / AVG_MPH
+
+        def heuristic(node: Node):
             '''
-            Heuristic function: Estimate of time needed to travel path (based on Euclidian distance and average speed across network). 
+            Heuristic function: Estimate of time needed to travel from node to end_node (based on Euclidian distance and average speed across network). 
             The average speed across the network (AVG_MPH) is calculated in the initialize() method. 
-            The LON2MI and LAT2MI are used to convert lat and long to miles based on sampling two points in NYC and calculating lat/lon mile distance.
+            Nodes keep planar mile coordinates (see geo), so no lat/lon conversion happens per push.
             '''
-            lat_dist = abs(start.coords[0] - end.coords[0])
-            lon_dist = abs(start.coords[1] - end.coords[1])
-
-            lat_dist_in_miles = lat_dist * LAT2MI
-            lon_dist_in_miles = lon_dist * LON2MI
-            
-            distance_in_miles = math.sqrt((lat_dist_in_miles)**2 + (lon_dist_in_miles)**2)
-
-            time = 60*distance_in_miles/AVG_MPH
-            return time
+            return geo.euclidean(node.xy, target) * minutes_per_mile
         
-        open_nodes = [(heuristic(self, end_node), self)]
+        if not self.may_reach(end_node):
+            return (-1, []) if return_path else -1
+
+        open_nodes = pqueue.make_queue(queue)
+        open_nodes.push(heuristic(self), self)
         open_set = set()
         open_set.add(self)
         
         g = {}
         g[self] = 0
+        came_from = {} # <Node: Edge used to reach node>, only filled if return_path
         
         while len(open_nodes) > 0:
-            _, curr_node = heapq.heappop(open_nodes)
+            _, curr_node = open_nodes.pop()
             open_set.remove(curr_node)
             
             if curr_node == end_node:
+                if return_path:
+                    path = []
+                    while curr_node in came_from:
+                        path.append(came_from[curr_node])
+                        curr_node = came_from[curr_node].start_node
+                    return g[end_node], path[::-1]
                 return g[curr_node]
             
             for edge in curr_node.neighbors:
@@ -136,11 +230,15 @@ class Node(NotUberObject):
                 new_g = g[curr_node] + edge.travel_time(start_time)
                 if neighbor not in g.keys() or new_g < g[neighbor]:
                     g[neighbor] = new_g
-                    new_f = new_g + heuristic(neighbor, end_node)
+                    if return_path:
+                        came_from[neighbor] = edge
+                    new_f = new_g + heuristic(neighbor)
                     if neighbor not in open_set:
                         open_set.add(neighbor)
-                        heapq.heappush(open_nodes, (new_f, neighbor))
+                        open_nodes.push(new_f, neighbor)
         
+        if return_path:
+            return -1, []
         return -1
     
     def partition(self, grid: list = None, grid_params: list = None) -> None:
@@ -154,12 +252,13 @@ class Node(NotUberObject):
 
         lat, lon = self.coords
         num_partitions, minlat, maxlat, minlon, maxlon = grid_params
-        lat_idx, lon_idx = math.floor( math.ceil(math.sqrt(num_partitions))*(lat - minlat) / (maxlat - minlat) ), math.floor( math.ceil(math.sqrt(num_partitions))*(lon - minlon) / (maxlon - minlon) ) # Index of subpartition in grid
+        dim = math.ceil(math.sqrt(num_partitions)) # Grid is dim x dim
+        lat_idx, lon_idx = math.floor( dim*(lat - minlat) / (maxlat - minlat) ), math.floor( dim*(lon - minlon) / (maxlon - minlon) ) # Index of subpartition in grid
         
         # Edge cases
-        if lat_idx == 30:
+        if lat_idx == dim:
             lat_idx -= 1 
-        if lon_idx == 30:
+        if lon_idx == dim:
             lon_idx -= 1
 
         grid[lat_idx][lon_idx].append(self) # Add node to appropriate subpartition
@@ -168,8 +267,9 @@ class Person(NotUberObject):
 
     def __init__(self, id: int = None, timestamp: str = None, lat: float = None, lon: float = None) -> None:
         super().__init__(id, lat, lon)
-        self.time = dt.datetime.strptime(timestamp, "%m/%d/%Y %H:%M:%S")
+        self.time = parse_timestamp(timestamp) if isinstance(timestamp, str) else timestamp # also accepts a datetime
         self.node = None
+        self.edge_point = None # (edge index, offset along edge) if placed on a road segment (rtree.EdgeRTree)
 
     def __eq__(self, other) -> bool:
         return isinstance(self, Person) and isinstance(other, Person) and self.id == other.id
@@ -195,67 +295,139 @@ class Person(NotUberObject):
 
         lat, lon = coords
         num_partitions, minlat, maxlat, minlon, maxlon = grid_params
-        lat_idx, lon_idx = math.floor( math.ceil(math.sqrt(num_partitions))*(lat - minlat) / (maxlat - minlat) ), math.floor( math.ceil(math.sqrt(num_partitions))*(lon - minlon) / (maxlon - minlon) )
+        dim = math.ceil(math.sqrt(num_partitions)) # Grid is dim x dim
+        lat_idx, lon_idx = math.floor( dim*(lat - minlat) / (maxlat - minlat) ), math.floor( dim*(lon - minlon) / (maxlon - minlon) )
 
         # Edge cases
-        if lat_idx >= 30:
-            lat_idx = 29
+        if lat_idx >= dim:
+            lat_idx = dim - 1
         elif lat_idx < 0:
             lat_idx = 0
-        if lon_idx >= 30:
-            lon_idx = 29
+        if lon_idx >= dim:
+            lon_idx = dim - 1
         elif lon_idx < 0:
             lon_idx = 0
 
         # Index of subpartition in grid matrix
         return (lat_idx, lon_idx)
     
-    def grid_search(self, idx1, idx2, n):
+    def grid_search(self, idx1, idx2, n, dim = 30):
 
         surrounding_grid = []
         for i in range(-n, n+1):
-            if(idx1+i >= 30):
+            if(idx1+i >= dim):
                 continue
             for j in range(-n, n+1):
-                if(idx2+j >= 30):
+                if(idx2+j >= dim):
                     continue
                 surrounding_grid.append((abs(idx1+i), abs(idx2+j)))
         
         return list(set(surrounding_grid))
     
-    def assign_node(self, coords: tuple = None, grid: list = None, grid_params: list = None) -> Node:
+    def assign_node(self, coords: tuple = None, grid: list = None, grid_params: list = None, component: int = None) -> Node:
         '''
         Assign Person to nearest node given coordinates and partition grid
             - - coods: Lat/lon coordinates of object to be partitioned
-            - grid: nodes in graph grouped by subpartition
-            - grid_params: [num_partitions, minlat, maxlat, minlon, maxlon]
+            - grid: nodes in graph grouped by subpartition, or a spatial index with get_kNN (KDTree/QuadTree)
+            - grid_params: [num_partitions, minlat, maxlat, minlon, maxlon] (unused for spatial indexes)
+            - component: only assign nodes of this strongly connected component (grid only, build spatial indexes
+                         from those nodes instead), so people aren't placed on dead ends they can't leave
         '''
 
+        if hasattr(grid, 'get_kNN'): # Spatial index, no search ring to widen
+            _, nearest_node = grid.get_kNN(1, coords)[0]
+            return nearest_node
+
         lat_idx, lon_idx = self.partition(coords, grid_params) # Get subpartition of object
+        dim = len(grid)
 
         # Get surrounding subpartitions (max 3x3 grid surrounding subpartition)
         nodes = []
         n = 1
         while not nodes:
-            search_space = self.grid_search(lat_idx, lon_idx, n)
+            search_space = self.grid_search(lat_idx, lon_idx, n, dim)
             for idx1, idx2 in search_space:
-                nodes.extend(grid[idx1][idx2])
+                nodes.extend(grid[idx1][idx2] if component is None else [node for node in grid[idx1][idx2] if node.component == component])
             n += 1
 
-        # Find nearest node
+        # Find nearest node (to coords, which may be a passenger's end coords)
+        xy = geo.project(*coords)
         nearest_node = None
         min_dist = float('inf')
         for node in nodes:
-            if math.sqrt((self.coords[0] - node.coords[0])**2 + (self.coords[1] - node.coords[1])**2) < min_dist:
+            dist = geo.euclidean(xy, node.xy)
+            if dist < min_dist:
                 nearest_node = node
-                min_dist = math.sqrt((self.coords[0] - node.coords[0])**2 + (self.coords[1] - node.coords[1])**2)
+                min_dist = dist
 
         return nearest_node
 
+class Route:
+
+    def __init__(self, start_time: dt.datetime = None, start_node: Node = None) -> None:
+        '''
+        Timeline of a route: nodes passed and the time (minutes after start_time) each node is reached
+        '''
+
+        self.start_time = start_time
+        self.nodes = [start_node]
+        self.times = [0]
+
+    @property
+    def end_time(self) -> dt.datetime:
+        return self.start_time + dt.timedelta(minutes = self.times[-1])
+
+    def add_leg(self, edges: list, leg_start_time: dt.datetime, leg_minutes: float = None) -> None:
+        '''
+        Append path (list of Edge objects starting at the last node of the route) driven from leg_start_time
+            - leg_minutes: routed time of the leg if it isn't the sum of its edges (legs starting or ending mid-edge),
+                           edge times are scaled to it
+        '''
+
+        minutes = (leg_start_time - self.start_time).total_seconds() / 60
+        if edges and edges[0].start_node is not self.nodes[-1]: # e.g. no path found for the previous leg
+            self.nodes.append(edges[0].start_node)
+            self.times.append(minutes)
+        edge_times = [edge.travel_time(leg_start_time) for edge in edges] # Same travel times as routing (speeds at leg start time)
+        total = sum(edge_times)
+        scale = leg_minutes / total if leg_minutes is not None and total > 0 else 1
+        for edge, edge_time in zip(edges, edge_times):
+            minutes += edge_time * scale
+            self.nodes.append(edge.end_node)
+            self.times.append(minutes)
+
+    def position_at(self, time: dt.datetime) -> tuple:
+        '''
+        Interpolated lat/lon coordinates at a given time, O(log route length)
+        '''
+
+        minutes = (time - self.start_time).total_seconds() / 60
+        i = bisect_right(self.times, minutes) - 1
+        if i < 0:
+            return self.nodes[0].coords
+        if i >= len(self.nodes) - 1:
+            return self.nodes[-1].coords
+
+        # Fraction of the way along the edge being driven
+        frac = (minutes - self.times[i]) / (self.times[i+1] - self.times[i]) if self.times[i+1] > self.times[i] else 1
+        start, end = self.nodes[i].coords, self.nodes[i+1].coords
+        return (start[0] + frac * (end[0] - start[0]), start[1] + frac * (end[1] - start[1]))
+
 class Driver(Person):
 
     def __init__(self, id: int = None, timestamp: str = None, lat: float = None, lon: float = None) -> None:
         super().__init__(id, timestamp, lat, lon)
+        self.route = None # Route of current (or last) ride, ends at the drop off
+
+    def position_at(self, time: dt.datetime) -> tuple:
+        '''
+        Where the driver is at a given time: along its route (the drop off once it is over), or its coordinates if
+        it hasn't driven a ride yet
+        '''
+
+        if self.route is not None:
+            return self.route.position_at(time)
+        return self.coords
 
     def __eq__(self, other) -> bool:
         return isinstance(self, Driver) and isinstance(other, Driver) and self.id == other.id
@@ -268,27 +440,29 @@ class Passenger(Person):
     def __init__(self, id: int = None, timestamp: str = None, start_lat: float = None, start_lon: float = None, end_lat: float = None, end_lon: float = None, start_node: Node = None, end_node: Node = None) -> None:
         super().__init__(id, timestamp, start_lat, start_lon)
         self.end_coords = (end_lat, end_lon)
+        self.end_xy = geo.project(end_lat, end_lon) if end_lat is not None else None
 
         self.end_node = None 
+        self.end_edge_point = None
 
     def __eq__(self, other) -> bool:
         return isinstance(self, Passenger) and isinstance(other, Passenger) and self.id == other.id
 
     def euclidean_dist(self, other, time = 'start') -> float:
         '''
-        Return distance between latitude/longitude coordinates
+        Return straight line distance in miles between objects
             - Object must have coords attribute
             - time: {'start', 'end'} specifies whether you want the distance to/from the passenger's start location or end location
         '''
 
-        if not self.coords or not other.coords:
+        if self.xy is None or other.xy is None:
             print('Missing latitude/longitude coordinates')
             return
         
         if time == 'start':
-            return math.sqrt((self.coords[0] - other.coords[0])**2 + (self.coords[1] - other.coords[1])**2)
+            return geo.euclidean(self.xy, other.xy)
         if time == 'end':
-            return math.sqrt((self.end_coords[0] - other.coords[0])**2 + (self.end_coords[1] - other.coords[1])**2)
+            return geo.euclidean(self.end_xy, other.xy)
 
 class Edge:
 
@@ -309,6 +483,16 @@ class Edge:
             return 60*self.length / float(self.weekend_speeds[hour])
         else:
             return 60*self.length / float(self.weekday_speeds[hour])
+
+    def set_speed(self, bucket: int, mph: float) -> None:
+        '''
+        Set speed of edge in an hour bucket (0-23 weekday, 24-47 weekend)
+        '''
+
+        if bucket >= 24:
+            self.weekend_speeds[bucket - 24] = mph
+        else:
+            self.weekday_speeds[bucket] = mph
         
     def __eq__(self, other: object) -> bool:
         return (isinstance(other, self.__class__) and 
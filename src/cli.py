@@ -0,0 +1,152 @@
+'''
+notuber command line: simulations, network compilation and benchmarks behind one command.
+
+Only argparse is imported up front. Each subcommand imports the modules it needs (NumPy, the network modules, Numba on the
+first JIT search) and the network is loaded by the simulation that uses it, so `notuber --help` or `notuber bench geo`
+start without loading the road network.
+'''
+import os
+import sys
+import time
+import argparse
+
+MATCHERS = {
+    't1': 'first available driver, Manhattan distance estimates',
+    't2': 'closest driver by straight line distance',
+    't3': 'closest driver by network travel time (Dijkstra)',
+    't4': 'closest driver by network travel time (A*)',
+    't5': 'spatial indexes, live traffic, en-route dispatch, checkpoints',
+    'pooling': 'T5 network with shared rides',
+    'sharded': 'T5 sharded over Grid cells, one process per shard',
+}
+BENCHMARKS = {
+    'geo': 'scalar vs vectorized distance kernels',
+    'kernels': 'A* on Node objects vs the array kernels (Python and Numba)',
+    'pqueue': 'binary heap vs radix heap searches',
+    'rtree': 'nearest node vs nearest edge snapping',
+    'memprofile': 'memory used by the initialized T5 network state',
+    'loadgen': 'ride requests replayed against the matching service',
+    'routetrace': 'routing queries recorded with simulate --trace replayed against routers',
+}
+TABLES = {
+    'travel-times': 'traveltimes', # Grid cell to cell travel times
+    'hubs': 'hubs', # Hub travel time tables
+}
+
+
+def run_module(name: str, args: list) -> None:
+    # Runs a module's __main__ block as if started with python <name>.py args
+    import runpy
+
+    sys.argv = [name + '.py'] + list(args)
+    runpy.run_module(name, run_name = '__main__', alter_sys = True)
+
+
+def print_metrics(result: dict) -> None:
+    for key, value in result.items():
+        print(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}')
+
+
+def simulate(args) -> None:
+    if args.matcher in ('t1', 't2', 't3', 't4'):
+        if args.passengers is not None or args.kdtree or args.no_edge_snapping or args.resume or args.checkpoint or args.trace:
+            raise SystemExit(f'notuber simulate: {args.matcher} only takes --data-dir (the other options are for t5, pooling and sharded)')
+        import importlib
+
+        start = time.time()
+        importlib.import_module(args.matcher.upper()).main()
+        print(f'Simulation Runtime: {time.time() - start} seconds')
+        return
+
+    import T5
+
+    start = time.time()
+    T5.USE_QUADTREE = not args.kdtree
+    T5.USE_EDGE_SNAPPING = not args.no_edge_snapping
+    T5.DRIVERS_FILE = args.drivers or T5.DRIVERS_FILE
+    T5.PASSENGERS_FILE = args.requests or T5.PASSENGERS_FILE
+    T5.TRAFFIC_FILE = args.traffic or T5.TRAFFIC_FILE
+    if args.trace is not None:
+        if args.matcher == 'sharded':
+            raise SystemExit('notuber simulate: --trace records one process, it is not supported by the sharded matcher')
+        T5.TRACE_FILE = args.trace
+    print('Initializing...')
+    T5.initialize()
+    if args.passengers is not None:
+        T5.PASSENGERS[:] = T5.PASSENGERS[:args.passengers]
+    print(f'Finished initializing in {time.time() - start} seconds.')
+
+    start = time.time()
+    if args.matcher == 't5':
+        T5.CHECKPOINT_FILE = args.checkpoint or args.resume
+        T5.main(args.resume)
+    elif args.matcher == 'pooling':
+        import pooling
+        print_metrics(pooling.simulate())
+    else:
+        import sharded
+        print_metrics(sharded.run(args.shards or sharded.NUM_SHARDS, args.step or sharded.STEP_MINUTES, not args.inline))
+    print(f'Simulation Runtime: {time.time() - start} seconds')
+
+
+def compile_network(args) -> None:
+    start = time.time()
+    if args.tables:
+        for table in args.tables:
+            run_module(TABLES[table], [])
+        return
+
+    import T5
+    print(f'Saved network to {T5.compile_network(args.out)} in {time.time() - start} seconds')
+
+
+def bench(args) -> None:
+    run_module(args.name, args.args)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog = 'notuber', description = 'NotUber ride matching simulations on the NYC road network')
+    parser.add_argument('--data-dir', default = None, help = 'directory with node_data.json, edges.csv, drivers.csv and passengers.csv '
+                        '(default: $NOTUBER_DATA, the checkout data/ directory or ./data)')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    sim = commands.add_parser('simulate', help = 'run a matching simulation over the ride requests',
+                              description = 'Matchers: ' + '; '.join(f'{name}: {text}' for name, text in MATCHERS.items()))
+    sim.add_argument('--matcher', choices = list(MATCHERS), default = 't5')
+    sim.add_argument('--passengers', type = int, default = None, help = 'only simulate the first n passengers')
+    sim.add_argument('--drivers', default = None, help = 'drivers file in the data directory (e.g. a generated workload)')
+    sim.add_argument('--requests', default = None, help = 'passengers file in the data directory')
+    sim.add_argument('--traffic', default = None, help = 'csv of speed updates (start_id,end_id,bucket,mph)')
+    sim.add_argument('--kdtree', action = 'store_true', help = 'use KDTree and Grid instead of quadtrees')
+    sim.add_argument('--no-edge-snapping', action = 'store_true', help = 'snap people to nodes instead of road segments')
+    sim.add_argument('--trace', default = None, help = 'record every routing query to this file (replay with bench routetrace)')
+    sim.add_argument('--checkpoint', default = None, help = 't5: file to keep saving checkpoints to')
+    sim.add_argument('--resume', default = None, help = 't5: checkpoint file to continue from')
+    sim.add_argument('--shards', type = int, default = None, help = 'sharded: number of shards (default: one per CPU)')
+    sim.add_argument('--step', type = float, default = None, help = 'sharded: minutes per synchronized time step')
+    sim.add_argument('--inline', action = 'store_true', help = 'sharded: run the shards one after another in this process')
+    sim.set_defaults(func = simulate)
+
+    net = commands.add_parser('compile-network', help = 'save the network arrays loaded instead of node_data.json and edges.csv')
+    net.add_argument('--out', default = None, help = 'output file (default: network.npz in the data directory)')
+    net.add_argument('--tables', nargs = '+', choices = list(TABLES), default = None,
+                     help = 'precompute travel time tables instead (needs the full network, slow)')
+    net.set_defaults(func = compile_network)
+
+    benchmarks = commands.add_parser('bench', help = 'run a benchmark',
+                                     description = 'Benchmarks: ' + '; '.join(f'{name}: {text}' for name, text in BENCHMARKS.items()))
+    benchmarks.add_argument('name', choices = list(BENCHMARKS))
+    benchmarks.add_argument('args', nargs = argparse.REMAINDER, help = 'arguments passed to the benchmark')
+    benchmarks.set_defaults(func = bench)
+    return parser
+
+
+def main(argv: list = None) -> None:
+    args = build_parser().parse_args(argv)
+    if args.data_dir is not None:
+        os.environ['NOTUBER_DATA'] = os.path.abspath(args.data_dir) # read by loaders when first imported
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
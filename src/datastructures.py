@@ -2,12 +2,16 @@ import datetime as dt
 import math
 import heapq
 
+import numpy as np
+
 import classes
+import geo
 
 # Pre-computed values from prior pre-processing
 MIN_LAT, MIN_LON, MAX_LAT, MAX_LON = 40.49, -74.26, 40.92, -73.69
 LAT_RANGE = MAX_LAT - MIN_LAT
 LON_RANGE = MAX_LON - MIN_LON
+(MIN_X, MIN_Y), (MAX_X, MAX_Y) = geo.project(MIN_LAT, MIN_LON), geo.project(MAX_LAT, MAX_LON) # same bounds in planar miles, for KDTree and QuadTree
 GRID_WIDTH, GRID_HEIGHT = 20, 30
 
 class GridSpace:
@@ -129,10 +133,8 @@ class GridSpace:
         if intersection is None:
             print(f'Failed to find intersection between edge from {edge.start_node.coords} to {edge.end_node.coords} with region defined by lat bounds {self.lat_bounds} and lon bounds {self.lon_bounds}')
             return None
-        # Calculate length of resulting segment
-        dx = int_node.coords[0] - intersection[0]
-        dy = int_node.coords[1] - intersection[1]
-        return math.sqrt(dx*dx + dy*dy)
+        # Length of resulting segment, as the fraction of the edge up to the intersection (edge lengths are network miles)
+        return edge.length * geo.euclidean(int_node.xy, geo.project(*intersection)) / geo.euclidean(int_node.xy, ext_node.xy)
                 
         
     def calc_avg_mph(self):
@@ -163,22 +165,33 @@ class GridSpace:
     def remove_driver(self, driver):
         self.drivers.remove(driver)
         
-    def get_closest_driver(self, coords, time:dt.datetime):
+    def get_closest_driver(self, coords, time:dt.datetime, cell_eta=None):
+        '''
+        Find driver in this grid space with the smallest estimated time to reach coords
+            - cell_eta: precomputed network travel time (minutes) from this grid space to the grid space of coords.
+                        If None, the estimate is the Manhattan distance at the grid space's average speed
+        '''
         hour = time.hour
         weekday = time.isoweekday() < 6
+        mph = self.weekday_avg_mph[hour] if weekday else self.weekend_avg_mph[hour]
+        xy = geo.project(*coords)
         min_time = float('inf')
         best_driver = None
         for driver in self.drivers:
-            # use manhattan distance and current time to estimate time to arrive
-            eta = abs(driver.coords[0] - coords[0]) + abs(driver.coords[1] - coords[1])
-            eta *= self.weekday_avg_mph[hour] if weekday else self.weekend_avg_mph[hour]
-            eta *= 60 # convert to minutes
+            if cell_eta is not None:
+                eta = cell_eta
+            elif mph == float('inf'):
+                # no roads in this region, so we can't estimate travel time
+                eta = float('inf')
+            else:
+                # use manhattan distance (in miles) and average speed to estimate time to arrive
+                eta = geo.manhattan(driver.xy, xy) / mph * 60 # convert to minutes
             
             # if driver hasn't arrived yet, add time till arrival
             if driver.time > time:
                 eta += (driver.time - time).total_seconds() / 60
             
-            if eta < min_time:
+            if best_driver is None or eta < min_time or (eta == min_time and driver.id < best_driver.id): # ties go to lowest id, whatever the set order
                 min_time = eta
                 best_driver = driver
         
@@ -199,16 +212,48 @@ class Grid:
         lon = idx[1] / GRID_HEIGHT * LON_RANGE + MIN_LON
         return (lat, lon)
     
+    @staticmethod
+    def idx2cell(idx):
+        # flat index of a grid space, used to index precomputed cell tables
+        return idx[0] * GRID_HEIGHT + idx[1]
+    
+    @staticmethod
+    def cell2idx(cell):
+        return (cell // GRID_HEIGHT, cell % GRID_HEIGHT)
+    
     def __init__(self) -> None:
         self.grid = [[GridSpace(lat_idx, lon_idx) for lon_idx in range(0, GRID_HEIGHT)]
                         for lat_idx in range(0, GRID_WIDTH)]
         self.driver_count = 0
+        self.travel_times = None # optional traveltimes.CellTravelTimes table used to estimate driver ETAs
+        self.isochrones = None # optional traveltimes.CellIsochrones of travel_times, driver searches only visit cells that reach the pickup in time
+        self.occupied = np.zeros((GRID_WIDTH * GRID_HEIGHT + 7) // 8, dtype = np.uint8) # bitset of cells with drivers (packbits little bit order)
+        self.speed_profile = None # CellSpeedProfile, if speeds were calculated from a graph.ArrayGraph
+        
+    def calc_avg_speeds(self, graph = None):
+        '''
+        Calculate average speeds of every grid space
+            - graph: optional graph.ArrayGraph, if given speeds are computed with a vectorized CellSpeedProfile
+                     (and edges don't need to be added to the grid)
+        '''
+        if graph is not None:
+            self.speed_profile = CellSpeedProfile(graph)
+            self.speed_profile.apply_to(self)
+            return
         
-    def calc_avg_speeds(self):
         for lat_idx in range(GRID_WIDTH):
             for lon_idx in range(GRID_HEIGHT):
                 self.grid[lat_idx][lon_idx].calc_avg_mph()
     
+    def update_speeds(self, edge_idx, new_speeds):
+        '''
+        Change speeds of a subset of edges and refresh average speeds of only the affected grid spaces
+        (requires speeds calculated from a graph, see calc_avg_speeds). Returns affected flat cell indices
+        '''
+        cells = self.speed_profile.update_speeds(edge_idx, new_speeds)
+        self.speed_profile.apply_to(self, cells)
+        return cells
+    
     def add_node(self, node) -> None:
         self.get_grid_space(node.coords).add_node(node)
         
@@ -221,25 +266,73 @@ class Grid:
         idx = Grid.coord2idx(coords)
         return self.grid[idx[0]][idx[1]]
     
+    def set_occupied(self, coords) -> None:
+        # keep the bit of the grid space containing coords in sync with its driver set
+        idx = Grid.coord2idx(coords)
+        cell = Grid.idx2cell(idx)
+        if self.grid[idx[0]][idx[1]].drivers:
+            self.occupied[cell >> 3] |= 1 << (cell & 7)
+        else:
+            self.occupied[cell >> 3] &= ~(1 << (cell & 7)) & 0xFF
+    
     def add_driver(self, driver) -> None:
         self.driver_count += 1
         coords = driver.coords #if driver.node is None else driver.node.coords
         self.get_grid_space(coords).add_driver(driver)
+        self.set_occupied(coords)
     
     def remove_driver(self, driver):
         self.driver_count -= 1
         coords = driver.coords #if driver.node is None else driver.node.coords
         self.get_grid_space(coords).remove_driver(driver)
+        self.set_occupied(coords)
         
     def move_driver_to(self, driver:classes.Driver, coords):
         self.get_grid_space(driver.coords).remove_driver(driver)
+        self.set_occupied(driver.coords)
         driver.coords = coords
         self.get_grid_space(coords).add_driver(driver)
+        self.set_occupied(coords)
     
+    def get_closest_driver_isochrones(self, coords, time):
+        '''
+        Search only cells that reach the pickup in time: occupied cells are intersected with the isochrone bitset of
+        the pickup cell, smallest threshold first. A driver found with ETA <= threshold is the best of the whole grid,
+        every cell left out is known to be further (the floodfill takes the nearest ring with any driver, even across a river).
+        
+        Returns (eta, driver), None if the hour bucket isn't computed or no driver is within the largest threshold
+        '''
+        bucket = classes.hour_bucket(time)
+        if not self.isochrones.computed[bucket]:
+            return None
+        query_idx = Grid.coord2idx(coords)
+        query_cell = Grid.idx2cell(query_idx)
+        searched = set()
+        min_time = float('inf')
+        best_driver = None
+        for k, minutes in enumerate(self.isochrones.minutes):
+            for cell in self.isochrones.candidate_cells(query_cell, bucket, k, self.occupied).tolist():
+                if cell in searched: continue
+                searched.add(cell)
+                idx = Grid.cell2idx(cell)
+                cell_eta = None if cell == query_cell else self.isochrones.travel_times.cell_time(cell, query_cell, time)
+                eta, driver = self.grid[idx[0]][idx[1]].get_closest_driver(coords, time, cell_eta)
+                if driver is not None and (best_driver is None or eta < min_time or (eta == min_time and driver.id < best_driver.id)):
+                    min_time = eta
+                    best_driver = driver
+            if min_time <= minutes:
+                return (min_time, best_driver)
+        return None
         
     def get_closest_driver(self, coords, time) -> classes.Driver:
+        if self.isochrones is not None:
+            found = self.get_closest_driver_isochrones(coords, time)
+            if found is not None:
+                return found
+        
         # perform floodfill on grid searching for best driver
-        idx_to_search = [Grid.coord2idx(coords)]
+        query_idx = Grid.coord2idx(coords)
+        idx_to_search = [query_idx]
         visited = set()
         
         min_time = float('inf')
@@ -253,8 +346,11 @@ class Grid:
                 visited.add(idx)
                 
                 # search this gridspace for closest driver
-                eta, driver = self.grid[idx[0]][idx[1]].get_closest_driver(coords, time)
-                if eta < min_time:
+                cell_eta = None
+                if self.travel_times is not None and idx != query_idx:
+                    cell_eta = self.travel_times.cell_time(Grid.idx2cell(idx), Grid.idx2cell(query_idx), time)
+                eta, driver = self.grid[idx[0]][idx[1]].get_closest_driver(coords, time, cell_eta)
+                if driver is not None and (best_driver is None or eta < min_time or (eta == min_time and driver.id < best_driver.id)): # even if unreachable (inf)
                     min_time = eta
                     best_driver = driver
                 
@@ -276,39 +372,147 @@ class Grid:
 
 
 
+class OngoingRides:
+    '''
+    Min-heap of busy drivers (on a ride, or not started yet) keyed by the time they become available.
+    Drivers only go back into the spatial index when their ride is over, so matching only scans idle drivers.
+    '''
+    
+    def __init__(self) -> None:
+        self.heap = [] # (available time, driver id, driver), id breaks ties so drivers are never compared
+    
+    def __len__(self) -> int:
+        return len(self.heap)
+    
+    def push(self, driver) -> None:
+        heapq.heappush(self.heap, (driver.time, driver.id, driver))
+    
+    def peek_time(self) -> dt.datetime:
+        return self.heap[0][0]
+    
+    def pop(self):
+        # driver that becomes available soonest
+        return heapq.heappop(self.heap)[2]
+    
+    def pop_completed(self, time: dt.datetime) -> list:
+        # all drivers available at time
+        drivers = []
+        while self.heap and self.heap[0][0] <= time:
+            drivers.append(heapq.heappop(self.heap)[2])
+        return drivers
+
+
+class CellSpeedProfile:
+    '''
+    Length-weighted average speed of every grid space for every hour bucket, computed with NumPy over ArrayGraph edges.
+    
+    Like Grid.add_edge, each edge is split between the grid space of its start node and the grid space of its end node
+    at the point where it leaves the start grid space. Weighted speed sums are kept so a subset of edge speeds can be
+    changed (e.g. live traffic) without recomputing every grid space.
+    '''
+    
+    def __init__(self, graph) -> None:
+        self.graph = graph
+        
+        lat_idx, lon_idx = CellSpeedProfile.coords2idx(graph.lat, graph.lon)
+        start_lat, start_lon = lat_idx[graph.edge_start], lon_idx[graph.edge_start]
+        self.start_cell = start_lat * GRID_HEIGHT + start_lon
+        self.end_cell = lat_idx[graph.edge_end] * GRID_HEIGHT + lon_idx[graph.edge_end]
+        
+        # Fraction of each edge inside its start grid space: segment parameter where it crosses the start grid space boundary
+        x0, y0 = graph.lat[graph.edge_start], graph.lon[graph.edge_start]
+        dx, dy = graph.lat[graph.edge_end] - x0, graph.lon[graph.edge_end] - y0
+        min_lat = start_lat / GRID_WIDTH * LAT_RANGE + MIN_LAT
+        min_lon = start_lon / GRID_HEIGHT * LON_RANGE + MIN_LON
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            tx = np.where(dx > 0, (min_lat + LAT_RANGE / GRID_WIDTH - x0) / dx, np.where(dx < 0, (min_lat - x0) / dx, np.inf))
+            ty = np.where(dy > 0, (min_lon + LON_RANGE / GRID_HEIGHT - y0) / dy, np.where(dy < 0, (min_lon - y0) / dy, np.inf))
+        fraction = np.clip(np.minimum(tx, ty), 0, 1)
+        fraction[self.start_cell == self.end_cell] = 1
+        
+        lengths = graph.lengths.astype(np.float64)
+        self.start_length = fraction * lengths # length of edge in start grid space
+        self.end_length = lengths - self.start_length # length of edge in end grid space
+        
+        num_cells = GRID_WIDTH * GRID_HEIGHT
+        self.total_length = (np.bincount(self.start_cell, self.start_length, minlength = num_cells) +
+                             np.bincount(self.end_cell, self.end_length, minlength = num_cells))
+        self.weighted_speeds = np.zeros((num_cells, graph.speeds.shape[1]))
+        for bucket in range(graph.speeds.shape[1]):
+            self.weighted_speeds[:, bucket] = (np.bincount(self.start_cell, self.start_length * graph.speeds[:, bucket], minlength = num_cells) +
+                                               np.bincount(self.end_cell, self.end_length * graph.speeds[:, bucket], minlength = num_cells))
+    
+    @staticmethod
+    def coords2idx(lat, lon):
+        # vectorized Grid.coord2idx
+        lat_idx = np.clip(np.floor((lat - MIN_LAT) / LAT_RANGE * GRID_WIDTH).astype(np.int64), 0, GRID_WIDTH-1)
+        lon_idx = np.clip(np.floor((lon - MIN_LON) / LON_RANGE * GRID_HEIGHT).astype(np.int64), 0, GRID_HEIGHT-1)
+        return lat_idx, lon_idx
+    
+    def avg_mph(self) -> np.ndarray:
+        '''
+        (num grid spaces x NUM_BUCKETS) average speeds, inf for grid spaces without edges (same as GridSpace.calc_avg_mph)
+        '''
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            avg = self.weighted_speeds / self.total_length[:, None]
+        avg[self.total_length == 0] = float('inf')
+        return avg
+    
+    def update_speeds(self, edge_idx, new_speeds) -> np.ndarray:
+        '''
+        Set speeds of a subset of edges in the graph and update the weighted sums incrementally
+            - edge_idx: (k,) edge indices
+            - new_speeds: (k x NUM_BUCKETS) new speeds
+        
+        Returns indices of grid spaces whose average speeds changed
+        '''
+        edge_idx = np.asarray(edge_idx, dtype = np.int64)
+        new_speeds = np.asarray(new_speeds, dtype = self.graph.speeds.dtype)
+        delta = new_speeds.astype(np.float64) - self.graph.speeds[edge_idx]
+        self.graph.speeds[edge_idx] = new_speeds
+        
+        np.add.at(self.weighted_speeds, self.start_cell[edge_idx], self.start_length[edge_idx, None] * delta)
+        np.add.at(self.weighted_speeds, self.end_cell[edge_idx], self.end_length[edge_idx, None] * delta)
+        return np.union1d(self.start_cell[edge_idx], self.end_cell[edge_idx])
+    
+    def apply_to(self, grid, cells = None) -> None:
+        '''
+        Copy average speeds into the GridSpace objects of grid (only the given flat cell indices if cells is not None)
+        '''
+        avg = self.avg_mph()
+        if cells is None:
+            cells = range(GRID_WIDTH * GRID_HEIGHT)
+        for cell in cells:
+            grid_space = grid.grid[cell // GRID_HEIGHT][cell % GRID_HEIGHT]
+            grid_space.weekday_avg_mph = avg[cell, :24].tolist()
+            grid_space.weekend_avg_mph = avg[cell, 24:].tolist()
+            grid_space.total_length = self.total_length[cell]
+
+
 class KDTree:
+    '''
+    Splits nodes on their planar mile coordinates (node.xy, see geo), alternating x (lat) and y (lon).
+    Queries take lat/lon coords and distances returned are miles.
+    '''
     left = None
     right = None
     nodes = None # if at leaf, this contains all nodes in this region
     depth = 0
     
     split_val = None
-    x_bounds = None
-    y_bounds = None
+    box = None # (minx, maxx, miny, maxy) in planar miles
     
     @staticmethod
     def selector(depth:int): return int(depth % 2 != 0)
-    @staticmethod
-    def dist(coord1, coord2):
-        # Euclidean distance
-        d1 = coord2[0] - coord1[0]
-        d2 = coord2[1] - coord1[1]
-        return math.sqrt(d1*d1 + d2*d2)
-    @staticmethod
-    def dist_to_rect(point, rect_x_bounds, rect_y_bounds):
-        dx = max(rect_x_bounds[0] - point[0], 0, point[0] - rect_x_bounds[1])
-        dy = max(rect_y_bounds[0] - point[1], 0, point[1] - rect_y_bounds[1])
-        return math.sqrt(dx*dx + dy*dy)
     
     # return the distance from the bounds of this region and a point
     def dist_to_point(self, point):
-        return KDTree.dist_to_rect(point, self.x_bounds, self.y_bounds)
+        return geo.box_euclidean(point, self.box)
     
     def __init__(self, nodes, depth: int, max_depth: int,
-                 minx=MIN_LAT, maxx=MAX_LAT, miny=MIN_LON, maxy=MAX_LON) -> None:
+                 minx=MIN_X, maxx=MAX_X, miny=MIN_Y, maxy=MAX_Y) -> None:
         self.depth = depth
-        self.x_bounds = (minx, maxx)
-        self.y_bounds = (miny, maxy)
+        self.box = (minx, maxx, miny, maxy)
         
         # If reached max split depth, make leaf
         if depth >= max_depth:
@@ -318,10 +522,10 @@ class KDTree:
         # Select lat if even depth, lon if odd depth
         selector = KDTree.selector(depth)
         
-        sorted_nodes = sorted(nodes, key=lambda x: x.coords[selector])
+        sorted_nodes = sorted(nodes, key=lambda x: x.xy[selector])
         
         median = int(len(sorted_nodes) / 2)
-        self.split_val = sorted_nodes[median].coords[selector]
+        self.split_val = sorted_nodes[median].xy[selector]
         #print(f'Split on {"lon" if selector else "lat"} at {self.split_val}')
         
         left_nodes = sorted_nodes[:median]
@@ -355,7 +559,7 @@ class KDTree:
             for node in self.nodes:
                 #seen_nodes.append(node)
                 
-                d = KDTree.dist(node.coords, query_coords)
+                d = geo.euclidean(node.xy, query_coords)
                 # If closer, or heap not filled, add new point
                 if len(k_closest_heap) < k or d < -k_closest_heap[0][0]:
                     heapq.heappush(k_closest_heap, (-d, node))
@@ -397,6 +601,180 @@ class KDTree:
     def get_kNN(self, k, query_coords):
         #search_list = []
         knn_list = []
-        self.kNN_helper(k, query_coords, knn_list)#, search_list)
+        self.kNN_helper(k, geo.project(*query_coords), knn_list)#, search_list)
         return knn_list#, search_list
-    
\ No newline at end of file
+    
+
+
+class QuadTree:
+    '''
+    Adaptive quadtree partition for objects with coords (nodes or drivers).
+    A leaf splits into four quadrants once it holds more than capacity objects, so dense regions get
+    small cells and sparse regions stay as one large cell. Each leaf holds at most capacity objects
+    (unless max depth is reached), so lookups cost the same regardless of local density.
+    
+    Has the same kNN interface as KDTree and the same driver interface as Grid.
+    Objects are placed by their planar mile coordinates (obj.xy, see geo), so distances and ETAs need no conversion.
+    '''
+    MAX_DEPTH = 24 # stop splitting when many objects share the same coordinates
+    
+    def __init__(self, objects=(), capacity: int = 32, depth: int = 0,
+                 minx=MIN_X, maxx=MAX_X, miny=MIN_Y, maxy=MAX_Y, avg_mph=None) -> None:
+        self.capacity = capacity
+        self.depth = depth
+        self.x_bounds = (minx, maxx) # quadrant this tree is responsible for
+        self.y_bounds = (miny, maxy)
+        self.box = [float('inf'), float('-inf'), float('inf'), float('-inf')] # bounding box of objects ever inserted (objects may lie outside quadrant at the root)
+        self.avg_mph = avg_mph # speed used to convert distance into driver ETA
+        
+        self.objects = [] # objects in this region if leaf
+        self.children = None
+        self.count = 0
+        
+        for obj in objects:
+            self.insert(obj)
+    
+    @property
+    def driver_count(self):
+        return self.count
+    
+    def dist_to_point(self, point):
+        return geo.box_euclidean(point, self.box)
+    
+    def manhattan_to_point(self, point):
+        # Manhattan distance in miles from point to bounding box
+        return geo.box_manhattan(point, self.box)
+    
+    def child_for(self, xy):
+        midx = (self.x_bounds[0] + self.x_bounds[1]) / 2
+        midy = (self.y_bounds[0] + self.y_bounds[1]) / 2
+        return self.children[2 * (xy[0] >= midx) + (xy[1] >= midy)]
+    
+    def split(self):
+        minx, maxx = self.x_bounds
+        miny, maxy = self.y_bounds
+        midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+        self.children = [QuadTree((), self.capacity, self.depth+1, minx, midx, miny, midy),
+                         QuadTree((), self.capacity, self.depth+1, minx, midx, midy, maxy),
+                         QuadTree((), self.capacity, self.depth+1, midx, maxx, miny, midy),
+                         QuadTree((), self.capacity, self.depth+1, midx, maxx, midy, maxy)]
+        for obj in self.objects:
+            self.child_for(obj.xy).insert(obj)
+        self.objects = []
+    
+    def insert(self, obj) -> None:
+        x, y = obj.xy
+        self.count += 1
+        self.box[0], self.box[1] = min(self.box[0], x), max(self.box[1], x)
+        self.box[2], self.box[3] = min(self.box[2], y), max(self.box[3], y)
+        
+        if self.children is not None:
+            self.child_for(obj.xy).insert(obj)
+            return
+        
+        self.objects.append(obj)
+        if len(self.objects) > self.capacity and self.depth < QuadTree.MAX_DEPTH:
+            self.split()
+    
+    def remove(self, obj) -> None:
+        # obj.xy must be the coordinates it was inserted with
+        if self.children is None:
+            self.objects.remove(obj)
+            self.count -= 1
+            return
+        
+        self.child_for(obj.xy).remove(obj)
+        self.count -= 1
+        
+        # merge children back into a leaf once they are sparse again
+        if self.count <= self.capacity // 2:
+            objects = []
+            stack = list(self.children)
+            while stack:
+                tree = stack.pop()
+                if tree.children is None: objects.extend(tree.objects)
+                else: stack.extend(tree.children)
+            self.children = None
+            self.objects = objects
+    
+    def leaves(self):
+        if self.children is None:
+            yield self
+            return
+        for child in self.children:
+            yield from child.leaves()
+    
+    def get_kNN(self, k, query_coords):
+        '''
+        Best-first search over tree regions ordered by distance to query_coords.
+        Returns list of (-dist, object) in heap order, like KDTree.get_kNN
+        '''
+        query_coords = geo.project(*query_coords)
+        k_closest_heap = [] # (-dist, tiebreak, object), tiebreak keeps objects from being compared
+        regions = [(0, 0, self)]
+        counter = 1
+        while regions:
+            bound, _, tree = heapq.heappop(regions)
+            if len(k_closest_heap) >= k and bound >= -k_closest_heap[0][0]:
+                break
+            
+            if tree.children is None:
+                for obj in tree.objects:
+                    d = geo.euclidean(obj.xy, query_coords)
+                    if len(k_closest_heap) < k or d < -k_closest_heap[0][0]:
+                        heapq.heappush(k_closest_heap, (-d, counter, obj))
+                        counter += 1
+                        if len(k_closest_heap) > k: heapq.heappop(k_closest_heap)
+                continue
+            
+            for child in tree.children:
+                if child.count > 0:
+                    heapq.heappush(regions, (child.dist_to_point(query_coords), counter, child))
+                    counter += 1
+        
+        return [(d, obj) for d, _, obj in k_closest_heap]
+    
+    # Driver interface (same as Grid)
+    def add_driver(self, driver) -> None:
+        self.insert(driver)
+    
+    def remove_driver(self, driver) -> None:
+        self.remove(driver)
+    
+    def move_driver_to(self, driver:classes.Driver, coords):
+        self.remove(driver)
+        driver.coords = coords
+        self.insert(driver)
+    
+    def get_closest_driver(self, coords, time:dt.datetime):
+        '''
+        Best-first search for driver with smallest estimated time to reach coords
+        (Manhattan distance at avg_mph, plus time until driver is available)
+        '''
+        xy = geo.project(*coords)
+        min_time = float('inf')
+        best_driver = None
+        regions = [(0, 0, self)]
+        counter = 1
+        while regions:
+            bound, _, tree = heapq.heappop(regions)
+            if bound > min_time: # regions at exactly min_time may hold a tie with a lower id
+                break
+            
+            if tree.children is None:
+                for driver in tree.objects:
+                    eta = geo.manhattan(driver.xy, xy) / self.avg_mph * 60
+                    # if driver hasn't arrived yet, add time till arrival
+                    if driver.time > time:
+                        eta += (driver.time - time).total_seconds() / 60
+                    if best_driver is None or eta < min_time or (eta == min_time and driver.id < best_driver.id): # ties go to lowest id, whatever the tree shape
+                        min_time = eta
+                        best_driver = driver
+                continue
+            
+            for child in tree.children:
+                if child.count > 0:
+                    heapq.heappush(regions, (child.manhattan_to_point(xy) / self.avg_mph * 60, counter, child))
+                    counter += 1
+        
+        return (min_time, best_driver)
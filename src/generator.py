@@ -0,0 +1,137 @@
+import os
+import time
+import argparse
+
+import numpy as np
+
+import classes
+import loaders
+import simconfig
+from datastructures import QuadTree
+
+DATA_DIR = loaders.DATA_DIR
+KNN = 16 # Nearby nodes a sampled point can land on
+TIME_JITTER = 5 # Minutes, sampled times are spread this much around the sampled request time
+CHUNK_ROWS = loaders.CHUNK_ROWS # Rows generated and written at a time
+
+### Binary record formats (epoch seconds, coordinates of the snapped nodes and their ids)
+DRIVER_DTYPE = np.dtype([('time', '<i8'), ('lat', '<f8'), ('lon', '<f8'), ('node', '<i8')])
+PASSENGER_DTYPE = np.dtype([('time', '<i8'), ('lat', '<f8'), ('lon', '<f8'), ('end_lat', '<f8'), ('end_lon', '<f8'),
+                            ('node', '<i8'), ('end_node', '<i8')])
+
+
+class Sampler:
+    '''
+    Spatio-temporal distribution of drivers.csv or passengers.csv, snapped to the road network.
+
+    A sampled row takes the time of a random row of the file (jittered by up to TIME_JITTER minutes) and, for each of
+    its points (driver location, or pickup and drop off), one of the k nodes nearest to that row's point. Every point
+    is a node, so generated workloads need no snapping.
+        - node_index: QuadTree or KDTree over Node objects
+    '''
+
+    def __init__(self, path: str, node_index, k: int = KNN) -> None:
+        with open(path, 'r') as f:
+            self.header = f.readline().strip()
+        self.times, coords = loaders.load_people(path)
+        self.num_points = coords.shape[1] // 2 # 1 for drivers, 2 for passengers
+
+        # k nearest nodes of every point in the file: (rows x k) node ids and coordinates
+        self.node_ids, self.lat, self.lon = [], [], []
+        for p in range(self.num_points):
+            neighbors = [[node for _, node in node_index.get_kNN(k, (lat, lon))] for lat, lon in coords[:, 2*p:2*p+2].tolist()]
+            self.node_ids.append(np.array([[int(node.id) for node in row] for row in neighbors], dtype = np.int64))
+            self.lat.append(np.array([[node.coords[0] for node in row] for row in neighbors], dtype = np.float64))
+            self.lon.append(np.array([[node.coords[1] for node in row] for row in neighbors], dtype = np.float64))
+
+    @property
+    def dtype(self) -> np.dtype:
+        return PASSENGER_DTYPE if self.num_points == 2 else DRIVER_DTYPE
+
+    def sample_times(self, n: int, rng: np.random.Generator):
+        '''
+        Returns (times, source rows) of n sampled rows, sorted by time
+        '''
+
+        rows = rng.integers(0, len(self.times), n)
+        times = self.times[rows] + rng.integers(-TIME_JITTER * 60, TIME_JITTER * 60 + 1, n)
+        order = np.argsort(times, kind = 'stable')
+        return times[order], rows[order]
+
+    def sample_points(self, rows, rng: np.random.Generator) -> np.ndarray:
+        '''
+        Records (see DRIVER_DTYPE / PASSENGER_DTYPE, time left at 0) with points sampled around the given source rows
+        '''
+
+        records = np.zeros(len(rows), dtype = self.dtype)
+        fields = [('lat', 'lon', 'node'), ('end_lat', 'end_lon', 'end_node')]
+        for p in range(self.num_points):
+            k = rng.integers(0, self.node_ids[p].shape[1], len(rows))
+            lat_field, lon_field, node_field = fields[p]
+            records[lat_field] = self.lat[p][rows, k]
+            records[lon_field] = self.lon[p][rows, k]
+            records[node_field] = self.node_ids[p][rows, k]
+        return records
+
+    def generate(self, n: int, path: str, rng: np.random.Generator, chunk_rows: int = CHUNK_ROWS) -> None:
+        '''
+        Stream n sampled rows, sorted by time, to path: .npy for binary records, otherwise csv in the source file's format
+        '''
+
+        times, rows = self.sample_times(n, rng)
+        binary = path.endswith('.npy')
+        if binary:
+            out = np.lib.format.open_memmap(path, mode = 'w+', dtype = self.dtype, shape = (n,))
+        else:
+            out = open(path, 'w')
+            out.write(self.header + '\n')
+
+        coord_fields = ['lat', 'lon', 'end_lat', 'end_lon'][:2 * self.num_points]
+        for start in range(0, n, chunk_rows):
+            records = self.sample_points(rows[start:start+chunk_rows], rng)
+            records['time'] = times[start:start+chunk_rows]
+            if binary:
+                out[start:start+len(records)] = records
+                continue
+            columns = [loaders.format_timestamps(records['time'])] + [records[field].tolist() for field in coord_fields]
+            out.write(''.join(','.join(map(str, row)) + '\n' for row in zip(*columns)))
+
+        if binary:
+            out.flush()
+        else:
+            out.close()
+
+
+def load_records(path: str) -> np.ndarray:
+    '''
+    Memory map a generated .npy workload
+    '''
+
+    return np.load(path, mmap_mode = 'r')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate drivers/passengers sampled from drivers.csv and passengers.csv')
+    parser.add_argument('--scale', type = float, default = 10, help = 'multiple of the shipped number of drivers and passengers')
+    parser.add_argument('--drivers', type = int, default = None, help = 'number of drivers (overrides scale)')
+    parser.add_argument('--passengers', type = int, default = None, help = 'number of passengers (overrides scale)')
+    parser.add_argument('--format', choices = ['csv', 'npy'], default = 'npy')
+    parser.add_argument('--seed', type = int, default = simconfig.SEED)
+    parser.add_argument('--out', default = DATA_DIR, help = 'output directory')
+    args = parser.parse_args()
+
+    START = time.time()
+    node_ids, node_lats, node_lons = loaders.load_nodes(os.path.join(DATA_DIR, 'node_data.json'))
+    graph = loaders.load_edge_graph(node_ids, node_lats, node_lons, os.path.join(DATA_DIR, 'edges.csv'))
+    main = graph.strongly_connected_components() == graph.main_component # only sample nodes every other node can be reached from
+    node_index = QuadTree([classes.Node(id = node_id, lat = lat, lon = lon)
+                           for node_id, lat, lon in zip(node_ids[main].tolist(), node_lats[main].tolist(), node_lons[main].tolist())])
+    rng = np.random.default_rng(args.seed)
+
+    for name, count in (('drivers', args.drivers), ('passengers', args.passengers)):
+        sampler = Sampler(os.path.join(DATA_DIR, f'{name}.csv'), node_index)
+        n = count if count is not None else int(round(len(sampler.times) * args.scale))
+        path = os.path.join(args.out, f'{name}_{n}.{args.format}')
+        sampler.generate(n, path, rng)
+        print(f'Wrote {n} {name} to {path}')
+    print(f'Finished in {time.time() - START} seconds')
@@ -0,0 +1,137 @@
+import math
+
+import numpy as np
+
+### Based on sampling two points in NYC and calculating lat/lon mile distance. Both are ~13% below the true miles per
+### degree at NYC's latitude (69.0 and 52.3), with the same ratio, so nearest neighbours and shapes are exact and distances
+### are biased low on purpose: the A* heuristic (straight line miles at the network average speed, Node.shortest_path_a_star
+### and kernels) then overestimates less often. With true miles A* returns longer routes (T5 on 1500 passengers: average
+### wait 41.1 -> 45.3 minutes). Use haversine_many for real distances
+LON2MI = 45.5
+LAT2MI = 60.0
+EARTH_RADIUS_MI = 3958.8
+
+
+def project(lat, lon) -> tuple:
+    '''
+    Planar mile coordinates (x, y) = (lat * LAT2MI, lon * LON2MI) of scalars or arrays.
+    Objects keep these next to their lat/lon (NotUberObject.xy, graph.ArrayGraph.x/y), so distance kernels and
+    search loops never convert degrees again
+    '''
+
+    return (lat * LAT2MI, lon * LON2MI)
+
+
+def unproject(x, y) -> tuple:
+    return (x / LAT2MI, y / LON2MI)
+
+
+### Scalar kernels on planar (x, y) tuples, for Python loops (math on floats beats NumPy on single points)
+
+def euclidean(a: tuple, b: tuple) -> float:
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def manhattan(a: tuple, b: tuple) -> float:
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+def box_euclidean(point: tuple, box: tuple) -> float:
+    '''
+    Distance from a point to a box (minx, maxx, miny, maxy), 0 inside
+    '''
+
+    dx = max(box[0] - point[0], 0, point[0] - box[1])
+    dy = max(box[2] - point[1], 0, point[1] - box[3])
+    return math.hypot(dx, dy)
+
+
+def box_manhattan(point: tuple, box: tuple) -> float:
+    dx = max(box[0] - point[0], 0, point[0] - box[1])
+    dy = max(box[2] - point[1], 0, point[1] - box[3])
+    return dx + dy
+
+
+### Vectorized kernels: points are (..., 2) arrays that broadcast against each other, so the same kernel is
+### one-to-one, one-to-many (a point against an (N, 2) array) or many-to-many (see pairwise)
+
+def euclidean_many(a, b) -> np.ndarray:
+    d = np.asarray(a, dtype = np.float64) - np.asarray(b, dtype = np.float64)
+    return np.hypot(d[..., 0], d[..., 1])
+
+
+def manhattan_many(a, b) -> np.ndarray:
+    d = np.abs(np.asarray(a, dtype = np.float64) - np.asarray(b, dtype = np.float64))
+    return d[..., 0] + d[..., 1]
+
+
+def box_euclidean_many(points, boxes) -> tuple:
+    '''
+    Smallest (0 inside) and largest distance from points to boxes (..., 4) = [minx, miny, maxx, maxy]
+    '''
+
+    points, boxes = np.asarray(points, dtype = np.float64), np.asarray(boxes, dtype = np.float64)
+    lo, hi = boxes[..., 0:2], boxes[..., 2:4]
+    near = np.maximum(np.maximum(lo - points, points - hi), 0)
+    far = np.maximum(points - lo, hi - points)
+    return euclidean_many(near, 0), euclidean_many(far, 0)
+
+
+def segment_euclidean_many(points, a, b) -> tuple:
+    '''
+    Distance from points to the segments a -> b, and where the closest point is along each segment (0 at a, 1 at b)
+
+    Returns (offsets, distances)
+    '''
+
+    points, a, b = np.asarray(points, dtype = np.float64), np.asarray(a, dtype = np.float64), np.asarray(b, dtype = np.float64)
+    d = b - a
+    length2 = d[..., 0]**2 + d[..., 1]**2
+    t = np.clip(((points - a) * d).sum(axis = -1) / np.where(length2 > 0, length2, 1), 0, 1)
+    return t, euclidean_many(a + t[..., None] * d, points)
+
+
+def haversine_many(a, b) -> np.ndarray:
+    '''
+    Great circle miles between lat/lon degree points (not planar coordinates)
+    '''
+
+    a, b = np.radians(np.asarray(a, dtype = np.float64)), np.radians(np.asarray(b, dtype = np.float64))
+    dlat, dlon = b[..., 0] - a[..., 0], b[..., 1] - a[..., 1]
+    h = np.sin(dlat / 2)**2 + np.cos(a[..., 0]) * np.cos(b[..., 0]) * np.sin(dlon / 2)**2
+    return 2 * EARTH_RADIUS_MI * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+KERNELS = {'euclidean': euclidean_many, 'manhattan': manhattan_many, 'haversine': haversine_many}
+
+
+def pairwise(a, b, kernel: str = 'euclidean') -> np.ndarray:
+    '''
+    (M x N) distances between every point of a (M x 2) and every point of b (N x 2)
+        - kernel: name in KERNELS (haversine takes lat/lon degrees, the others planar miles)
+    '''
+
+    if kernel not in KERNELS:
+        raise ValueError(f'Unknown distance kernel {kernel!r}, expected one of {list(KERNELS)}')
+    return KERNELS[kernel](np.asarray(a, dtype = np.float64)[:, None, :], np.asarray(b, dtype = np.float64)[None, :, :])
+
+
+if __name__ == '__main__':
+    import time
+
+    # Random points over the simulation area (datastructures bounds)
+    rng = np.random.default_rng(0)
+    coords = np.column_stack((rng.uniform(40.49, 40.92, 2000), rng.uniform(-74.26, -73.69, 2000)))
+    xy = np.column_stack(project(coords[:, 0], coords[:, 1]))
+
+    start = time.time()
+    loop = [[euclidean(a, b) for b in xy[:1000].tolist()] for a in xy[1000:].tolist()]
+    loop_seconds = time.time() - start
+    start = time.time()
+    planar = pairwise(xy[1000:], xy[:1000])
+    seconds = time.time() - start
+    great_circle = pairwise(coords[1000:], coords[:1000], 'haversine')
+
+    error = np.abs(planar - great_circle) / np.maximum(great_circle, 1e-9)
+    print(f'1000 x 1000 euclidean: {loop_seconds:.3f} s scalar, {seconds:.4f} s vectorized (max diff {np.max(np.abs(planar - np.array(loop))):.1e} miles)')
+    print(f'Planar miles vs haversine: median {np.median(error) * 100:.2f}%, max {np.max(error) * 100:.2f}% relative difference (biased low on purpose, see LAT2MI)')
@@ -0,0 +1,260 @@
+import numpy as np
+
+import classes
+import pqueue
+import geo
+
+
+class ArrayGraph:
+    '''
+    Compact array representation of the road network (CSR adjacency)
+        - node_ids: (N,) original node ids, position in array is the node index
+        - lat, lon: (N,) node coordinates
+        - x, y: (N,) planar mile coordinates of the nodes (geo.project), for distance kernels and heuristics
+        - indptr: (N+1,) edges leaving node i are edges indptr[i]:indptr[i+1]
+        - edge_start, edge_end: (E,) node indices of each edge, sorted by start node
+        - lengths: (E,) edge lengths in miles
+        - speeds: (E x NUM_BUCKETS) edge speeds in mph, columns in hour bucket order (weekday 0-23, weekend 0-23)
+        - component: (N,) strongly connected component of each node, once computed (see strongly_connected_components)
+    '''
+
+    def __init__(self, node_ids, lat, lon, edge_start, edge_end, lengths, speeds) -> None:
+        self.node_ids = np.asarray(node_ids, dtype = np.int64)
+        self.lat = np.asarray(lat, dtype = np.float64)
+        self.lon = np.asarray(lon, dtype = np.float64)
+        self.x, self.y = geo.project(self.lat, self.lon)
+        self.node_index = {int(node_id): i for i, node_id in enumerate(self.node_ids)} # <node_id: node index>
+
+        # Sort edges by start node to build CSR offsets (no copies if edges are already grouped by start node)
+        self.edge_start = np.asarray(edge_start, dtype = np.int32)
+        self.edge_end = np.asarray(edge_end, dtype = np.int32)
+        self.lengths = np.asarray(lengths, dtype = np.float32)
+        self.speeds = np.asarray(speeds, dtype = np.float32)
+        if np.any(self.edge_start[1:] < self.edge_start[:-1]):
+            order = np.argsort(self.edge_start, kind = 'stable')
+            self.edge_start, self.edge_end = self.edge_start[order], self.edge_end[order]
+            self.lengths, self.speeds = self.lengths[order], self.speeds[order]
+        self.indptr = np.zeros(len(self.node_ids) + 1, dtype = np.int64)
+        np.cumsum(np.bincount(self.edge_start, minlength = len(self.node_ids)), out = self.indptr[1:])
+
+        self.edges = None # Edge objects in edge order, if built from Node objects
+        self.reverse_indptr = None # CSR offsets of edges grouped by end node, built on first use
+        self.reverse_order = None
+        self.component = None
+        self.main_component = None # Largest strongly connected component
+
+    def save(self, path: str) -> None:
+        '''
+        Write the network arrays (and components, if computed) to a .npz file, see load
+        '''
+
+        arrays = {'node_ids': self.node_ids, 'lat': self.lat, 'lon': self.lon, 'edge_start': self.edge_start, 'edge_end': self.edge_end,
+                  'lengths': self.lengths, 'speeds': self.speeds}
+        if self.component is not None:
+            arrays['component'] = self.component
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        '''
+        Network saved with save, without parsing node_data.json and edges.csv again
+        '''
+
+        with np.load(path) as arrays:
+            graph = cls(arrays['node_ids'], arrays['lat'], arrays['lon'], arrays['edge_start'], arrays['edge_end'], arrays['lengths'], arrays['speeds'])
+            if 'component' in arrays:
+                graph.component = arrays['component']
+                graph.main_component = int(np.argmax(np.bincount(graph.component)))
+        return graph
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edge_start)
+
+    @classmethod
+    def from_nodes(cls, nodes: dict):
+        '''
+        Build from Node objects (<node_id: Node_Object>) whose neighbors hold Edge objects.
+        Each Edge gets an index attribute pointing to its row in the edge arrays.
+        '''
+
+        node_list = list(nodes.values())
+        index = {node.id: i for i, node in enumerate(node_list)}
+        edges = [edge for node in node_list for edge in node.neighbors]
+
+        edge_start = np.fromiter((index[edge.start_node.id] for edge in edges), dtype = np.int32, count = len(edges))
+        edge_end = np.fromiter((index[edge.end_node.id] for edge in edges), dtype = np.int32, count = len(edges))
+        lengths = np.fromiter((edge.length for edge in edges), dtype = np.float32, count = len(edges))
+        speeds = np.empty((len(edges), classes.NUM_BUCKETS), dtype = np.float32)
+        for i, edge in enumerate(edges):
+            speeds[i, :24] = [float(edge.weekday_speeds[hour]) for hour in range(24)]
+            speeds[i, 24:] = [float(edge.weekend_speeds[hour]) for hour in range(24)]
+
+        graph = cls([int(node.id) for node in node_list], [node.coords[0] for node in node_list], [node.coords[1] for node in node_list],
+                    edge_start, edge_end, lengths, speeds)
+
+        # Edges were already grouped by start node, so the stable sort kept their order
+        graph.edges = edges
+        for i, edge in enumerate(edges):
+            edge.index = i
+        return graph
+
+    def make_edges(self, nodes: dict) -> list:
+        '''
+        Create Edge objects for Node objects (<node_id: Node_Object>) from the edge arrays and add them to node neighbors.
+        Edge speeds are views of rows of the speed table, so speed changes to the table are seen by Node routing.
+        '''
+
+        self.edges = []
+        for i, (start, end) in enumerate(zip(self.edge_start.tolist(), self.edge_end.tolist())):
+            start_node = nodes[int(self.node_ids[start])]
+            edge = classes.Edge(start_node, nodes[int(self.node_ids[end])], self.lengths[i], self.speeds[i, :24], self.speeds[i, 24:])
+            edge.index = i
+            start_node.neighbors.append(edge)
+            self.edges.append(edge)
+        return self.edges
+
+    def edge_index(self, start_id: int, end_id: int) -> int:
+        '''
+        Index of edge between two node ids (-1 if there is no such edge)
+        '''
+
+        start = self.node_index.get(int(start_id))
+        end = self.node_index.get(int(end_id))
+        if start is None or end is None:
+            return -1
+        for e in range(self.indptr[start], self.indptr[start+1]):
+            if self.edge_end[e] == end:
+                return e
+        return -1
+
+    def strongly_connected_components(self, nodes: dict = None) -> np.ndarray:
+        '''
+        Strongly connected components of the directed road network (iterative Tarjan), stored in component and main_component
+            - nodes: optional Node objects (<node_id: Node_Object>) to tag with their component
+
+        Components are numbered in the order Tarjan completes them, which is a reverse topological order of the
+        component graph: a node can only reach nodes whose component id is <= its own (see may_reach)
+
+        Returns (N,) component id of every node
+        '''
+
+        indptr, edge_end = self.indptr.tolist(), self.edge_end.tolist()
+        index = [-1] * self.num_nodes # DFS discovery order
+        low = [0] * self.num_nodes
+        on_stack = [False] * self.num_nodes
+        component = [-1] * self.num_nodes
+        stack = []
+        counter = num_components = 0
+
+        for root in range(self.num_nodes):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [[root, indptr[root]]] # DFS path: [node, next edge to follow]
+            while work:
+                frame = work[-1]
+                node, k = frame
+                if k < indptr[node+1]:
+                    frame[1] += 1
+                    neighbor = edge_end[k]
+                    if index[neighbor] == -1:
+                        index[neighbor] = low[neighbor] = counter
+                        counter += 1
+                        stack.append(neighbor)
+                        on_stack[neighbor] = True
+                        work.append([neighbor, indptr[neighbor]])
+                    elif on_stack[neighbor] and index[neighbor] < low[node]:
+                        low[node] = index[neighbor]
+                    continue
+
+                # All edges of node followed
+                work.pop()
+                if work and low[node] < low[work[-1][0]]:
+                    low[work[-1][0]] = low[node]
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = num_components
+                        if member == node:
+                            break
+                    num_components += 1
+
+        self.component = np.array(component, dtype = np.int32)
+        self.main_component = int(np.argmax(np.bincount(self.component)))
+        if nodes is not None:
+            for node_id, c in zip(self.node_ids.tolist(), component):
+                nodes[node_id].component = c
+        return self.component
+
+    def may_reach(self, start: int, end: int) -> bool:
+        '''
+        False if there is certainly no path from node index start to node index end (O(1), needs strongly_connected_components).
+        True within one component, e.g. between any two nodes of the main component
+        '''
+
+        return self.component is None or self.component[start] >= self.component[end]
+
+    def travel_times(self, bucket: int) -> np.ndarray:
+        '''
+        Travel time in minutes over every edge in an hour bucket
+        '''
+
+        return 60 * self.lengths / self.speeds[:, bucket]
+
+    def build_reverse(self) -> None:
+        '''
+        Edges grouped by end node: edges entering node i are reverse_order[reverse_indptr[i]:reverse_indptr[i+1]]
+        '''
+
+        self.reverse_order = np.argsort(self.edge_end, kind = 'stable')
+        self.reverse_indptr = np.zeros(self.num_nodes + 1, dtype = np.int64)
+        np.cumsum(np.bincount(self.edge_end, minlength = self.num_nodes), out = self.reverse_indptr[1:])
+
+    def shortest_path_tree(self, source: int, bucket: int, reverse: bool = False, queue = None):
+        '''
+        One-to-all Dijkstra over the edge arrays from node index source, with edge speeds of an hour bucket
+            - reverse: times from every node to source instead
+            - queue: priority queue to use (see pqueue.make_queue), binary heap by default
+
+        Returns (times, tree_edges): minutes from source to every node (inf if unreachable), and for every node the edge
+        index entering it on its shortest path from source (reverse: the edge leaving it towards source), -1 if none
+        '''
+
+        weights = self.travel_times(bucket).tolist()
+        if reverse:
+            if self.reverse_indptr is None:
+                self.build_reverse()
+            indptr, order, other = self.reverse_indptr.tolist(), self.reverse_order.tolist(), self.edge_start.tolist()
+        else:
+            indptr, order, other = self.indptr.tolist(), range(self.num_edges), self.edge_end.tolist()
+
+        inf = float('inf')
+        times = [inf] * self.num_nodes
+        tree_edges = [-1] * self.num_nodes
+        times[source] = 0
+        heap = pqueue.make_queue(queue)
+        heap.push(0, source)
+        while heap:
+            t, node = heap.pop()
+            if t > times[node]:
+                continue # stale heap entry
+            for k in range(indptr[node], indptr[node+1]):
+                e = order[k]
+                neighbor = other[e]
+                new_t = t + weights[e]
+                if new_t < times[neighbor]:
+                    times[neighbor] = new_t
+                    tree_edges[neighbor] = e
+                    heap.push(new_t, neighbor)
+
+        return np.array(times), np.array(tree_edges, dtype = np.int32)
@@ -0,0 +1,180 @@
+import os
+import datetime as dt
+
+import numpy as np
+
+import classes
+import loaders
+
+NUM_HUBS = 10
+DEFAULT_DIR = loaders.DATA_DIR
+FORWARD, REVERSE = 0, 1 # From hub to every node, from every node to hub
+
+
+def find_hubs(passengers_path: str, snap, n: int = NUM_HUBS) -> np.ndarray:
+    '''
+    Most frequent pickup/drop off nodes in passengers.csv
+        - snap: list of coords -> list of the Nodes trips start or end at (e.g. T5.snap_nodes)
+
+    Returns node ids of the n busiest nodes, busiest first
+    '''
+
+    _, coords = loaders.load_people(passengers_path)
+    points = [(lat, lon) for lat, lon in coords[:, 0:2].tolist()] + [(lat, lon) for lat, lon in coords[:, 2:4].tolist()]
+    ids = [int(node.id) for node in snap(points)]
+    values, counts = np.unique(np.array(ids, dtype = np.int64), return_counts = True)
+    return values[np.argsort(-counts, kind = 'stable')[:n]]
+
+
+class HubTables:
+    '''
+    One-to-all travel times from and to hub nodes for every hour bucket, stored in memory-mapped .npy files
+    so only the pages that are looked up are read from disk.
+        - hub_ids: (H,) node ids of hubs
+        - times: (2 x H x NUM_BUCKETS x N) minutes, times[FORWARD, h, bucket, i] from hub h to node index i and
+                 times[REVERSE, h, bucket, i] from node index i to hub h (inf if unreachable)
+        - tree_edges: optional array of the same shape with the shortest path tree edge of every node
+                      (FORWARD: edge entering the node, REVERSE: edge leaving the node), so paths can be rebuilt
+
+    Any trip starting or ending at a hub is a table lookup instead of an A* search. Tables invalidated by speed updates
+    are rebuilt one hub and direction at a time on their next lookup, in memory only (files are mapped copy-on-write).
+    '''
+
+    def __init__(self, graph, hub_ids, times, tree_edges = None) -> None:
+        self.graph = graph
+        self.hub_ids = np.asarray(hub_ids, dtype = np.int64)
+        self.hub_index = {int(node_id): h for h, node_id in enumerate(self.hub_ids)} # <node_id: hub index>
+        self.times = times
+        self.tree_edges = tree_edges
+        self.built = ~np.isnan(times[0, 0, :, 0]) if len(self.hub_ids) else np.zeros(classes.NUM_BUCKETS, dtype = bool) # buckets in the tables
+        self.stale = np.zeros((2, len(self.hub_ids), classes.NUM_BUCKETS), dtype = bool) # [direction, hub, bucket] to rebuild
+
+    @staticmethod
+    def paths(directory: str) -> tuple:
+        return tuple(os.path.join(directory, name) for name in ('hub_nodes.npy', 'hub_times.npy', 'hub_tree_edges.npy'))
+
+    @classmethod
+    def build(cls, graph, hub_ids, directory: str = DEFAULT_DIR, buckets = range(classes.NUM_BUCKETS),
+              with_paths: bool = True, verbose: bool = False):
+        '''
+        Run forward and reverse one-to-all Dijkstra (graph.ArrayGraph.shortest_path_tree) from every hub for each hour bucket,
+        writing straight into memory-mapped files in directory
+            - buckets: hour buckets to compute, other buckets are left as NaN (lookups fall back to routing)
+            - with_paths: also store shortest path trees (doubles the file size)
+
+        This is an offline step: 2 * hubs * buckets searches over the whole network
+        '''
+
+        nodes_path, times_path, edges_path = cls.paths(directory)
+        hub_ids = np.asarray(hub_ids, dtype = np.int64)
+        shape = (2, len(hub_ids), classes.NUM_BUCKETS, graph.num_nodes)
+        np.save(nodes_path, hub_ids)
+        times = np.lib.format.open_memmap(times_path, mode = 'w+', dtype = np.float32, shape = shape)
+        times[:] = np.nan
+        tree_edges = np.lib.format.open_memmap(edges_path, mode = 'w+', dtype = np.int32, shape = shape) if with_paths else None
+
+        for bucket in buckets:
+            for h, hub_id in enumerate(hub_ids):
+                source = graph.node_index[int(hub_id)]
+                for direction in (FORWARD, REVERSE):
+                    t, e = graph.shortest_path_tree(source, bucket, reverse = direction == REVERSE)
+                    times[direction, h, bucket] = t
+                    if with_paths:
+                        tree_edges[direction, h, bucket] = e
+            if verbose:
+                print(f'Computed hour bucket {bucket}')
+
+        times.flush()
+        if with_paths:
+            tree_edges.flush()
+        elif os.path.exists(edges_path):
+            os.remove(edges_path) # left over from an earlier build
+        return cls(graph, hub_ids, times, tree_edges)
+
+    @classmethod
+    def load(cls, graph, directory: str = DEFAULT_DIR):
+        nodes_path, times_path, edges_path = cls.paths(directory)
+        times = np.load(times_path, mmap_mode = 'c')
+        if times.shape[-1] != graph.num_nodes:
+            raise ValueError(f'Hub tables in {directory} were built for a network with {times.shape[-1]} nodes, not {graph.num_nodes}')
+        tree_edges = np.load(edges_path, mmap_mode = 'c') if os.path.exists(edges_path) else None
+        return cls(graph, np.load(nodes_path), times, tree_edges)
+
+    def invalidate(self, buckets) -> None:
+        '''
+        Mark the tables of the given hour buckets as out of date (e.g. after live speed updates), each hub and direction
+        is rebuilt on its next lookup
+        '''
+
+        self.stale[:, :, list(buckets)] = True
+
+    def rebuild(self, direction: int, h: int, bucket: int) -> None:
+        # One forward or reverse search from a hub on the graph's current speeds, if its table is out of date
+        if not self.stale[direction, h, bucket]:
+            return
+        source = self.graph.node_index[int(self.hub_ids[h])]
+        t, e = self.graph.shortest_path_tree(source, bucket, reverse = direction == REVERSE)
+        self.times[direction, h, bucket] = t
+        if self.tree_edges is not None:
+            self.tree_edges[direction, h, bucket] = e
+        self.stale[direction, h, bucket] = False
+
+    def lookup(self, start_id: int, end_id: int, time: dt.datetime):
+        '''
+        Table entry for a trip from or to a hub
+
+        Returns (direction, hub index, bucket, node index) or None if neither node is a hub or the bucket was not built
+        '''
+
+        bucket = classes.hour_bucket(time)
+        if not self.built[bucket]:
+            return None
+        h = self.hub_index.get(int(start_id))
+        if h is not None:
+            self.rebuild(FORWARD, h, bucket)
+            return FORWARD, h, bucket, self.graph.node_index[int(end_id)]
+        h = self.hub_index.get(int(end_id))
+        if h is not None:
+            self.rebuild(REVERSE, h, bucket)
+            return REVERSE, h, bucket, self.graph.node_index[int(start_id)]
+        return None
+
+    def shortest_path(self, start_node: classes.Node, end_node: classes.Node, start_time: dt.datetime, return_path: bool = False):
+        '''
+        Exact shortest travel time in Node.shortest_path_a_star's format (-1 if no path) for trips from or to a hub, None for any other trip.
+        return_path needs the shortest path trees and Edge objects on the graph (graph.ArrayGraph.make_edges)
+        '''
+
+        entry = self.lookup(start_node.id, end_node.id, start_time)
+        if entry is None or (return_path and (self.tree_edges is None or self.graph.edges is None)):
+            return None
+
+        direction, h, bucket, i = entry
+        t = float(self.times[direction, h, bucket, i])
+        if t == float('inf'):
+            return (-1, []) if return_path else -1
+        if not return_path:
+            return t
+
+        # Walk the shortest path tree between the node and the hub
+        tree = self.tree_edges[direction, h, bucket]
+        hub = self.graph.node_index[int(self.hub_ids[h])]
+        path = []
+        while i != hub:
+            e = int(tree[i])
+            path.append(self.graph.edges[e])
+            i = self.graph.edge_start[e] if direction == FORWARD else self.graph.edge_end[e]
+        if direction == FORWARD:
+            path.reverse()
+        return t, path
+
+
+if __name__ == '__main__':
+    import time
+    import T5
+
+    START = time.time()
+    T5.initialize()
+    hub_ids = find_hubs(os.path.join(DEFAULT_DIR, 'passengers.csv'), T5.snap_nodes)
+    HubTables.build(T5.GRAPH, hub_ids, verbose = True)
+    print(f'Saved tables for hubs {hub_ids.tolist()} to {DEFAULT_DIR} in {time.time() - START} seconds')
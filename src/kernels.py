@@ -0,0 +1,196 @@
+import heapq
+import time
+import random
+import datetime as dt
+import importlib.util
+
+import numpy as np
+
+import classes
+import geo
+
+HAS_NUMBA = importlib.util.find_spec('numba') is not None # optional, routing falls back to the same kernels in pure Python
+
+
+def a_star_kernel(indptr, edge_end, weights, x, y, source, target, mph, g, pred, in_open):
+    '''
+    Node.shortest_path_a_star over CSR edge arrays: same heuristic, and like it a node already in the open set is not pushed
+    again when its time improves. If mph <= 0, Node.shortest_path instead (Dijkstra, improved nodes are pushed again).
+        - weights: minutes over every edge
+        - x, y: planar mile coordinates of the nodes (graph.ArrayGraph.x/y, see geo), the heuristic is straight line miles
+        - g, pred, in_open: scratch arrays of length N (g all inf, in_open all False). On return g and pred hold the best
+                            known time and entering edge of every reached node
+
+    Written to compile with Numba (int64/float64 arrays in) and to run as plain Python (lists in, no per-element NumPy overhead)
+
+    Returns (minutes from source to target or -1 if no path is found, number of nodes expanded)
+    '''
+
+    dijkstra = mph <= 0
+    scale = 0.0 if dijkstra else 60.0 / mph
+    target_xy = (x[target], y[target])
+    g[source] = 0.0
+    in_open[source] = True
+    heap = [(geo.euclidean((x[source], y[source]), target_xy) * scale, source)]
+    expanded = 0
+    while len(heap) > 0:
+        key, node = heapq.heappop(heap)
+        if node == target:
+            return (key if dijkstra else g[node]), expanded
+        if dijkstra:
+            if key > g[node]:
+                continue # stale heap entry
+        else:
+            in_open[node] = False
+        expanded += 1
+
+        g_node = g[node]
+        for k in range(indptr[node], indptr[node+1]):
+            neighbor = edge_end[k]
+            new_g = g_node + weights[k]
+            if new_g < g[neighbor]:
+                g[neighbor] = new_g
+                pred[neighbor] = k
+                if dijkstra:
+                    heapq.heappush(heap, (new_g, neighbor))
+                elif not in_open[neighbor]:
+                    in_open[neighbor] = True
+                    heapq.heappush(heap, (new_g + geo.euclidean((x[neighbor], y[neighbor]), target_xy) * scale, neighbor))
+    return -1.0, expanded
+
+
+a_star_jit = None # a_star_kernel compiled by jit_kernel
+
+
+def jit_kernel():
+    '''
+    a_star_kernel compiled with Numba, imported on the first JIT search rather than with this module
+    (importing Numba alone takes longer than starting the command line)
+    '''
+
+    global a_star_jit
+    if a_star_jit is None:
+        import numba
+        from numba.extending import register_jitable
+        register_jitable(geo.euclidean) # the heuristic, compiled into the kernel
+        a_star_jit = numba.njit(cache = True)(a_star_kernel)
+    return a_star_jit
+
+
+class Router:
+    '''
+    Node.shortest_path / shortest_path_a_star over graph.ArrayGraph arrays, JIT compiled with Numba when it is installed
+    (use_jit = None), otherwise the same kernel runs in pure Python over lists.
+    Edge travel times are computed once per hour bucket; call invalidate after changing edge speeds.
+    Nodes expanded by the last search are kept in expanded (0 if it was rejected before searching).
+    '''
+
+    def __init__(self, graph, use_jit: bool = None) -> None:
+        self.graph = graph
+        self.expanded = 0
+        self.use_jit = HAS_NUMBA if use_jit is None else use_jit and HAS_NUMBA
+        self.weights = {} # <bucket: edge travel times>
+        if self.use_jit:
+            self.arrays = (graph.indptr, graph.edge_end.astype(np.int64), graph.x, graph.y)
+        else:
+            self.arrays = (graph.indptr.tolist(), graph.edge_end.tolist(), graph.x.tolist(), graph.y.tolist())
+
+    def invalidate(self, buckets = None) -> None:
+        # drop cached edge travel times of the given hour buckets (all if None)
+        if buckets is None:
+            self.weights.clear()
+            return
+        for bucket in buckets:
+            self.weights.pop(bucket, None)
+
+    def bucket_weights(self, bucket: int):
+        if bucket not in self.weights:
+            weights = self.graph.travel_times(bucket).astype(np.float64)
+            self.weights[bucket] = weights if self.use_jit else weights.tolist()
+        return self.weights[bucket]
+
+    def search(self, start_node: classes.Node, end_node: classes.Node, start_time: dt.datetime, mph: float, return_path: bool):
+        indptr, edge_end, x, y = self.arrays
+        n = self.graph.num_nodes
+        source, target = self.graph.node_index[int(start_node.id)], self.graph.node_index[int(end_node.id)]
+        self.expanded = 0
+        if not self.graph.may_reach(source, target):
+            return (-1.0, []) if return_path else -1.0
+        weights = self.bucket_weights(classes.hour_bucket(start_time))
+        if self.use_jit:
+            g, pred, in_open = np.full(n, np.inf), np.empty(n, dtype = np.int64), np.zeros(n, dtype = np.bool_)
+            minutes, expanded = jit_kernel()(indptr, edge_end, weights, x, y, source, target, float(mph), g, pred, in_open)
+        else:
+            g, pred, in_open = [float('inf')] * n, [-1] * n, [False] * n
+            minutes, expanded = a_star_kernel(indptr, edge_end, weights, x, y, source, target, mph, g, pred, in_open)
+
+        minutes = float(minutes)
+        self.expanded = int(expanded)
+        if not return_path:
+            return minutes
+        if minutes < 0:
+            return minutes, []
+
+        # Walk entering edges back from target
+        path = []
+        node = target
+        while node != source:
+            e = int(pred[node])
+            path.append(self.graph.edges[e])
+            node = int(self.graph.edge_start[e])
+        return minutes, path[::-1]
+
+    def shortest_path(self, start_node: classes.Node, end_node: classes.Node, start_time: dt.datetime) -> float:
+        '''
+        Dijkstra, same as Node.shortest_path (-1 if no path is found)
+        '''
+
+        return self.search(start_node, end_node, start_time, 0, False)
+
+    def shortest_path_a_star(self, start_node: classes.Node, end_node: classes.Node, start_time: dt.datetime, AVG_MPH, return_path: bool = False):
+        '''
+        A*, same as Node.shortest_path_a_star (-1 if no path is found, return_path needs graph.make_edges)
+        '''
+
+        return self.search(start_node, end_node, start_time, AVG_MPH, return_path)
+
+
+def benchmark(graph, nodes: dict, avg_mph: float, num_pairs: int = 200, seed: int = 0) -> list:
+    '''
+    Time A* on random node pairs with each available backend
+
+    Returns list of (backend, total seconds, max abs difference from Node.shortest_path_a_star)
+    '''
+
+    rng = random.Random(seed)
+    node_list = list(nodes.values())
+    pairs = [(rng.choice(node_list), rng.choice(node_list), classes.bucket_start_time(rng.randrange(classes.NUM_BUCKETS)))
+             for _ in range(num_pairs)]
+
+    start = time.time()
+    expected = [a.shortest_path_a_star(b, t, avg_mph) for a, b, t in pairs]
+    results = [('Node.shortest_path_a_star', time.time() - start, 0.0)]
+
+    backends = [('python kernel', False)] + ([('numba kernel', True)] if HAS_NUMBA else [])
+    for name, use_jit in backends:
+        router = Router(graph, use_jit)
+        for bucket in classes.bucket_start_time(0), classes.bucket_start_time(1):
+            router.shortest_path_a_star(node_list[0], node_list[1], bucket, avg_mph) # compile and fill weight caches outside timing
+        for bucket in range(classes.NUM_BUCKETS):
+            router.bucket_weights(bucket)
+        start = time.time()
+        times = [router.shortest_path_a_star(a, b, t, avg_mph) for a, b, t in pairs]
+        results.append((name, time.time() - start, max(abs(x - y) for x, y in zip(times, expected))))
+    return results
+
+
+if __name__ == '__main__':
+    import T5
+
+    T5.initialize()
+    results = benchmark(T5.GRAPH, T5.NODES, T5.AVG_MPH)
+    base = results[0][1]
+    for name, seconds, diff in results:
+        print(f'{name:>26}: {seconds:8.3f} s  {base / seconds:6.1f}x  max diff {diff:.2e} minutes')
+    if not HAS_NUMBA:
+        print('Numba is not installed, only the pure Python kernel was timed')
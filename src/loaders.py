@@ -0,0 +1,273 @@
+import os
+import re
+import datetime as dt
+from array import array
+from itertools import islice
+
+import numpy as np
+
+import classes
+from graph import ArrayGraph
+
+CHUNK_SIZE = 1 << 20 # Characters read from file at a time
+CHUNK_ROWS = 100000 # Rows of csv files parsed at a time
+EPOCH = np.datetime64('1970-01-01T00:00:00', 's')
+EPOCH_DATETIME = dt.datetime(1970, 1, 1)
+
+### Data files: $NOTUBER_DATA if set, else data/ next to src/ in a checkout, else ./data (installed package)
+SOURCE_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+DATA_DIR = os.environ.get('NOTUBER_DATA') or (SOURCE_DATA_DIR if os.path.isdir(SOURCE_DATA_DIR) else os.path.join(os.getcwd(), 'data'))
+
+NODE_PATTERN = re.compile(r'"(-?\d+)"\s*:\s*\{([^{}]*)\}')
+FIELD_PATTERN = re.compile(r'"(\w+)"\s*:\s*("[^"]*"|[-+\w.]+)')
+TOKEN_PATTERN = re.compile(r'"([^"]*)"\s*:|[{}\[\]]')
+
+
+def data_path(*names: str) -> str:
+    return os.path.join(DATA_DIR, *names)
+
+
+def load_nodes(path: str):
+    '''
+    Stream node_data.json ({node_id: {'lon': float, 'lat': float}, ...}) into typed arrays without json.load-ing the whole dict
+
+    Returns (node_ids, lat, lon) NumPy arrays
+    '''
+
+    node_ids, lat, lon = array('q'), array('d'), array('d')
+    with open(path, 'r') as f:
+        buffer = ''
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            buffer += chunk
+            end = 0
+            for match in NODE_PATTERN.finditer(buffer):
+                fields = dict(FIELD_PATTERN.findall(match.group(2)))
+                node_ids.append(int(match.group(1)))
+                lat.append(float(fields['lat']))
+                lon.append(float(fields['lon']))
+                end = match.end()
+            buffer = buffer[end:] # keep partial record for next chunk
+            if not chunk:
+                break
+
+    return np.frombuffer(node_ids, dtype = np.int64), np.frombuffer(lat, dtype = np.float64), np.frombuffer(lon, dtype = np.float64)
+
+
+def iter_adjacency(path: str):
+    '''
+    Stream adjacency.json ({start_id: {end_id: {'day_type', 'hour', 'length', 'max_speed', 'time'}, ...}, ...}).
+    The attribute value may also be a list of such dicts (one per day type/hour).
+
+    Yields (start_id, end_id, bucket, length, max_speed) per attribute dict, only holding one chunk of text in memory
+    '''
+
+    with open(path, 'r') as f:
+        buffer = ''
+        depth = 0 # 1: inside top level dict, 2: inside start node dict, 3+: inside attributes of an edge
+        start_id = end_id = None
+        key = None
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            buffer += chunk
+            pos = 0
+            for token in TOKEN_PATTERN.finditer(buffer):
+                if token.start() < pos:
+                    continue # inside an attribute dict that was already parsed
+                text = token.group(0)
+                if token.group(1) is not None: # key
+                    key = token.group(1)
+                    pos = token.end()
+                    continue
+
+                if text == '{' and depth >= 2:
+                    # attribute dict: parse it as soon as it is complete, it contains no nested objects
+                    if depth == 2:
+                        end_id = key
+                    close = buffer.find('}', token.end())
+                    if close < 0:
+                        break # incomplete, wait for next chunk
+                    fields = dict(FIELD_PATTERN.findall(buffer, token.end(), close))
+                    bucket = int(fields['hour']) + (24 if fields['day_type'].strip('"') == 'weekend' else 0)
+                    yield int(start_id), int(end_id), bucket, float(fields['length']), float(fields['max_speed'])
+                    pos = close + 1
+                elif text in '{[':
+                    depth += 1
+                    if depth == 2:
+                        start_id = key
+                    elif depth == 3:
+                        end_id = key # list of attribute dicts
+                    pos = token.end()
+                else:
+                    depth -= 1
+                    pos = token.end()
+
+            buffer = buffer[pos:]
+            if not chunk:
+                break
+
+
+def load_adjacency(path: str, node_ids, lat, lon) -> ArrayGraph:
+    '''
+    Stream adjacency.json directly into ArrayGraph edge arrays
+        - node_ids, lat, lon: node arrays (see load_nodes)
+
+    Records of the same edge must be next to each other (they are nested under the same start/end ids).
+    Edges with unknown nodes are skipped. Buckets missing from the file get the mean of the edge's known speeds.
+    '''
+
+    node_index = {int(node_id): i for i, node_id in enumerate(node_ids)}
+    edge_start, edge_end = array('i'), array('i')
+    lengths, speeds = array('f'), array('f')
+    blank = array('f', [float('nan')] * classes.NUM_BUCKETS)
+
+    last = None
+    for start_id, end_id, bucket, length, max_speed in iter_adjacency(path):
+        if (start_id, end_id) != last:
+            last = (start_id, end_id)
+            if start_id not in node_index or end_id not in node_index:
+                continue
+            edge_start.append(node_index[start_id])
+            edge_end.append(node_index[end_id])
+            lengths.append(length)
+            speeds.extend(blank)
+        elif start_id not in node_index or end_id not in node_index:
+            continue
+        speeds[(len(lengths) - 1) * classes.NUM_BUCKETS + bucket] = max_speed
+
+    speeds = np.frombuffer(speeds, dtype = np.float32).reshape(-1, classes.NUM_BUCKETS)
+    missing = np.isnan(speeds)
+    if missing.any():
+        with np.errstate(invalid = 'ignore'):
+            fill = np.nanmean(np.where(missing.all(axis = 1, keepdims = True), 0, speeds), axis = 1)
+        speeds[missing] = np.broadcast_to(fill[:, None], speeds.shape)[missing]
+
+    return ArrayGraph(node_ids, lat, lon, np.frombuffer(edge_start, dtype = np.int32), np.frombuffer(edge_end, dtype = np.int32),
+                      np.frombuffer(lengths, dtype = np.float32), speeds)
+
+
+def load_network(node_path: str, adjacency_path: str) -> ArrayGraph:
+    '''
+    Stream node_data.json and adjacency.json into an ArrayGraph
+    '''
+
+    return load_adjacency(adjacency_path, *load_nodes(node_path))
+
+
+def load_edges(path: str, chunk_rows: int = CHUNK_ROWS):
+    '''
+    Bulk load edges.csv (start_id, end_id, length, weekday_0..23, weekend_0..23) in chunks of rows
+
+    Returns (start_ids, end_ids, lengths, speeds) with speeds as an (E x NUM_BUCKETS) float32 array
+    '''
+
+    start_ids, end_ids, lengths, speeds = [], [], [], []
+    with open(path, 'r') as f:
+        _ = f.readline()
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                break
+            rows = np.loadtxt(lines, delimiter = ',', dtype = np.float64, ndmin = 2) # node ids are exact in float64
+            start_ids.append(rows[:, 0].astype(np.int64))
+            end_ids.append(rows[:, 1].astype(np.int64))
+            lengths.append(rows[:, 2].astype(np.float32))
+            speeds.append(rows[:, 3:].astype(np.float32))
+
+    if not lengths:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32), np.empty((0, classes.NUM_BUCKETS), np.float32)
+    return np.concatenate(start_ids), np.concatenate(end_ids), np.concatenate(lengths), np.concatenate(speeds)
+
+
+def ids_to_index(node_ids, ids):
+    '''
+    Vectorized lookup of node indices (positions in node_ids) for an array of node ids, KeyError if an id is not in node_ids
+    '''
+
+    node_ids, ids = np.asarray(node_ids), np.asarray(ids)
+    order = np.argsort(node_ids)
+    idx = order[np.minimum(np.searchsorted(node_ids, ids, sorter = order), len(order) - 1)]
+    found = node_ids[idx] == ids
+    if not found.all():
+        raise KeyError(f'Unknown node ids {np.unique(ids[~found])[:10].tolist()}')
+    return idx
+
+
+def network_speed_stats(speeds):
+    '''
+    Average speed over the whole network (mean of every edge's average speed) and per hour bucket
+    '''
+
+    return float(speeds.mean(dtype = np.float64)), speeds.mean(axis = 0, dtype = np.float64)
+
+
+def load_edge_graph(node_ids, lat, lon, edges_path: str) -> ArrayGraph:
+    '''
+    Build an ArrayGraph from node arrays (see load_nodes) and edges.csv
+    '''
+
+    start_ids, end_ids, lengths, speeds = load_edges(edges_path)
+    return ArrayGraph(node_ids, lat, lon, ids_to_index(node_ids, start_ids), ids_to_index(node_ids, end_ids), lengths, speeds)
+
+
+def parse_timestamps(timestamps) -> np.ndarray:
+    '''
+    Vectorized parse of a column of MM/DD/YYYY HH:MM:SS timestamps into epoch seconds (int64, timestamps taken as UTC).
+    Only the distinct date prefixes are converted to dates, everything else is digit arithmetic over the whole column
+    '''
+
+    raw = np.asarray(timestamps, dtype = 'S19')
+    if raw.size == 0:
+        return np.empty(0, dtype = np.int64)
+    digits = raw.view(np.uint8).reshape(-1, 19).astype(np.int64) - ord('0')
+
+    # Time of day
+    seconds = ((digits[:, 11] * 10 + digits[:, 12]) * 3600 + (digits[:, 14] * 10 + digits[:, 15]) * 60 +
+               digits[:, 17] * 10 + digits[:, 18])
+
+    # Date: memoized table of distinct date prefixes
+    dates, inverse = np.unique(raw.astype('S10'), return_inverse = True)
+    day_seconds = np.array([(np.datetime64(f'{d[6:10]}-{d[0:2]}-{d[3:5]}', 's') - EPOCH).astype(np.int64)
+                            for d in (date.decode() for date in dates)], dtype = np.int64)
+    return day_seconds[inverse.reshape(-1)] + seconds
+
+
+def epoch_to_datetime(seconds: int) -> dt.datetime:
+    return EPOCH_DATETIME + dt.timedelta(seconds = int(seconds))
+
+
+def format_timestamps(seconds) -> list:
+    '''
+    Epoch seconds back to MM/DD/YYYY HH:MM:SS strings (inverse of parse_timestamps), formatting each distinct date once
+    '''
+
+    days, day_seconds = np.divmod(np.asarray(seconds, dtype = np.int64), 86400)
+    unique_days, inverse = np.unique(days, return_inverse = True)
+    dates = [epoch_to_datetime(day * 86400).strftime('%m/%d/%Y') for day in unique_days.tolist()]
+    hours, rest = np.divmod(day_seconds, 3600)
+    minutes, secs = np.divmod(rest, 60)
+    return [f'{dates[d]} {h:02d}:{m:02d}:{s:02d}' for d, h, m, s in
+            zip(inverse.reshape(-1).tolist(), hours.tolist(), minutes.tolist(), secs.tolist())]
+
+
+def load_people(path: str, chunk_rows: int = CHUNK_ROWS):
+    '''
+    Bulk load drivers.csv (Date/Time, Lat, Lon) or passengers.csv (Date/Time, Lat, Lon, Dest Lat, Dest Lon)
+
+    Returns (epoch seconds int64 array, (rows x coordinate columns) float64 array)
+    '''
+
+    times, coords = [], []
+    with open(path, 'r') as f:
+        _ = f.readline()
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                break
+            times.append(parse_timestamps([line[:19] for line in lines])) # timestamps are fixed width
+            num_cols = lines[0].count(',') + 1
+            coords.append(np.loadtxt(lines, delimiter = ',', usecols = range(1, num_cols), dtype = np.float64, ndmin = 2))
+
+    if not times:
+        return np.empty(0, dtype = np.int64), np.empty((0, 0), dtype = np.float64)
+    return np.concatenate(times), np.concatenate(coords)
@@ -0,0 +1,133 @@
+import os
+import csv
+import json
+import asyncio
+import argparse
+import datetime as dt
+
+import classes
+import geo
+import loaders
+import service
+
+DATA_DIR = loaders.DATA_DIR
+EST_MPH = 20 # Speed used to estimate when an assigned driver pings again after drop off
+
+
+def read_rows(path: str) -> list:
+    with open(path, 'r') as f:
+        _ = f.readline()
+        return list(csv.reader(f))
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def replay(host: str, port: int, speedup: float, limit: int = None) -> dict:
+    '''
+    Synthetic load: ping every driver in drivers.csv, then replay ride requests from passengers.csv at speedup x real time.
+    Requests with the same timestamp are sent together, so minute boundaries arrive as bursts.
+    Assigned drivers ping again at the drop off location once their (estimated) ride is over.
+
+    Returns latency percentiles (ms), throughput and rejections
+    '''
+
+    drivers = read_rows(os.path.join(DATA_DIR, 'drivers.csv'))
+    passengers = read_rows(os.path.join(DATA_DIR, 'passengers.csv'))[:limit]
+    reader, writer = await asyncio.open_connection(host, port)
+    loop = asyncio.get_running_loop()
+
+    sent = {} # <ride id: (send time, passenger row)>
+    pings = [] # scheduled driver pings, cancelled when replay ends
+    latencies = []
+    results = {'assignment': 0, 'busy': 0, 'no_drivers': 0}
+
+    def send(message: dict) -> None:
+        writer.write((json.dumps(message) + '\n').encode())
+
+    def ping_after_ride(driver_id: int, row: list, eta: float) -> None:
+        start_lat, start_lon, end_lat, end_lon = map(float, row[1:])
+        minutes = eta + geo.manhattan(geo.project(start_lat, start_lon), geo.project(end_lat, end_lon)) / EST_MPH * 60
+        dropoff_time = classes.parse_timestamp(row[0]) + dt.timedelta(minutes = minutes)
+        ping = {'type': 'driver', 'id': driver_id, 'time': dropoff_time.strftime(classes.TIMESTAMP_FORMAT), 'lat': end_lat, 'lon': end_lon}
+        pings.append(loop.call_later(minutes * 60 / speedup, send, ping))
+
+    async def listen() -> None:
+        while len(latencies) < len(passengers):
+            line = await reader.readline()
+            if not line:
+                return
+            response = json.loads(line)
+            send_time, row = sent.pop(response['ride'])
+            latencies.append((loop.time() - send_time) * 1000)
+            if response['type'] == 'assignment':
+                results['assignment'] += 1
+                ping_after_ride(response['driver'], row, response['eta'])
+            else:
+                results[response['reason']] += 1
+
+    for id, (timestamp, lat, lon) in enumerate(drivers, start = 1):
+        send({'type': 'driver', 'id': id, 'time': timestamp, 'lat': float(lat), 'lon': float(lon)})
+    await writer.drain()
+
+    listener = asyncio.create_task(listen())
+    start = loop.time()
+    first_time = classes.parse_timestamp(passengers[0][0])
+    for id, row in enumerate(passengers, start = 1):
+        offset = (classes.parse_timestamp(row[0]) - first_time).total_seconds() / speedup
+        if offset > loop.time() - start:
+            await writer.drain()
+            await asyncio.sleep(offset - (loop.time() - start))
+        sent[id] = (loop.time(), row)
+        send({'type': 'ride', 'id': id, 'time': row[0], 'lat': float(row[1]), 'lon': float(row[2]),
+              'end_lat': float(row[3]), 'end_lon': float(row[4])})
+    await writer.drain()
+    await listener
+    elapsed = loop.time() - start
+    for ping in pings:
+        ping.cancel()
+    writer.close()
+    await writer.wait_closed()
+
+    return {'requests': len(passengers), 'seconds': elapsed, 'throughput': len(passengers) / elapsed,
+            'p50_ms': percentile(latencies, 50), 'p95_ms': percentile(latencies, 95), 'p99_ms': percentile(latencies, 99),
+            'max_ms': max(latencies, default = float('nan')), **results}
+
+
+async def run_local(speedup: float, limit: int = None) -> dict:
+    '''
+    Start a matching service in this process over an empty QuadTree driver index and replay against it
+    (no road network needed)
+    '''
+
+    from datastructures import QuadTree
+    matcher = service.MatchingService(QuadTree(avg_mph = EST_MPH))
+    await matcher.start(service.HOST, 0)
+    port = matcher.server.sockets[0].getsockname()[1]
+    try:
+        report = await replay(service.HOST, port, speedup, limit)
+    finally:
+        await matcher.stop()
+    report['batches'] = matcher.stats['batches']
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Replay passengers.csv against the matching service')
+    parser.add_argument('--host', default = service.HOST)
+    parser.add_argument('--port', type = int, default = service.PORT)
+    parser.add_argument('--speedup', type = float, default = 3600, help = 'simulated seconds per real second')
+    parser.add_argument('--limit', type = int, default = None, help = 'only replay the first LIMIT ride requests')
+    parser.add_argument('--local', action = 'store_true', help = 'start an in-process service instead of connecting to one')
+    args = parser.parse_args()
+
+    if args.local:
+        report = asyncio.run(run_local(args.speedup, args.limit))
+    else:
+        report = asyncio.run(replay(args.host, args.port, args.speedup, args.limit))
+    for key, val in report.items():
+        print(f'{key}: {val}')
@@ -0,0 +1,163 @@
+import gc
+import sys
+import time
+import types
+import argparse
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+try:
+    import resource
+except ImportError: # not available on Windows, peak RSS is then not reported
+    resource = None
+
+import classes
+
+NOT_DATA = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType, types.FrameType)
+TRACKER = None # PhaseTracker while profiling, phase marks are no-ops otherwise
+
+
+def deep_sizeof(root, seen: set = None, skip_types: tuple = ()) -> tuple:
+    '''
+    Bytes and object counts (by type name) of everything reachable from root
+        - seen: ids of objects already counted, shared between calls so objects reachable from several roots are counted once
+        - skip_types: objects of these types (other than root) are neither counted nor followed,
+                      so e.g. Node objects don't pull their Edge objects into the count
+
+    NumPy arrays count their own buffer only, views are not followed to the array they view.
+    '''
+
+    seen = set() if seen is None else seen
+    total = 0
+    counts = Counter()
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, NOT_DATA) or (obj is not root and isinstance(obj, skip_types)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        counts[type(obj).__name__] += 1
+        if isinstance(obj, np.ndarray):
+            continue
+        stack.extend(gc.get_referents(obj))
+    return total, counts
+
+
+def rss_kb() -> int:
+    '''
+    Current resident set size in KB (None if not available)
+    '''
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * (resource.getpagesize() if resource else 4096) // 1024
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss_kb() -> int:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak # bytes on macOS, KB elsewhere
+
+
+class PhaseTracker:
+    '''
+    Time, RSS and peak RSS at the end of each phase (see mark), and optionally the peak of Python allocations
+    within each phase (tracemalloc, much slower)
+    '''
+
+    def __init__(self, use_tracemalloc: bool = False) -> None:
+        self.use_tracemalloc = use_tracemalloc
+        self.phases = []
+        self.last_time = time.time()
+        if use_tracemalloc:
+            tracemalloc.start()
+
+    def mark(self, name: str) -> None:
+        '''
+        End of a phase
+        '''
+
+        now = time.time()
+        phase = {'phase': name, 'seconds': now - self.last_time, 'rss_mb': rss_kb(), 'peak_rss_mb': peak_rss_kb()}
+        for key in ('rss_mb', 'peak_rss_mb'):
+            if phase[key] is not None:
+                phase[key] /= 1024
+        if self.use_tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            phase['traced_mb'], phase['traced_peak_mb'] = current / 2**20, peak / 2**20
+            tracemalloc.reset_peak()
+        self.phases.append(phase)
+        self.last_time = time.time()
+
+    def stop(self) -> None:
+        if self.use_tracemalloc:
+            tracemalloc.stop()
+
+
+def mark(name: str) -> None:
+    '''
+    Phase mark called from initialization code, only recorded while profiling
+    '''
+
+    if TRACKER is not None:
+        TRACKER.mark(name)
+
+
+def structure_report(structures: list) -> list:
+    '''
+    Deep size of each (name, object, skip_types) in order, objects already counted under an earlier name are not counted again
+
+    Returns list of (name, bytes, object counts)
+    '''
+
+    seen = set()
+    return [(name, *deep_sizeof(obj, seen, skip_types)) for name, obj, skip_types in structures]
+
+
+def print_table(rows: list, columns: list) -> None:
+    print('  '.join(f'{column:>14}' for column in columns))
+    for row in rows:
+        print('  '.join(f'{row[column]:>14.2f}' if isinstance(row[column], float) else f'{str(row[column]):>14}' for column in columns))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Memory used by the initialized T5 network state')
+    parser.add_argument('--tracemalloc', action = 'store_true', help = 'also trace Python allocations per phase (slow)')
+    parser.add_argument('--kdtree', action = 'store_true', help = 'use KDTree and Grid instead of quadtrees')
+    args = parser.parse_args()
+
+    import T5
+    import graph
+    import memprofile # the module T5 marks phases in (this script runs as __main__)
+
+    T5.USE_QUADTREE = not args.kdtree
+    tracker = memprofile.TRACKER = PhaseTracker(args.tracemalloc)
+    T5.initialize()
+    tracker.stop()
+
+    print('Initialization phases:')
+    print_table(tracker.phases, list(tracker.phases[0].keys()))
+
+    people = (classes.Driver, classes.Passenger)
+    network = (classes.Node, classes.Edge) + people
+    rows = structure_report([
+        ('NODES', T5.NODES, (classes.Edge,) + people),
+        ('edges', T5.GRAPH.edges, (classes.Node,)),
+        ('NODE_COORDS', T5.NODE_COORDS, network),
+        ('GRAPH', T5.GRAPH, network),
+        ('PARTITION', T5.PARTITION, network + (graph.ArrayGraph,)),
+        ('NODE_INDEX', T5.NODE_INDEX, network),
+        ('DRIVERS', T5.DRIVERS, (classes.Node,)),
+        ('PASSENGERS', T5.PASSENGERS, (classes.Node,)),
+    ])
+
+    print('\nStructures (objects reachable from an earlier row are counted there):')
+    for name, size, counts in rows:
+        top = ', '.join(f'{type_name} {count}' for type_name, count in counts.most_common(4))
+        print(f'{name:>12}  {size / 2**20:>10.2f} MB  {sum(counts.values()):>10} objects  ({top})')
@@ -0,0 +1,358 @@
+import time
+import datetime as dt
+
+import classes
+from datastructures import QuadTree
+from datastructures import OngoingRides
+
+### Pooling parameters
+CAPACITY = 3 # Max passengers in a car at once
+MAX_WAIT = 15 # Minutes, latest pickup after the ride request
+MAX_DETOUR = 0.5 # A passenger's ride may take this fraction longer than driving there directly
+CANDIDATES = 8 # Nearest driver routes evaluated per request
+BUCKET_CAPACITY = 32 # Max routes per quadtree leaf
+
+
+class Stop:
+    '''
+    Pickup or drop off of a passenger at a node, which must be reached by deadline. A drop off must be reached within
+    max_ride minutes of the pickup, its deadline is None until the pickup is reached
+    '''
+    __slots__ = ('passenger', 'node', 'pickup', 'deadline', 'direct', 'max_ride')
+
+    def __init__(self, passenger: classes.Passenger, node: classes.Node, pickup: bool, deadline: dt.datetime, direct: float,
+                 max_ride: float = None) -> None:
+        self.passenger = passenger
+        self.node = node
+        self.pickup = pickup
+        self.deadline = deadline
+        self.direct = direct # Minutes from pickup to drop off without detours
+        self.max_ride = max_ride # Minutes from pickup to drop off with detours (drop offs only)
+
+
+class PooledRoute:
+    '''
+    Ordered pickup/drop off stops of one driver, starting from origin (last node reached) at origin_time.
+    Leg times between consecutive stops are cached, so evaluating an insertion only routes the new legs:
+        - legs[i]: minutes from the previous stop (origin for i = 0) to stops[i]
+        - arrivals[i]: minutes after origin_time that stops[i] is reached
+        - slack[i]: minutes stops[i:] can all be delayed without missing a deadline or a max ride time
+        - load[i]: passengers on board after stops[i]
+    '''
+
+    def __init__(self, driver: classes.Driver) -> None:
+        self.driver = driver
+        self.origin = driver.node
+        self.origin_time = driver.time
+        self.coords, self.xy = driver.node.coords, driver.node.xy # Position in the matcher's spatial index
+        self.onboard = 0 # Passengers on board at origin
+        self.stops, self.legs = [], []
+        self.arrivals, self.slack, self.load = [], [], []
+
+    def __len__(self) -> int:
+        return len(self.stops)
+
+    @property
+    def end_time(self) -> dt.datetime:
+        return self.origin_time + dt.timedelta(minutes = self.arrivals[-1] if self.arrivals else 0)
+
+    def refresh(self) -> None:
+        '''
+        Recompute arrivals, slack and load from the cached legs, O(number of stops)
+        '''
+
+        n = len(self.stops)
+        self.arrivals, self.slack, self.load = [0] * n, [0] * n, [0] * n
+        t, load = 0, self.onboard
+        for i, stop in enumerate(self.stops):
+            t += self.legs[i]
+            load += 1 if stop.pickup else -1
+            self.arrivals[i], self.load[i] = t, load
+
+        slack = float('inf')
+        for i in range(n - 1, -1, -1):
+            if self.stops[i].deadline is not None:
+                deadline = (self.stops[i].deadline - self.origin_time).total_seconds() / 60
+                slack = min(slack, deadline - self.arrivals[i])
+            self.slack[i] = slack
+
+        # Delaying the stops after a pickup up to its drop off makes that ride longer (delaying both does not)
+        pickups = {}
+        for k, stop in enumerate(self.stops):
+            if stop.pickup:
+                pickups[stop.passenger.id] = k
+            elif stop.deadline is None:
+                p = pickups[stop.passenger.id]
+                ride_slack = stop.max_ride - (self.arrivals[k] - self.arrivals[p])
+                for i in range(p + 1, k + 1):
+                    self.slack[i] = min(self.slack[i], ride_slack)
+
+    def advance(self, now: dt.datetime = None) -> list:
+        '''
+        Drop stops reached by now (all stops if now is None) and move origin to the last one reached.
+        An idle driver waits at origin, so its route starts no earlier than now.
+
+        Returns list of (Stop, time reached)
+        '''
+
+        done = 0
+        if now is None:
+            done = len(self.stops)
+        else:
+            minutes = (now - self.origin_time).total_seconds() / 60
+            while done < len(self.stops) and self.arrivals[done] <= minutes:
+                done += 1
+
+        completed = [(stop, self.origin_time + dt.timedelta(minutes = self.arrivals[i])) for i, stop in enumerate(self.stops[:done])]
+        picked_up = {stop.passenger.id: reached for stop, reached in completed if stop.pickup}
+        for stop in self.stops[done:]:
+            if stop.deadline is None and stop.passenger.id in picked_up:
+                stop.deadline = picked_up[stop.passenger.id] + dt.timedelta(minutes = stop.max_ride)
+        if done:
+            self.origin = self.stops[done-1].node
+            self.onboard = self.load[done-1]
+            self.origin_time = completed[-1][1]
+            del self.stops[:done], self.legs[:done]
+            self.refresh()
+        if not self.stops and now is not None and now > self.origin_time:
+            self.origin_time = now
+        return completed
+
+    def best_insertion(self, pickup: Stop, dropoff: Stop, leg_time, capacity: int):
+        '''
+        Cheapest feasible positions to insert a passenger's pickup and drop off, O(number of stops^2) arithmetic
+        over O(number of stops) new legs.
+            - leg_time: (start Node, end Node) -> minutes (inf if no path)
+        The leg to the first stop is already being driven, so nothing is inserted before it.
+
+        Returns (added minutes to the route, i, j) or None, where pickup goes before stops[i] and drop off before stops[j] (i <= j)
+        '''
+
+        n = len(self.stops)
+        pickup_deadline = (pickup.deadline - self.origin_time).total_seconds() / 60
+        best = None
+
+        for i in range(1 if n else 0, n + 1):
+            prev = self.stops[i-1] if i else None
+            prev_node, prev_arrival = (prev.node, self.arrivals[i-1]) if i else (self.origin, 0)
+            if (self.load[i-1] if i else self.onboard) + 1 > capacity:
+                continue
+            pickup_arrival = prev_arrival + leg_time(prev_node, pickup.node)
+            if pickup_arrival > pickup_deadline:
+                continue
+
+            # Drop off right after pickup
+            added = pickup_arrival - prev_arrival + pickup.direct
+            if i < n:
+                added += leg_time(dropoff.node, self.stops[i].node) - self.legs[i]
+            if pickup.direct <= dropoff.max_ride and (i == n or added <= self.slack[i]):
+                if best is None or added < best[0]:
+                    best = (added, i, i)
+            if i == n:
+                continue
+
+            # Drop off after later stops, stops between pickup and drop off are delayed by the pickup detour
+            pickup_delay = pickup_arrival - prev_arrival + leg_time(pickup.node, self.stops[i].node) - self.legs[i]
+            if pickup_delay > self.slack[i] or (best is not None and pickup_delay >= best[0]):
+                continue
+            for j in range(i + 1, n + 1):
+                if self.load[j-1] + 1 > capacity:
+                    break # passenger would be on board while the car is full
+                dropoff_arrival = self.arrivals[j-1] + pickup_delay + leg_time(self.stops[j-1].node, dropoff.node)
+                if dropoff_arrival - pickup_arrival > dropoff.max_ride:
+                    break # later drop offs only arrive later
+                added = dropoff_arrival - self.arrivals[j-1]
+                if j < n:
+                    added += leg_time(dropoff.node, self.stops[j].node) - self.legs[j]
+                    if added > self.slack[j]:
+                        continue
+                if best is None or added < best[0]:
+                    best = (added, i, j)
+
+        return best
+
+    def insert(self, pickup: Stop, dropoff: Stop, i: int, j: int, leg_time) -> None:
+        '''
+        Insert pickup before stops[i] and drop off before stops[j] (positions from best_insertion)
+        '''
+
+        n = len(self.stops)
+        if j == i:
+            new_stops = [pickup, dropoff]
+        else:
+            # drop off first so position i is unchanged
+            prev_node = self.stops[j-1].node
+            self.stops.insert(j, dropoff)
+            self.legs.insert(j, leg_time(prev_node, dropoff.node))
+            if j < n:
+                self.legs[j+1] = leg_time(dropoff.node, self.stops[j+1].node)
+            new_stops = [pickup]
+
+        prev_node = self.stops[i-1].node if i else self.origin
+        legs = [leg_time(prev_node, pickup.node)] + [pickup.direct] * (len(new_stops) - 1)
+        self.stops[i:i] = new_stops
+        self.legs[i:i] = legs
+        k = i + len(new_stops)
+        if k < len(self.stops):
+            self.legs[k] = leg_time(new_stops[-1].node, self.stops[k].node)
+        self.refresh()
+
+
+class PoolingMatcher:
+    '''
+    Shared ride matching: each ride request is inserted into the route of the nearby driver where it adds the least
+    driving time, subject to seat capacity, a max wait for pickup and a max detour for every passenger on the route.
+    Candidate routes come from a quadtree over route origins (CANDIDATES nearest), so a request costs
+    O(log drivers + CANDIDATES * stops^2) and does not grow with the number of active rides.
+        - leg_time: (start Node, end Node, start time) -> minutes (negative if no path), e.g. RouteCache.shortest_path
+        - snap: coords -> nearest Node
+    '''
+
+    def __init__(self, leg_time, snap, capacity: int = CAPACITY, max_wait: float = MAX_WAIT,
+                 max_detour: float = MAX_DETOUR, candidates: int = CANDIDATES) -> None:
+        self.leg_time = leg_time
+        self.snap = snap
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.max_detour = max_detour
+        self.candidates = candidates
+
+        self.index = QuadTree(capacity = BUCKET_CAPACITY)
+        self.offline = OngoingRides() # Drivers not available yet, added to the index once they could make a pickup
+        self.routes = {} # <driver id: PooledRoute>
+        self.completed = [] # (Stop, time reached) of stops that are done
+        self.stats = {'requests': 0, 'assigned': 0, 'pooled': 0, 'rejected': 0}
+
+    def add_driver(self, driver: classes.Driver) -> None:
+        self.offline.push(driver)
+
+    def go_online(self, time: dt.datetime) -> None:
+        # routes of drivers available by time
+        for driver in self.offline.pop_completed(time):
+            if driver.node is None:
+                driver.node = self.snap(driver.coords)
+            route = PooledRoute(driver)
+            self.routes[driver.id] = route
+            self.index.insert(route)
+
+    def advance(self, route: PooledRoute, now: dt.datetime = None) -> None:
+        completed = route.advance(now)
+        if completed:
+            self.completed.extend(completed)
+            self.index.remove(route)
+            route.coords, route.xy = route.origin.coords, route.origin.xy
+            self.index.insert(route)
+
+    def request(self, passenger: classes.Passenger):
+        '''
+        Match a ride request to a driver route
+
+        Returns (Driver, PooledRoute) or None if no nearby route can take the passenger
+        '''
+
+        self.stats['requests'] += 1
+        if passenger.node is None:
+            passenger.node = self.snap(passenger.coords)
+        if passenger.end_node is None:
+            passenger.end_node = self.snap(passenger.end_coords)
+
+        # Leg times for this request (speeds of the request's hour bucket)
+        legs = {}
+        def leg_time(start: classes.Node, end: classes.Node) -> float:
+            key = (start.id, end.id)
+            if key not in legs:
+                minutes = 0 if start is end else self.leg_time(start, end, passenger.time)
+                legs[key] = minutes if minutes >= 0 else float('inf')
+            return legs[key]
+
+        direct = leg_time(passenger.node, passenger.end_node)
+        if direct == float('inf'):
+            self.stats['rejected'] += 1
+            return None
+        pickup_deadline = passenger.time + dt.timedelta(minutes = self.max_wait)
+        pickup = Stop(passenger, passenger.node, True, pickup_deadline, direct)
+        dropoff = Stop(passenger, passenger.end_node, False, None, direct, direct * (1 + self.max_detour))
+
+        self.go_online(pickup_deadline)
+        best = None
+        for _, route in self.index.get_kNN(self.candidates, passenger.coords):
+            self.advance(route, passenger.time)
+            insertion = route.best_insertion(pickup, dropoff, leg_time, self.capacity)
+            if insertion is not None and (best is None or insertion[0] < best[0][0]):
+                best = (insertion, route)
+
+        if best is None:
+            self.stats['rejected'] += 1
+            return None
+
+        (_, i, j), route = best
+        self.stats['assigned'] += 1
+        if route.onboard or route.stops:
+            self.stats['pooled'] += 1
+        route.insert(pickup, dropoff, i, j, leg_time)
+        route.driver.time = route.end_time
+        route.driver.node = route.stops[-1].node
+        route.driver.coords = route.driver.node.coords
+        return route.driver, route
+
+    def finish(self) -> None:
+        '''
+        Drive every route to its end
+        '''
+
+        for route in self.routes.values():
+            self.advance(route)
+
+    def summary(self) -> dict:
+        '''
+        Average pickup wait and ride time over direct drive time (minutes) of completed rides
+        '''
+
+        pickups = {}
+        waits, detours = [], []
+        for stop, reached in self.completed:
+            if stop.pickup:
+                pickups[stop.passenger.id] = reached
+                waits.append(max(0, (reached - stop.passenger.time).total_seconds() / 60))
+            elif stop.passenger.id in pickups:
+                detours.append((reached - pickups[stop.passenger.id]).total_seconds() / 60 - stop.direct)
+
+        return {**self.stats, 'avg_wait': sum(waits) / len(waits) if waits else float('nan'),
+                'avg_detour': sum(detours) / len(detours) if detours else float('nan')}
+
+
+def simulate() -> dict:
+    '''
+    Pool T5.PASSENGERS onto T5.DRIVERS after T5.initialize, with T5's routing, node snapping and traffic updates
+
+    Returns PoolingMatcher.summary
+    '''
+
+    import T5
+
+    matcher = PoolingMatcher(lambda start, end, start_time: T5.ROUTE_CACHE.shortest_path(start, end, start_time, T5.AVG_MPH),
+                             lambda coords: T5.NODE_INDEX.get_kNN(1, coords)[0][1])
+    for driver in T5.DRIVERS:
+        matcher.add_driver(driver)
+
+    for passenger in T5.PASSENGERS:
+        T5.TRAFFIC_UPDATER.poll(T5.TRAFFIC_UPDATES)
+        matcher.request(passenger)
+    matcher.finish()
+    T5.close_trace()
+    return matcher.summary()
+
+
+if __name__ == '__main__':
+    import T5
+
+    START = time.time()
+    print('Initializing...')
+    T5.initialize()
+    print(f'Finished initializing in {time.time() - START} seconds.')
+
+    START = time.time()
+    summary = simulate()
+    print(f'Simulation Runtime: {time.time() - START} seconds')
+    for key, val in summary.items():
+        print(f'{key}: {val}')
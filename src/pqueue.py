@@ -0,0 +1,152 @@
+import heapq
+import time
+import random
+
+QUANTUM = 0.1 / 60 # Minutes, radix heap priorities are quantized to 0.1 second
+KEY_BITS = 64 # Largest quantized key is 2**64 - 1 (far beyond any travel time)
+
+
+class BinaryHeap:
+    '''
+    heapq with an insertion counter as tie break, so equal priorities never fall back to comparing items (Node objects
+    can't be ordered). Pops exactly in priority order, any float priorities.
+    '''
+
+    def __init__(self) -> None:
+        self.heap = []
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def push(self, priority: float, item) -> None:
+        self.count += 1
+        heapq.heappush(self.heap, (priority, self.count, item))
+
+    def pop(self) -> tuple:
+        '''
+        Returns (priority, item) with the smallest priority
+        '''
+
+        priority, _, item = heapq.heappop(self.heap)
+        return priority, item
+
+
+class RadixHeap:
+    '''
+    Monotone priority queue: priorities are quantized to integer keys floor(priority / quantum) and kept in 65 buckets
+    by the highest bit in which a key differs from the last popped key. Push is O(1); each entry moves to a lower bucket
+    at most 64 times over its lifetime, so pop is amortized O(log C) for C the largest key, with no float comparisons.
+
+    Priorities must not decrease below the last popped one (true for Dijkstra: a pushed time is a popped time plus
+    an edge time). Smaller priorities are clamped to the last popped key and counted in clamped (A* with the
+    network average speed heuristic, which is not consistent on roads faster than average).
+
+    Entries with the same key pop in any order, so compared to BinaryHeap (with searches that push an improved node again):
+        - one-to-all searches run to exhaustion give exactly the same times
+        - searches that stop when the target pops return a time less than one quantum above the shortest time:
+          the target pops with key K while a node on the shortest path with key <= floor(shortest / quantum) waits
+    Node.shortest_path_a_star doesn't push open nodes again and clamps keys, so it has no such bound with this queue.
+    '''
+
+    def __init__(self, quantum: float = QUANTUM) -> None:
+        self.quantum = quantum
+        self.buckets = [[] for _ in range(KEY_BITS + 1)] # bucket 0 holds keys equal to last
+        self.last = 0 # last popped key
+        self.size = 0
+        self.clamped = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def push(self, priority: float, item) -> None:
+        key = int(priority / self.quantum)
+        if key < self.last:
+            key = self.last
+            self.clamped += 1
+        self.buckets[(key ^ self.last).bit_length()].append((key, priority, item))
+        self.size += 1
+
+    def pop(self) -> tuple:
+        '''
+        Returns (priority, item) with the smallest quantized priority
+        '''
+
+        if self.size == 0:
+            raise IndexError('pop from empty RadixHeap')
+        buckets = self.buckets
+        if not buckets[0]:
+            # Move the lowest non-empty bucket down around its smallest key
+            i = 1
+            while not buckets[i]:
+                i += 1
+            entries = buckets[i]
+            buckets[i] = []
+            last = self.last = min(entry[0] for entry in entries)
+            for entry in entries:
+                buckets[(entry[0] ^ last).bit_length()].append(entry)
+        self.size -= 1
+        _, priority, item = buckets[0].pop()
+        return priority, item
+
+
+QUEUES = {'binary': BinaryHeap, 'radix': RadixHeap}
+
+
+def make_queue(queue = None):
+    '''
+    Empty priority queue for a shortest path search
+        - queue: None (BinaryHeap), a name in QUEUES, or a callable returning an object with push, pop and len
+    '''
+
+    if queue is None:
+        return BinaryHeap()
+    if isinstance(queue, str):
+        if queue not in QUEUES:
+            raise ValueError(f'Unknown priority queue {queue!r}, expected one of {list(QUEUES)}')
+        return QUEUES[queue]()
+    return queue()
+
+
+def benchmark(graph, nodes: dict, avg_mph: float, bucket_times: list, num_pairs: int = 100, num_trees: int = 5, seed: int = 0) -> list:
+    '''
+    Time Node.shortest_path, Node.shortest_path_a_star and graph.ArrayGraph.shortest_path_tree with each queue
+    on the same random queries
+        - bucket_times: start time of every hour bucket (classes.bucket_start_time), queries start at one of them
+
+    Returns list of (search, queue, total seconds, max abs difference from the binary heap in minutes)
+    '''
+
+    rng = random.Random(seed)
+    node_list = list(nodes.values())
+    buckets = [rng.randrange(len(bucket_times)) for _ in range(num_pairs)]
+    pairs = [(rng.choice(node_list), rng.choice(node_list), bucket_times[b]) for b in buckets]
+    sources = [(graph.node_index[int(rng.choice(node_list).id)], b) for b in buckets[:num_trees]]
+
+    searches = [
+        ('dijkstra', lambda queue: [a.shortest_path(b, t, queue = queue) for a, b, t in pairs]),
+        ('a_star', lambda queue: [a.shortest_path_a_star(b, t, avg_mph, queue = queue) for a, b, t in pairs]),
+        ('one_to_all', lambda queue: [x for s, b in sources for x in graph.shortest_path_tree(s, b, queue = queue)[0].tolist()]),
+    ]
+    results = []
+    for search, run in searches:
+        expected = None
+        for queue in QUEUES:
+            start = time.time()
+            values = run(queue)
+            seconds = time.time() - start
+            if expected is None:
+                expected = values
+            diff = max((abs(x - y) for x, y in zip(values, expected) if x != y), default = 0.0)
+            results.append((search, queue, seconds, diff))
+    return results
+
+
+if __name__ == '__main__':
+    import classes
+    import T5
+
+    T5.initialize()
+    print(f'Radix heap quantum {QUANTUM * 60:.2f} s: point to point searches may end up to {QUANTUM:.2e} minutes late, one-to-all is exact (A* is not bounded)')
+    for search, queue, seconds, diff in benchmark(T5.GRAPH, T5.NODES, T5.AVG_MPH, [classes.bucket_start_time(b) for b in range(classes.NUM_BUCKETS)]):
+        print(f'{search:>10} {queue:>7}: {seconds:8.3f} s  max diff {diff:.2e} minutes')
@@ -0,0 +1,181 @@
+import os
+import time
+import argparse
+
+import numpy as np
+
+import classes
+import loaders
+import graph
+
+### Binary record format of a trace file: packed little endian records, no header (read back with read_trace)
+TRACE_DTYPE = np.dtype([('start', '<i8'), ('end', '<i8'), ('bucket', 'u1'), ('mph', '<f4'), ('minutes', '<f8'),
+                        ('expanded', '<i4'), ('source', 'u1')])
+FLUSH_ROWS = 65536 # Records buffered before writing
+TOLERANCE = 1e-6 # Minutes, replayed results further than this from the recorded ones are mismatches
+
+
+class TraceRecorder:
+    '''
+    Records routing queries (traffic.RouteCache.shortest_path calls) to a binary trace file of TRACE_DTYPE records:
+    start and end node ids, hour bucket, A* speed (mph), minutes returned (-1 if no path), nodes expanded and what
+    answered the query (source)
+
+    Nodes expanded are counted by kernels.Router searches, -1 for Node searches and 0 for cache and hub table answers.
+    '''
+
+    SEARCH, CACHE, HUB = 0, 1, 2 # source of a record
+    SOURCES = ('search', 'cache', 'hub')
+
+    def __init__(self, path: str, flush_rows: int = FLUSH_ROWS) -> None:
+        self.path = path
+        self.file = open(path, 'wb')
+        self.buffer = np.empty(flush_rows, dtype = TRACE_DTYPE)
+        self.size = 0 # records in buffer
+        self.count = 0 # records written
+
+    def record(self, start_id: int, end_id: int, bucket: int, mph: float, minutes: float, expanded: int, source: int) -> None:
+        self.buffer[self.size] = (start_id, end_id, bucket, mph, minutes, expanded, source)
+        self.size += 1
+        if self.size == len(self.buffer):
+            self.flush()
+
+    def flush(self) -> None:
+        self.buffer[:self.size].tofile(self.file)
+        self.file.flush()
+        self.count += self.size
+        self.size = 0
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+def read_trace(path: str) -> np.ndarray:
+    return np.fromfile(path, dtype = TRACE_DTYPE)
+
+
+def load_network() -> tuple:
+    '''
+    Road network alone, as T5.initialize loads it (compiled network file if present), without people or indexes
+
+    Returns (graph.ArrayGraph with Edge objects, <node_id: Node_Object>)
+    '''
+
+    from T5 import NETWORK_FILE
+
+    path = loaders.data_path(NETWORK_FILE)
+    if os.path.exists(path):
+        network = graph.ArrayGraph.load(path)
+    else:
+        node_ids, node_lats, node_lons = loaders.load_nodes(loaders.data_path('node_data.json'))
+        network = loaders.load_edge_graph(node_ids, node_lats, node_lons, loaders.data_path('edges.csv'))
+    nodes = {node_id: classes.Node(id = node_id, lat = lat, lon = lon)
+             for node_id, lat, lon in zip(network.node_ids.tolist(), network.lat.tolist(), network.lon.tolist())}
+    network.make_edges(nodes)
+    network.strongly_connected_components(nodes)
+    return network, nodes
+
+
+### Routers a trace can be replayed against: name -> (network, nodes) -> query function
+### (start Node, end Node, start time, mph) -> (minutes or -1, nodes expanded or -1 if not counted)
+
+def node_router(queue: str = None, dijkstra: bool = False):
+    def make(network, nodes):
+        if dijkstra:
+            return lambda start, end, start_time, mph: (start.shortest_path(end, start_time, queue), -1)
+        return lambda start, end, start_time, mph: (start.shortest_path_a_star(end, start_time, mph, queue = queue), -1)
+    return make
+
+
+def kernel_router(use_jit: bool):
+    def make(network, nodes):
+        import kernels
+
+        if use_jit and not kernels.HAS_NUMBA:
+            raise ValueError('The jit router needs Numba installed')
+        router = kernels.Router(network, use_jit)
+        for bucket in range(classes.NUM_BUCKETS):
+            router.bucket_weights(bucket) # edge travel times are not part of the query time
+        first = next(iter(nodes.values()))
+        router.shortest_path_a_star(first, first, classes.bucket_start_time(0), 1) # compiles the JIT kernel
+
+        def query(start, end, start_time, mph):
+            minutes = router.shortest_path_a_star(start, end, start_time, mph)
+            return minutes, router.expanded
+        return query
+    return make
+
+
+ROUTERS = {
+    'node': node_router(), # Node.shortest_path_a_star, binary heap
+    'node-radix': node_router('radix'),
+    'dijkstra': node_router(dijkstra = True), # Node.shortest_path, the exact times A* approximates
+    'dijkstra-radix': node_router('radix', dijkstra = True),
+    'kernel': kernel_router(False), # kernels.Router in pure Python
+    'jit': kernel_router(True),
+}
+
+
+def replay(records: np.ndarray, query, nodes: dict, tolerance: float = TOLERANCE) -> dict:
+    '''
+    Run every record of a trace through a router query function (see ROUTERS) and compare with the recorded minutes
+
+    Returns throughput and mismatch counts (different times, or a path found on one side only)
+    '''
+
+    starts, ends = records['start'].tolist(), records['end'].tolist()
+    buckets, mphs = records['bucket'].tolist(), records['mph'].tolist()
+    bucket_times = [classes.bucket_start_time(bucket) for bucket in range(classes.NUM_BUCKETS)]
+    minutes, expanded = np.empty(len(records)), np.empty(len(records), dtype = np.int64)
+
+    start_time = time.time()
+    for i, (start_id, end_id, bucket, mph) in enumerate(zip(starts, ends, buckets, mphs)):
+        minutes[i], expanded[i] = query(nodes[start_id], nodes[end_id], bucket_times[bucket], mph)
+    seconds = time.time() - start_time
+
+    recorded = records['minutes']
+    found, found_recorded = minutes >= 0, recorded >= 0
+    diff = np.where(found & found_recorded, np.abs(minutes - recorded), 0)
+    reachability = found != found_recorded
+    return {'queries': len(records), 'seconds': seconds, 'queries_per_s': len(records) / max(seconds, 1e-9),
+            'mismatches': int(np.sum((diff > tolerance) | reachability)), 'reachability_mismatches': int(np.sum(reachability)),
+            'max_diff': float(diff.max(initial = 0)), 'mean_expanded': float(expanded.mean()) if len(records) and expanded.min() >= 0 else -1}
+
+
+def describe(records: np.ndarray) -> dict:
+    # Query mix of a trace: what answered the queries, how many are distinct and how skewed the hour buckets are
+    sources = np.bincount(records['source'], minlength = len(TraceRecorder.SOURCES))
+    distinct = len(np.unique(np.column_stack((records['start'], records['end'], records['bucket'])), axis = 0))
+    buckets = np.bincount(records['bucket'], minlength = classes.NUM_BUCKETS)
+    searched = records['expanded'][(records['source'] == TraceRecorder.SEARCH) & (records['expanded'] >= 0)]
+    return {'records': len(records), **{name: int(count) for name, count in zip(TraceRecorder.SOURCES, sources)},
+            'distinct': distinct, 'busiest_bucket': int(np.argmax(buckets)) if len(records) else -1,
+            'busiest_bucket_share': float(buckets.max() / max(len(records), 1)),
+            'recorded_mean_expanded': float(searched.mean()) if len(searched) else -1}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Replay a routing trace (recorded with notuber simulate --trace) against routers')
+    parser.add_argument('path', help = 'trace file')
+    parser.add_argument('--routers', nargs = '+', choices = list(ROUTERS), default = ['kernel'])
+    parser.add_argument('--source', choices = TraceRecorder.SOURCES, default = None,
+                        help = 'only replay queries answered this way in the simulation (default: all)')
+    parser.add_argument('--limit', type = int, default = None, help = 'only replay the first LIMIT queries')
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE, help = 'minutes two results may differ by')
+    args = parser.parse_args()
+
+    records = read_trace(args.path)
+    print(', '.join(f'{key} {value:.2f}' if isinstance(value, float) else f'{key} {value}' for key, value in describe(records).items()))
+    if args.source is not None:
+        records = records[records['source'] == TraceRecorder.SOURCES.index(args.source)]
+    records = records[:args.limit]
+
+    START = time.time()
+    network, nodes = load_network()
+    print(f'Loaded network in {time.time() - START:.2f} seconds, replaying {len(records)} queries')
+    for name in args.routers:
+        result = replay(records, ROUTERS[name](network, nodes), nodes, args.tolerance)
+        print(f'{name:>14}: ' + ', '.join(f'{key} {value:.4g}' if isinstance(value, float) else f'{key} {value}' for key, value in result.items()))
@@ -0,0 +1,175 @@
+import time
+import math
+import datetime as dt
+
+import numpy as np
+
+import geo
+
+NODE_CAPACITY = 4 # Children per R-tree node (small nodes prune best with vectorized batch search)
+BATCH_SIZE = 1024 # Points searched together in nearest_batch (bounds the size of the candidate arrays)
+
+
+def str_order(boxes: np.ndarray, capacity: int) -> np.ndarray:
+    '''
+    Sort-Tile-Recursive packing order of boxes (n x [minx, miny, maxx, maxy]): sorted by x center into vertical slabs of
+    ceil(sqrt(n / capacity)) * capacity boxes, each slab sorted by y center, so consecutive runs of capacity boxes are compact tiles
+    '''
+
+    num_groups = math.ceil(len(boxes) / capacity)
+    slab_size = math.ceil(math.sqrt(num_groups)) * capacity
+    center_x = boxes[:, 0] + boxes[:, 2]
+    center_y = boxes[:, 1] + boxes[:, 3]
+    order = np.argsort(center_x, kind = 'stable')
+    for start in range(0, len(order), slab_size):
+        slab = order[start:start+slab_size]
+        order[start:start+slab_size] = slab[np.argsort(center_y[slab], kind = 'stable')]
+    return order
+
+
+class EdgeRTree:
+    '''
+    Static R-tree over road segments, bulk loaded with STR packing from graph.ArrayGraph arrays.
+    Finds the nearest edge to a point and the offset (0 at the start node, 1 at the end node) of the closest point on it,
+    so people can be placed on the road they are on instead of on the nearest intersection.
+        - graph: graph.ArrayGraph
+        - edges: optional boolean mask or indices of edges to index (e.g. edges of the main component)
+
+    Coordinates are planar miles (graph.ArrayGraph.x/y, see geo), distances returned are miles.
+    '''
+
+    def __init__(self, graph, edges = None, capacity: int = NODE_CAPACITY) -> None:
+        self.graph = graph
+        edges = np.arange(graph.num_edges) if edges is None else np.flatnonzero(edges) if np.asarray(edges).dtype == bool else np.asarray(edges)
+        x, y = graph.x, graph.y
+        ax, ay, bx, by = x[graph.edge_start[edges]], y[graph.edge_start[edges]], x[graph.edge_end[edges]], y[graph.edge_end[edges]]
+        boxes = np.column_stack((np.minimum(ax, bx), np.minimum(ay, by), np.maximum(ax, bx), np.maximum(ay, by)))
+
+        # Leaf entries in packing order
+        order = str_order(boxes, capacity)
+        self.edges = edges[order] # edge index of each leaf entry
+        self.segments = np.column_stack((ax, ay, bx, by))[order]
+        boxes = boxes[order]
+
+        # Pack levels bottom up until a single root: level l nodes have children child_start:child_end in level l-1
+        # (level 0 children are leaf entries)
+        self.boxes, self.child_start, self.child_end = [], [], []
+        while True:
+            starts = np.arange(0, len(boxes), capacity)
+            ends = np.minimum(starts + capacity, len(boxes))
+            parents = np.column_stack((np.minimum.reduceat(boxes[:, 0], starts), np.minimum.reduceat(boxes[:, 1], starts),
+                                       np.maximum.reduceat(boxes[:, 2], starts), np.maximum.reduceat(boxes[:, 3], starts)))
+            order = str_order(parents, capacity) if len(parents) > 1 else np.arange(1)
+            self.boxes.append(parents[order])
+            self.child_start.append(starts[order])
+            self.child_end.append(ends[order])
+            if len(parents) == 1:
+                break
+            boxes = parents[order]
+
+    def nearest_batch(self, coords, batch_size: int = BATCH_SIZE) -> tuple:
+        '''
+        Nearest edge of each point
+            - coords: (Q x 2) lat/lon
+
+        Points are searched together level by level: a node is kept for a point while its smallest distance is not above
+        the largest distance to the best node seen at that level (which bounds the distance to any segment inside it)
+
+        Returns (edges, offsets, distances), each of length Q: edge indices, offsets along the edge in [0, 1] and miles
+        '''
+
+        coords = np.asarray(coords, dtype = np.float64).reshape(-1, 2)
+        edges, offsets, dists = np.empty(len(coords), dtype = np.int64), np.empty(len(coords)), np.empty(len(coords))
+        for start in range(0, len(coords), batch_size):
+            stop = min(start + batch_size, len(coords))
+            edges[start:stop], offsets[start:stop], dists[start:stop] = self._search(*geo.project(coords[start:stop, 0], coords[start:stop, 1]))
+        return edges, offsets, dists
+
+    def _search(self, px: np.ndarray, py: np.ndarray) -> tuple:
+        num_points = len(px)
+        point = np.arange(num_points) # (point, node) candidate pairs
+        node = np.zeros(num_points, dtype = np.int64)
+        for level in range(len(self.boxes) - 1, -1, -1):
+            near, far = geo.box_euclidean_many(np.column_stack((px[point], py[point])), self.boxes[level][node])
+            bound = np.full(num_points, np.inf)
+            np.minimum.at(bound, point, far)
+            keep = near <= bound[point]
+            point, node = point[keep], node[keep]
+
+            # Replace each node by its children
+            starts, counts = self.child_start[level][node], self.child_end[level][node] - self.child_start[level][node]
+            first = np.cumsum(counts) - counts
+            node = np.repeat(starts - first, counts) + np.arange(counts.sum())
+            point = np.repeat(point, counts)
+
+        # Closest point on each candidate segment
+        segments = self.segments[node]
+        t, dist = geo.segment_euclidean_many(np.column_stack((px[point], py[point])), segments[:, 0:2], segments[:, 2:4])
+
+        # Best candidate of each point (lowest edge index on ties, e.g. both directions of a two-way street)
+        order = np.lexsort((self.edges[node], dist, point))
+        _, best = np.unique(point[order], return_index = True)
+        best = order[best]
+        return self.edges[node[best]], t[best], dist[best]
+
+    def nearest(self, coords: tuple) -> tuple:
+        '''
+        Returns (edge index, offset, miles) of the edge nearest to lat/lon coords
+        '''
+
+        edges, offsets, dists = self.nearest_batch([coords])
+        return int(edges[0]), float(offsets[0]), float(dists[0])
+
+
+def edge_point_path(route, graph, source: tuple, target: tuple, start_time: dt.datetime) -> tuple:
+    '''
+    Travel time between two points on edges (edge index, offset): rest of the source edge, then a node to node route
+    from its end node to the start node of the target edge, then the target edge up to the offset
+        - route: (start_node, end_node, start_time) -> (minutes, Edge objects), e.g. a traffic.RouteCache.shortest_path
+        - graph: graph.ArrayGraph with Edge objects (make_edges)
+
+    Returns (minutes, Edge objects driven, with source and target edges whole), (-1, []) if there is no path
+    '''
+
+    (source_edge, source_offset), (target_edge, target_offset) = source, target
+    first, last = graph.edges[source_edge], graph.edges[target_edge]
+    if source_edge == target_edge and target_offset >= source_offset:
+        return (target_offset - source_offset) * first.travel_time(start_time), [first]
+
+    head = (1 - source_offset) * first.travel_time(start_time)
+    minutes, path = route(first.end_node, last.start_node, start_time + dt.timedelta(minutes = head))
+    if minutes < 0:
+        return -1, []
+    arrival_time = start_time + dt.timedelta(minutes = head + minutes) # at the start of the target edge
+    return head + minutes + target_offset * last.travel_time(arrival_time), [first] + list(path) + [last]
+
+
+if __name__ == '__main__':
+    import random
+    import T5
+
+    T5.initialize()
+    rng = random.Random(0)
+    points = [passenger.coords for passenger in T5.PASSENGERS[:5000]] + [passenger.end_coords for passenger in T5.PASSENGERS[:5000]]
+    main = T5.GRAPH.component == T5.GRAPH.main_component
+
+    start = time.time()
+    tree = EdgeRTree(T5.GRAPH, main[T5.GRAPH.edge_start] & main[T5.GRAPH.edge_end])
+    print(f'Built R-tree over {len(tree.edges)} edges in {time.time() - start:.3f} seconds ({len(tree.boxes)} levels)')
+
+    start = time.time()
+    nodes = [T5.NODE_INDEX.get_kNN(1, coords)[0][1] for coords in points]
+    node_seconds = time.time() - start
+    start = time.time()
+    edges, offsets, dists = tree.nearest_batch(points)
+    edge_seconds = time.time() - start
+    node_dists = geo.euclidean_many(np.column_stack(geo.project(*np.array(points).T)), [node.xy for node in nodes])
+
+    # Exhaustive check on a sample
+    sample = rng.sample(range(len(points)), 200)
+    check = tree._search(*geo.project(np.array([points[i][0] for i in sample]), np.array([points[i][1] for i in sample])))
+    full = EdgeRTree(T5.GRAPH, tree.edges, capacity = len(tree.edges)) # single leaf node: brute force
+    brute = full.nearest_batch([points[i] for i in sample])
+    print(f'{len(points)} lookups: nearest node {node_seconds:.3f} s (mean {np.mean(node_dists) * 5280:.0f} ft away), '
+          f'nearest edge {edge_seconds:.3f} s (mean {np.mean(dists) * 5280:.0f} ft away)')
+    print(f'Matches brute force on {int(np.sum(np.isclose(check[2], brute[2])))} of {len(sample)} sampled points')
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+
+import classes
+
+### Service parameters
+HOST, PORT = '127.0.0.1', 8765
+MAX_PENDING = 200 # Ride requests waiting to be matched, beyond this requests are rejected (backpressure)
+BATCH_WINDOW = 0.002 # Seconds to wait for more requests to coalesce into one matching batch
+MAX_BATCH = 128 # Max requests matched per batch
+
+
+class MatchingService:
+    '''
+    Asyncio matching server over newline-delimited JSON on a local socket.
+
+    Requests:
+        {"type": "driver", "id": 1, "time": "04/25/2014 00:14:00", "lat": 40.667, "lon": -73.8713}  (driver location ping / available)
+        {"type": "ride", "id": 1, "time": "04/25/2014 00:00:00", "lat": ..., "lon": ..., "end_lat": ..., "end_lon": ...}
+    Responses (streamed back as soon as each ride is matched, not in request order):
+        {"type": "assignment", "ride": 1, "driver": 7, "eta": 3.2}
+        {"type": "rejected", "ride": 1, "reason": "busy" | "no_drivers"}
+
+    Ride requests are coalesced into batches matched by a single task, and the pending queue is bounded:
+    once it is full, new requests are rejected immediately instead of queueing behind the backlog.
+        - driver_index: Grid or QuadTree (anything with add_driver, move_driver_to, remove_driver, get_closest_driver)
+    '''
+
+    def __init__(self, driver_index, max_pending: int = MAX_PENDING, batch_window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH) -> None:
+        self.driver_index = driver_index
+        self.drivers = {} # <driver id: Driver_Object> drivers currently in index
+        self.pending = asyncio.Queue(maxsize = max_pending)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+        self.server = None
+        self.matcher = None
+        self.stats = {'rides': 0, 'assigned': 0, 'rejected': 0, 'pings': 0, 'batches': 0}
+
+    async def start(self, host: str = HOST, port: int = PORT) -> None:
+        self.matcher = asyncio.create_task(self.match_loop())
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.matcher is not None:
+            self.matcher.cancel()
+
+    def update_driver(self, message: dict) -> None:
+        '''
+        Driver location ping: add driver to the index or move it
+        '''
+
+        self.stats['pings'] += 1
+        driver_id = message['id']
+        coords = (float(message['lat']), float(message['lon']))
+        driver = self.drivers.get(driver_id)
+        if driver is None:
+            driver = classes.Driver(id = driver_id, timestamp = message['time'], lat = coords[0], lon = coords[1])
+            self.drivers[driver_id] = driver
+            self.driver_index.add_driver(driver)
+        else:
+            driver.time = classes.parse_timestamp(message['time'])
+            self.driver_index.move_driver_to(driver, coords)
+
+    def match(self, passenger: classes.Passenger) -> dict:
+        '''
+        Assign closest driver to passenger and take driver out of the index until its next ping
+        '''
+
+        if not self.drivers:
+            return {'type': 'rejected', 'ride': passenger.id, 'reason': 'no_drivers'}
+
+        eta, driver = self.driver_index.get_closest_driver(passenger.coords, passenger.time)
+        if driver is None:
+            return {'type': 'rejected', 'ride': passenger.id, 'reason': 'no_drivers'}
+
+        self.driver_index.remove_driver(driver)
+        del self.drivers[driver.id]
+        return {'type': 'assignment', 'ride': passenger.id, 'driver': driver.id, 'eta': eta}
+
+    async def match_loop(self) -> None:
+        '''
+        Take ride requests off the pending queue in batches and match them
+        '''
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Match in request time order so earlier requests get first pick of drivers
+            batch.sort(key = lambda item: item[0].time)
+            for passenger, future in batch:
+                response = self.match(passenger)
+                self.stats['assigned' if response['type'] == 'assignment' else 'rejected'] += 1
+                if not future.done():
+                    future.set_result(response)
+            self.stats['batches'] += 1
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        write_lock = asyncio.Lock()
+        responses = set()
+
+        async def send(response: dict) -> None:
+            async with write_lock:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+
+        async def respond(future) -> None:
+            await send(await future)
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+
+                if message['type'] == 'driver':
+                    self.update_driver(message)
+                elif message['type'] == 'ride':
+                    self.stats['rides'] += 1
+                    passenger = classes.Passenger(id = message['id'], timestamp = message['time'],
+                                                  start_lat = float(message['lat']), start_lon = float(message['lon']),
+                                                  end_lat = float(message['end_lat']), end_lon = float(message['end_lon']))
+                    future = asyncio.get_running_loop().create_future()
+                    try:
+                        self.pending.put_nowait((passenger, future))
+                    except asyncio.QueueFull:
+                        self.stats['rejected'] += 1
+                        await send({'type': 'rejected', 'ride': passenger.id, 'reason': 'busy'})
+                        continue
+                    task = asyncio.create_task(respond(future))
+                    responses.add(task)
+                    task.add_done_callback(responses.discard)
+
+            if responses:
+                await asyncio.gather(*responses)
+        finally:
+            writer.close()
+
+
+async def serve(driver_index, host: str = HOST, port: int = PORT) -> None:
+    service = MatchingService(driver_index)
+    await service.start(host, port)
+    print(f'Matching service listening on {host}:{port}')
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == '__main__':
+    import T5
+
+    START = time.time()
+    print('Initializing...')
+    T5.initialize()
+    print(f'Finished initializing in {time.time() - START} seconds.')
+    asyncio.run(serve(T5.DRIVER_INDEX))
@@ -0,0 +1,320 @@
+import os
+import time
+import argparse
+import datetime as dt
+import multiprocessing as mp
+
+import numpy as np
+
+import classes
+import checkpoint
+import T5
+from datastructures import Grid, QuadTree, OngoingRides, GRID_WIDTH, GRID_HEIGHT
+
+NUM_SHARDS = os.cpu_count() or 1
+STEP_MINUTES = 5 # Shards run in lock step: every shard finishes a step before boundary handoffs are exchanged
+FUTURE_DRIVERS = 10 # Busy drivers pulled into an empty shard's index, like T5.main
+MAX_ETA = 20 # Minutes, passengers whose best driver in their shard is further away are offered to an adjacent shard, which takes them only within this ETA
+
+
+def cell_of(coords: tuple) -> int:
+    return Grid.idx2cell(Grid.coord2idx(coords))
+
+
+def partition_cells(passengers: list, num_shards: int) -> np.ndarray:
+    '''
+    Split the Grid cells into num_shards bands of consecutive cells (row-major, so latitude bands) with about
+    the same number of pickups each
+
+    Returns (GRID_WIDTH * GRID_HEIGHT,) shard of every cell
+    '''
+
+    counts = np.bincount([cell_of(passenger.coords) for passenger in passengers], minlength = GRID_WIDTH * GRID_HEIGHT)
+    before = np.cumsum(counts) - counts # pickups in earlier cells
+    return np.minimum(before * num_shards // max(counts.sum(), 1), num_shards - 1)
+
+
+def driver_record(driver_idx: int, driver: classes.Driver) -> tuple:
+    '''
+    What a shard needs to take over a driver: the driver's position in T5.DRIVERS, availability, location and rides done
+    (routes stay with the shard that drove them, the taking shard places the driver at its drop off until it is free)
+    '''
+
+    edge, offset = driver.edge_point if driver.edge_point is not None else (-1, 0.0)
+    return (driver_idx, checkpoint.to_micros(driver.time), driver.coords[0], driver.coords[1],
+            driver.node.id if driver.node is not None else -1, edge, offset, T5.CONFIG.rides.get(driver.id, 0))
+
+
+def restore_driver(record: tuple) -> classes.Driver:
+    # Put a driver of T5.DRIVERS back in the state of a driver_record
+    driver_idx, micros, lat, lon, node_id, edge, offset, rides = record
+    driver = T5.DRIVERS[driver_idx]
+    driver.time = checkpoint.from_micros(micros)
+    driver.coords = (lat, lon)
+    driver.node = T5.NODES[node_id] if node_id >= 0 else None
+    driver.edge_point = (edge, offset) if edge >= 0 else None
+    driver.route = None
+    T5.CONFIG.rides[driver.id] = rides
+    return driver
+
+
+class Shard:
+    '''
+    Matcher and router for the drivers and pickups of a set of Grid cells, with its own driver index and ongoing rides.
+    Runs in its own process, on its own copy of the T5 network and people (same objects, same order in every process).
+        - shard_id: index of this shard
+        - cell_shard: shard of every Grid cell (see partition_cells)
+    '''
+
+    def __init__(self, shard_id: int, cell_shard: np.ndarray) -> None:
+        self.id = shard_id
+        self.cell_shard = cell_shard
+        self.driver_index = QuadTree(capacity = T5.BUCKET_CAPACITY, avg_mph = T5.AVG_MPH)
+        self.ongoing_rides = OngoingRides()
+        self.en_route = {} # Drivers in the index before their ride is over <driver id: Driver>
+        self.driver_idx = {} # <driver id: position in T5.DRIVERS>
+        self.wait_times, self.idle_times = [], []
+        self.total_profit = 0
+
+    def receive(self, records: list) -> None:
+        # Drivers handed to this shard (or starting in it)
+        for record in records:
+            driver = restore_driver(record)
+            self.driver_idx[driver.id] = record[0]
+            self.ongoing_rides.push(driver)
+
+    def step(self, passenger_ids: list, arrivals: list, forwarded: dict = None, step_start: dt.datetime = None,
+             neighbor_idle: int = 0) -> tuple:
+        '''
+        Take over arriving drivers, then match the passengers of one time step in request order
+            - forwarded: passengers not served in the previous step <passenger id: final>. Offers from an adjacent shard
+                         (final False) are only taken within MAX_ETA, final ones are matched however far the best driver
+                         is. Either way the driver leaves no earlier than step_start
+            - neighbor_idle: most idle drivers an adjacent shard had at the end of the previous step
+
+        Returns (handoffs, unserved, idle): (shard, driver record) for drivers whose drop off is in another shard,
+        (passenger id, best ETA here or inf) of passengers left for another shard, and number of idle drivers the shard has left
+        '''
+
+        forwarded = forwarded or {}
+        self.receive(arrivals)
+        handoffs, unserved = [], []
+        for passenger_id in passenger_ids:
+            passenger = T5.PASSENGERS[passenger_id]
+            T5.move_en_route(self.driver_index, self.en_route, passenger.time)
+            for driver in self.ongoing_rides.pop_completed(passenger.time + dt.timedelta(minutes = T5.EN_ROUTE_WINDOW)):
+                T5.index_driver(self.driver_index, self.en_route, driver, passenger.time)
+            for _ in range(FUTURE_DRIVERS if self.driver_index.driver_count == 0 else 0):
+                if len(self.ongoing_rides) == 0:
+                    break
+                T5.index_driver(self.driver_index, self.en_route, self.ongoing_rides.pop(), passenger.time)
+            if self.driver_index.driver_count == 0:
+                unserved.append((passenger_id, float('inf')))
+                continue
+
+            eta, driver = self.driver_index.get_closest_driver(passenger.coords, passenger.time)
+            final = forwarded.get(passenger_id)
+            if eta > MAX_ETA and (final is False or (final is None and neighbor_idle > 0)):
+                unserved.append((passenger_id, eta))
+                continue
+            self.driver_index.remove_driver(driver)
+            self.en_route.pop(driver.id, None)
+            wait_time, idle_time, profit, keeps_driving = T5.serve(driver, passenger, step_start if passenger_id in forwarded else None)
+            self.wait_times.append(wait_time)
+            self.idle_times.append(idle_time)
+            self.total_profit += profit
+            if not keeps_driving:
+                continue
+
+            # Drivers dropping off in another shard's cells are handed to it at the end of the step
+            shard = int(self.cell_shard[cell_of(driver.coords)])
+            if shard == self.id:
+                self.ongoing_rides.push(driver)
+            else:
+                handoffs.append((shard, driver_record(self.driver_idx.pop(driver.id), driver)))
+
+        return handoffs, unserved, self.driver_index.driver_count
+
+    def summary(self) -> dict:
+        return {'wait_times': self.wait_times, 'idle_times': self.idle_times, 'total_profit': self.total_profit}
+
+
+def band_bounds(cell_shard: np.ndarray, num_shards: int) -> tuple:
+    '''
+    First and last cell of every shard's band (partition_cells bands are consecutive cells), -1 for an empty band
+    '''
+
+    cells = np.arange(len(cell_shard))
+    first, last = np.full(num_shards, -1), np.full(num_shards, -1)
+    for k in range(num_shards):
+        band = cells[cell_shard == k]
+        if len(band):
+            first[k], last[k] = band[0], band[-1]
+    return first, last
+
+
+def forward(unserved: list, tried: dict, cell_shard: np.ndarray, bounds: tuple, idle: list) -> tuple:
+    '''
+    Where each passenger nobody served in a step goes next: the adjacent band nearest to the pickup that hasn't been
+    offered the passenger yet and has idle drivers (it takes the passenger within MAX_ETA), otherwise the band that had
+    the best ETA for it, which takes it whatever the ETA (the nearest band with idle drivers if none had a driver)
+        - unserved: (shard, passenger id, best ETA in that shard) returned by the shards
+        - tried: <passenger id: {shard: ETA}> of the shards the passenger was offered to, updated
+
+    Returns (<shard: {passenger id: final}>, number of offers to adjacent shards)
+    '''
+
+    first, last = bounds
+    offers, adjacent = {}, 0
+    for shard_id, passenger_id, eta in unserved:
+        cell = cell_of(T5.PASSENGERS[passenger_id].coords)
+        home = int(cell_shard[cell])
+        etas = tried.setdefault(passenger_id, {})
+        etas[shard_id] = eta
+        distance = lambda k: max(first[k] - cell, cell - last[k], 0) if first[k] >= 0 else np.inf
+        neighbors = sorted((k for k in (home - 1, home + 1) if 0 <= k < len(first) and k not in etas and idle[k] > 0), key = distance)
+        if neighbors:
+            offers.setdefault(neighbors[0], {})[passenger_id] = False
+            adjacent += 1
+            continue
+        target = min(etas, key = lambda k: (etas[k], k != home))
+        staffed = [k for k in range(len(first)) if idle[k] > 0]
+        if etas[target] == np.inf and staffed:
+            target = min(staffed, key = distance)
+        offers.setdefault(target, {})[passenger_id] = True
+    return offers, adjacent
+
+
+def worker(shard_id: int, cell_shard: np.ndarray, conn) -> None:
+    '''
+    Shard process: answers step messages until it receives None, then sends its summary
+    '''
+
+    if T5.GRAPH is None: # Started with spawn instead of fork
+        T5.initialize()
+    T5.CONFIG.draw_dropouts(T5.DRIVERS)
+    shard = Shard(shard_id, cell_shard)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        conn.send(shard.step(*message))
+    conn.send(shard.summary())
+
+
+class InlineShard:
+    '''
+    Same messages as a shard process, run in this process (one shard, or to compare with the processes)
+    '''
+
+    def __init__(self, shard_id: int, cell_shard: np.ndarray) -> None:
+        self.shard = Shard(shard_id, cell_shard)
+        self.reply = None
+
+    def send(self, message) -> None:
+        self.reply = self.shard.summary() if message is None else self.shard.step(*message)
+
+    def recv(self):
+        return self.reply
+
+
+def run(num_shards: int = NUM_SHARDS, step_minutes: float = STEP_MINUTES, processes: bool = True) -> dict:
+    '''
+    Simulate T5.PASSENGERS over num_shards Grid cell shards after T5.initialize.
+
+    Every time step, each shard gets the requests picked up in its cells, the drivers handed to it at the end of the
+    previous step and passengers its shard had no driver for within MAX_ETA (offered to the adjacent band nearest to the
+    pickup, which takes them within MAX_ETA too, and once no adjacent band can, matched by the band with the best ETA
+    whatever it is, counting the steps they waited, see forward).
+    Shards match and route in parallel, and the coordinator waits for all of them before exchanging handoffs, so a
+    driver dropping off across a boundary joins the next shard up to one step late.
+
+    Inline shards move the drivers of this process, they are put back as they were before returning.
+
+    Returns merged metrics
+    '''
+
+    cell_shard = partition_cells(T5.PASSENGERS, num_shards)
+    T5.CONFIG.draw_dropouts(T5.DRIVERS)
+    initial = [driver_record(driver_idx, driver) for driver_idx, driver in enumerate(T5.DRIVERS)]
+    inbox = [[] for _ in range(num_shards)] # driver records for each shard
+    for record in initial:
+        inbox[int(cell_shard[cell_of((record[2], record[3]))])].append(record)
+
+    # Requests by time step and pickup shard
+    start_time = min(passenger.time for passenger in T5.PASSENGERS)
+    steps = {}
+    for passenger_id, passenger in enumerate(T5.PASSENGERS):
+        step = int((passenger.time - start_time).total_seconds() // (step_minutes * 60))
+        steps.setdefault(step, [[] for _ in range(num_shards)])[int(cell_shard[cell_of(passenger.coords)])].append(passenger_id)
+
+    if processes:
+        context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context('spawn')
+        pipes = [context.Pipe() for _ in range(num_shards)]
+        workers = [context.Process(target = worker, args = (k, cell_shard, child)) for k, (_, child) in enumerate(pipes)]
+        for process in workers:
+            process.start()
+        shards = [parent for parent, _ in pipes]
+    else:
+        shards = [InlineShard(k, cell_shard) for k in range(num_shards)]
+
+    bounds = band_bounds(cell_shard, num_shards)
+    unserved, tried, idle, handoffs, forwards = [], {}, [0] * num_shards, 0, 0
+    step, last_step = 0, max(steps)
+    while step <= last_step or (unserved and step <= last_step + 2 * num_shards): # a few extra steps to hand over the last requests
+        passenger_ids = steps.get(step, [[] for _ in range(num_shards)])
+        offers, adjacent = forward(unserved, tried, cell_shard, bounds, idle)
+        forwarded = [offers.get(k, {}) for k in range(num_shards)]
+        forwards += adjacent
+        for k in offers:
+            passenger_ids[k] = sorted(list(offers[k]) + passenger_ids[k], key = lambda p: (T5.PASSENGERS[p].time, p))
+        step_start = start_time + dt.timedelta(minutes = step * step_minutes)
+        for k, shard in enumerate(shards):
+            neighbor_idle = max((idle[j] for j in (k - 1, k + 1) if 0 <= j < num_shards), default = 0)
+            shard.send((passenger_ids[k], inbox[k], forwarded[k], step_start, neighbor_idle))
+
+        # Barrier: every shard finished the step
+        inbox, unserved = [[] for _ in range(num_shards)], []
+        for k, shard in enumerate(shards):
+            shard_handoffs, shard_unserved, idle[k] = shard.recv()
+            for target, record in shard_handoffs:
+                inbox[target].append(record)
+            unserved += [(k, passenger_id, eta) for passenger_id, eta in shard_unserved]
+            handoffs += len(shard_handoffs)
+        step += 1
+
+    summaries = []
+    for shard in shards:
+        shard.send(None)
+        summaries.append(shard.recv())
+    if processes:
+        for process in workers:
+            process.join()
+    else:
+        for record in initial:
+            restore_driver(record)
+
+    wait_times = [t for summary in summaries for t in summary['wait_times']]
+    idle_times = [t for summary in summaries for t in summary['idle_times']]
+    return {'shards': num_shards, 'served': len(wait_times), 'unserved': len(T5.PASSENGERS) - len(wait_times),
+            'handoffs': handoffs, 'forwarded': forwards, 'avg_wait': sum(wait_times) / max(len(wait_times), 1),
+            'avg_idle': sum(idle_times) / max(len(idle_times), 1), 'total_profit': sum(summary['total_profit'] for summary in summaries)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'T5 simulation sharded over Grid cells, one process per shard')
+    parser.add_argument('--shards', type = int, nargs = '+', default = [NUM_SHARDS], help = 'shard counts to run (e.g. 1 2 4)')
+    parser.add_argument('--step', type = float, default = STEP_MINUTES, help = 'minutes per synchronized time step')
+    parser.add_argument('--passengers', type = int, default = None, help = 'only simulate the first n passengers')
+    parser.add_argument('--inline', action = 'store_true', help = 'run the shards one after another in this process')
+    args = parser.parse_args()
+
+    T5.initialize()
+    if args.passengers is not None:
+        T5.PASSENGERS[:] = T5.PASSENGERS[:args.passengers]
+    for num_shards in args.shards:
+        START = time.time()
+        result = run(num_shards, args.step, not args.inline)
+        seconds = time.time() - START
+        print(f'{num_shards} shards: {seconds:.2f} s, {result["served"] / seconds:.1f} passengers/s, '
+              + ', '.join(f'{key} {value:.2f}' if isinstance(value, float) else f'{key} {value}' for key, value in result.items()))
@@ -0,0 +1,84 @@
+import numpy as np
+
+SEED = 0
+DROPOUT_P = 1 / 15 # Chance a driver stops after each ride (geometric number of rides, 15 expected)
+
+GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    '''
+    Vectorized SplitMix64 finalizer: maps uint64 keys to well mixed uint64 values
+    '''
+
+    with np.errstate(over = 'ignore'):
+        z = x + GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * MIX1
+        z = (z ^ (z >> np.uint64(27))) * MIX2
+        return z ^ (z >> np.uint64(31))
+
+
+def uniforms(seed: int, driver_ids, draw: int = 0) -> np.ndarray:
+    '''
+    Counter-based per-driver streams: the draw-th uniform in [0, 1) of each driver's stream.
+    Each value only depends on (seed, driver id, draw), so it doesn't matter how many drivers there are,
+    in which order they are matched, or which process asks.
+    '''
+
+    ids = np.asarray(driver_ids, dtype = np.int64).astype(np.uint64)
+    key = splitmix64(splitmix64(np.uint64(seed)) ^ ids)
+    bits = splitmix64(key + np.uint64(draw))
+    return (bits >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+
+class SimConfig:
+    '''
+    Owns the randomness of a simulation run, so two runs with the same seed do exactly the same rides (and routing work).
+        - seed: seed of every driver stream
+        - dropout_p: chance a driver stops after each ride
+
+    Drop out is decided up front: the number of rides each driver does is drawn from the driver's own stream
+    in one vectorized batch (draw_dropouts), instead of calling random.randint after every ride.
+    '''
+
+    def __init__(self, seed: int = SEED, dropout_p: float = DROPOUT_P) -> None:
+        self.seed = seed
+        self.dropout_p = dropout_p
+        self.quota = {} # <driver id: rides before driver drops out>
+        self.rides = {} # <driver id: rides done>
+
+    def driver_rng(self, driver_id: int) -> np.random.Generator:
+        '''
+        Independent NumPy generator for any other randomness of a driver
+        '''
+
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key = (int(driver_id),)))
+
+    def ride_quotas(self, driver_ids) -> np.ndarray:
+        '''
+        Geometric number of rides (>= 1) for each driver id, by inverse CDF of the first uniform of its stream
+        '''
+
+        u = 1 - uniforms(self.seed, driver_ids) # (0, 1]
+        if self.dropout_p >= 1:
+            return np.ones(len(u), dtype = np.int64)
+        if self.dropout_p <= 0:
+            return np.full(len(u), np.iinfo(np.int64).max, dtype = np.int64)
+        return np.floor(np.log(u) / np.log1p(-self.dropout_p)).astype(np.int64) + 1
+
+    def draw_dropouts(self, drivers) -> None:
+        ids = [driver.id for driver in drivers]
+        self.quota.update(zip(ids, self.ride_quotas(ids).tolist()))
+        self.rides.update((id, 0) for id in ids)
+
+    def keeps_driving(self, driver) -> bool:
+        '''
+        Count a finished ride, True if the driver takes another ride
+        '''
+
+        if driver.id not in self.quota:
+            self.draw_dropouts([driver])
+        self.rides[driver.id] += 1
+        return self.rides[driver.id] < self.quota[driver.id]
@@ -0,0 +1,253 @@
+import csv
+import queue
+from collections import OrderedDict
+
+import numpy as np
+
+import classes
+from datastructures import Grid
+
+RECOMPUTE_ROWS = 1 # Stale cell travel time rows recomputed per poll (one one-to-all search each), until invalidated buckets are whole again
+
+
+class RouteCache:
+    '''
+    LRU cache of A* results keyed by (start node id, end node id, hour bucket).
+    Keeps an index from edge to the cached paths using it, so a speed update only drops the paths it touches.
+        - hubs: optional hubs.HubTables, trips from or to a hub node are answered from the tables instead
+        - router: optional kernels.Router, runs A* over the graph arrays instead of Node.shortest_path_a_star
+        - trace: optional routetrace.TraceRecorder, every query is recorded to it with what answered it
+    '''
+
+    def __init__(self, max_size: int = 100000, hubs = None, router = None, trace = None) -> None:
+        self.max_size = max_size
+        self.hubs = hubs
+        self.router = router
+        self.trace = trace
+        self.routes = OrderedDict() # <(start_id, end_id, bucket): (time, Edge objects on path)>
+        self.edge_routes = {} # <(edge index, bucket): set of route keys>
+        self.hits = 0
+        self.misses = 0
+        self.hub_hits = 0
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def shortest_path(self, start_node: classes.Node, end_node: classes.Node, start_time, AVG_MPH, return_path: bool = False) -> float:
+        '''
+        Cached Node.shortest_path_a_star (edges must have an index attribute, see graph.ArrayGraph.make_edges)
+            - return_path: also return the Edge objects on the path, i.e. (time, edges)
+        '''
+
+        if self.hubs is not None:
+            result = self.hubs.shortest_path(start_node, end_node, start_time, return_path)
+            if result is not None:
+                self.hub_hits += 1
+                if self.trace is not None:
+                    self.trace.record(start_node.id, end_node.id, classes.hour_bucket(start_time), AVG_MPH,
+                                      result[0] if return_path else result, 0, self.trace.HUB)
+                return result
+
+        bucket = classes.hour_bucket(start_time)
+        key = (start_node.id, end_node.id, bucket)
+        if key in self.routes:
+            self.hits += 1
+            self.routes.move_to_end(key)
+            time, path = self.routes[key]
+            if self.trace is not None:
+                self.trace.record(start_node.id, end_node.id, bucket, AVG_MPH, time, 0, self.trace.CACHE)
+            return (time, list(path)) if return_path else time
+
+        self.misses += 1
+        if self.router is not None:
+            time, path = self.router.shortest_path_a_star(start_node, end_node, start_time, AVG_MPH, return_path = True)
+        else:
+            time, path = start_node.shortest_path_a_star(end_node, start_time, AVG_MPH, return_path = True)
+        if self.trace is not None:
+            self.trace.record(start_node.id, end_node.id, bucket, AVG_MPH, time,
+                              self.router.expanded if self.router is not None else -1, self.trace.SEARCH)
+        self.routes[key] = (time, tuple(path))
+        for edge in path:
+            self.edge_routes.setdefault((edge.index, bucket), set()).add(key)
+
+        if len(self.routes) > self.max_size:
+            self.remove(next(iter(self.routes)))
+        return (time, path) if return_path else time
+
+    def remove(self, key) -> None:
+        _, path = self.routes.pop(key)
+        for e in {edge.index for edge in path}:
+            keys = self.edge_routes.get((e, key[2]))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.edge_routes[(e, key[2])]
+
+    def invalidate_edges(self, edge_buckets) -> int:
+        '''
+        Drop cached paths that use any of the given (edge index, bucket) pairs
+
+        Returns number of paths dropped
+        '''
+
+        dropped = 0
+        for edge_bucket in edge_buckets:
+            for key in list(self.edge_routes.get(edge_bucket, ())):
+                if key in self.routes:
+                    self.remove(key)
+                    dropped += 1
+        return dropped
+
+    def invalidate_buckets(self, buckets) -> int:
+        '''
+        Drop every cached path in the given hour buckets
+        '''
+
+        keys = [key for key in self.routes if key[2] in buckets]
+        for key in keys:
+            self.remove(key)
+        return len(keys)
+
+
+def read_updates(path: str) -> list:
+    '''
+    Read speed updates from csv file with header start_id,end_id,bucket,mph
+
+    Returns list of (start_id, end_id, bucket, mph)
+    '''
+
+    with open(path, 'r') as f:
+        _ = f.readline()
+        return [(int(start_id), int(end_id), int(bucket), float(mph)) for start_id, end_id, bucket, mph in csv.reader(f)]
+
+
+def feed_from_file(path: str, updates_queue: queue.Queue, batch_size: int = 1000) -> None:
+    '''
+    Stand-in for a live traffic feed: put updates from a file on a queue in batches
+    '''
+
+    updates = read_updates(path)
+    for i in range(0, len(updates), batch_size):
+        updates_queue.put(updates[i:i+batch_size])
+
+
+class TrafficUpdater:
+    '''
+    Applies batched speed updates to the network and invalidates only the derived data they affect
+        - graph: graph.ArrayGraph whose speed table is updated (and its Edge objects, if built from nodes)
+        - grid: optional Grid whose average speeds were calculated from graph (refreshed incrementally)
+        - route_cache: optional RouteCache, paths using updated edges are dropped (and its hub tables of updated buckets are rebuilt on lookup)
+        - travel_times: optional traveltimes.CellTravelTimes, hour buckets with updated edges are marked stale and
+                        recomputed recompute_rows rows per poll (rows looked up before are recomputed right away). The grid's
+                        isochrone bitsets of those buckets are turned off meanwhile and rebuilt once the bucket is whole
+        - strict: a faster edge can make a cached path that doesn't use it suboptimal. If strict, any speed
+                  increase drops all cached paths in that bucket, otherwise only paths using updated edges are dropped
+    '''
+
+    def __init__(self, graph, grid: Grid = None, route_cache: RouteCache = None, travel_times = None, strict: bool = False,
+                 recompute_rows: int = RECOMPUTE_ROWS) -> None:
+        self.graph = graph
+        self.grid = grid
+        self.route_cache = route_cache
+        self.travel_times = travel_times
+        self.strict = strict
+        self.recompute_rows = recompute_rows
+        self.pending = set() # Hour buckets of travel_times being recomputed
+        self.applied = [] # Every applied (start_id, end_id, bucket, mph) update, in order (e.g. for checkpoints)
+
+    def apply(self, updates) -> dict:
+        '''
+        Apply a batch of (start_id, end_id, bucket, mph) updates
+
+        Returns summary of what was updated and invalidated
+        '''
+
+        new_speeds = {} # <edge index: {bucket: mph}>
+        unknown = 0
+        for start_id, end_id, bucket, mph in updates:
+            e = self.graph.edge_index(start_id, end_id)
+            if e < 0 or mph <= 0:
+                unknown += 1
+                continue
+            new_speeds.setdefault(e, {})[bucket] = mph
+            self.applied.append((start_id, end_id, bucket, mph))
+
+        summary = {'edges': len(new_speeds), 'skipped': unknown, 'cells': 0, 'routes_invalidated': 0}
+        if not new_speeds:
+            return summary
+
+        edge_idx = np.fromiter(new_speeds.keys(), dtype = np.int64, count = len(new_speeds))
+        old_rows = self.graph.speeds[edge_idx].copy()
+        rows = old_rows.copy()
+        edge_buckets = []
+        faster_buckets = set()
+        for i, e in enumerate(edge_idx):
+            for bucket, mph in new_speeds[e].items():
+                rows[i, bucket] = mph
+                edge_buckets.append((int(e), bucket))
+                if mph > old_rows[i, bucket]:
+                    faster_buckets.add(bucket)
+
+        # Speed table and per-cell average speeds
+        if self.grid is not None and self.grid.speed_profile is not None:
+            cells = self.grid.update_speeds(edge_idx, rows)
+        else:
+            self.graph.speeds[edge_idx] = rows
+            cells = np.unique(np.concatenate([
+                [Grid.idx2cell(Grid.coord2idx((self.graph.lat[n], self.graph.lon[n]))) for n in self.graph.edge_start[edge_idx]],
+                [Grid.idx2cell(Grid.coord2idx((self.graph.lat[n], self.graph.lon[n]))) for n in self.graph.edge_end[edge_idx]]]))
+        summary['cells'] = len(cells)
+
+        # Edge objects used by Node routing
+        if self.graph.edges is not None:
+            for e, bucket in edge_buckets:
+                self.graph.edges[e].set_speed(bucket, float(new_speeds[e][bucket]))
+
+        # Derived data
+        if self.route_cache is not None:
+            summary['routes_invalidated'] = self.route_cache.invalidate_edges(edge_buckets)
+            if self.strict and faster_buckets:
+                summary['routes_invalidated'] += self.route_cache.invalidate_buckets(faster_buckets)
+            if self.route_cache.hubs is not None:
+                self.route_cache.hubs.invalidate({bucket for _, bucket in edge_buckets})
+            if self.route_cache.router is not None:
+                self.route_cache.router.invalidate({bucket for _, bucket in edge_buckets})
+        if self.travel_times is not None:
+            buckets = {bucket for _, bucket in edge_buckets}
+            self.travel_times.invalidate(buckets)
+            self.pending |= buckets
+            if self.grid is not None and self.grid.isochrones is not None:
+                self.grid.isochrones.refresh(buckets)
+
+        return summary
+
+    def catch_up(self) -> None:
+        '''
+        Recompute the next recompute_rows stale rows of the travel time table, and rebuild the isochrone bitsets of
+        buckets that are whole again
+        '''
+
+        if not self.pending:
+            return
+        self.travel_times.recompute(self.recompute_rows)
+        done = {bucket for bucket in self.pending if not self.travel_times.stale[bucket].any()}
+        if done and self.grid is not None and self.grid.isochrones is not None:
+            self.grid.isochrones.refresh(done)
+        self.pending -= done
+
+    def poll(self, updates_queue: queue.Queue) -> list:
+        '''
+        Apply every batch currently on the queue without blocking, then catch up on stale travel times
+
+        Returns list of batch summaries
+        '''
+
+        summaries = []
+        while True:
+            try:
+                updates = updates_queue.get_nowait()
+            except queue.Empty:
+                break
+            summaries.append(self.apply(updates))
+        self.catch_up()
+        return summaries
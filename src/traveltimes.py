@@ -0,0 +1,206 @@
+import datetime as dt
+
+import numpy as np
+
+import classes
+import geo
+import loaders
+from datastructures import Grid, GRID_WIDTH, GRID_HEIGHT
+
+NUM_CELLS = GRID_WIDTH * GRID_HEIGHT
+ISOCHRONE_MINUTES = (5, 10, 15, 20) # Reachability thresholds of CellIsochrones, ascending
+DEFAULT_PATH = loaders.data_path('cell_travel_times.npz')
+
+
+class CellTravelTimes:
+    '''
+    Precomputed network travel times (minutes) between representative nodes of every pair of Grid cells, for each hour bucket
+        - times: (NUM_BUCKETS x NUM_CELLS x NUM_CELLS) array, times[bucket, from_cell, to_cell]
+        - rep_nodes: node id representing each cell (-1 if the cell has no nodes)
+        - graph: optional graph.ArrayGraph (with current speeds) that invalidated rows are recomputed on
+
+    Lookups are O(1) table reads, so the table can be used as a pre-filter before exact routing.
+    '''
+
+    def __init__(self, times: np.ndarray, rep_nodes: np.ndarray, graph = None) -> None:
+        self.times = times
+        self.rep_nodes = rep_nodes
+        self.graph = graph
+        self.stale = np.zeros((classes.NUM_BUCKETS, NUM_CELLS), dtype = bool) # rows invalidated by traffic, [bucket, from_cell]
+        self.rep_cells = np.flatnonzero(rep_nodes >= 0) # cells with a representative node
+
+    @staticmethod
+    def representative_node(grid_space, component: int = None):
+        '''
+        Node in grid space closest to the center of the grid space (None if the grid space has no such nodes)
+            - component: only consider nodes of this strongly connected component (see graph.ArrayGraph.strongly_connected_components)
+        '''
+
+        center = geo.project((grid_space.lat_bounds[0] + grid_space.lat_bounds[1]) / 2, (grid_space.lon_bounds[0] + grid_space.lon_bounds[1]) / 2)
+        best_node = None
+        min_dist = float('inf')
+        for node in grid_space.nodes:
+            if component is not None and node.component != component:
+                continue
+            dist = geo.euclidean(node.xy, center)
+            if dist < min_dist:
+                min_dist = dist
+                best_node = node
+        return best_node
+
+    @classmethod
+    def precompute(cls, grid: Grid, buckets = range(classes.NUM_BUCKETS), dtype = np.float32, verbose: bool = False, component: int = None):
+        '''
+        Run one-to-all Dijkstra from the representative node of every cell for each hour bucket
+            - grid: Grid with nodes (and their edges) added
+            - buckets: hour buckets to compute, other buckets are left as NaN (unknown)
+            - dtype: np.float32 or np.float16 (half the size, ~0.1% relative error)
+            - component: representative nodes are taken from this component only (e.g. the main one, so a node on
+                         a dead end one-way stretch doesn't make its whole cell unreachable)
+
+        This is an offline step: one search per (cell, bucket) over the whole network
+        '''
+
+        rep_nodes = np.full(NUM_CELLS, -1, dtype = np.int64)
+        reps = {} # <cell: Node_Object>
+        for lat_idx in range(GRID_WIDTH):
+            for lon_idx in range(GRID_HEIGHT):
+                node = CellTravelTimes.representative_node(grid.grid[lat_idx][lon_idx], component)
+                if node is not None:
+                    cell = Grid.idx2cell((lat_idx, lon_idx))
+                    reps[cell] = node
+                    rep_nodes[cell] = int(node.id)
+
+        times = np.full((classes.NUM_BUCKETS, NUM_CELLS, NUM_CELLS), np.nan, dtype = dtype)
+        for bucket in buckets:
+            start_time = classes.bucket_start_time(bucket)
+            for from_cell, from_node in reps.items():
+                distances = from_node.shortest_path_tree(start_time)
+                for to_cell, to_node in reps.items():
+                    times[bucket, from_cell, to_cell] = distances.get(to_node.id, float('inf')) # inf if unreachable
+            if verbose:
+                print(f'Computed hour bucket {bucket}')
+
+        return cls(times, rep_nodes)
+
+    def save(self, path: str = DEFAULT_PATH) -> None:
+        np.savez(path, times = self.times, rep_nodes = self.rep_nodes)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_PATH, graph = None):
+        with np.load(path) as data:
+            return cls(data['times'], data['rep_nodes'], graph)
+
+    def cell_time(self, from_cell: int, to_cell: int, time: dt.datetime) -> float:
+        '''
+        Travel time in minutes between two cells at a given time
+
+        Returns None if the time is unknown (cell without nodes, bucket not computed, or invalidated without a graph
+        to recompute it on), inf if unreachable. An invalidated row is recomputed first (one one-to-all search)
+        '''
+
+        bucket = classes.hour_bucket(time)
+        if self.stale[bucket, from_cell] and not self.recompute_row(bucket, from_cell):
+            return None
+        t = self.times[bucket, from_cell, to_cell]
+        if np.isnan(t):
+            return None
+        return float(t)
+
+    def invalidate(self, buckets) -> None:
+        '''
+        Mark every row of the given hour buckets as stale. A changed edge can be on the path between any two cells,
+        not only cells it lies in, so the whole bucket goes. Stale rows are recomputed on the graph's current speeds
+        when looked up (cell_time) or caught up in the background (recompute)
+        '''
+
+        self.stale[np.ix_(list(buckets), self.rep_cells)] = True # cells without nodes have no times to recompute
+
+    def recompute_row(self, bucket: int, from_cell: int) -> bool:
+        '''
+        Rebuild the travel times from one cell in an hour bucket with one one-to-all search (graph.ArrayGraph.shortest_path_tree)
+
+        Returns False if there is no graph to recompute on (the row stays stale)
+        '''
+
+        if self.graph is None:
+            return False
+        index = self.graph.node_index
+        t, _ = self.graph.shortest_path_tree(index[int(self.rep_nodes[from_cell])], bucket)
+        self.times[bucket, from_cell, self.rep_cells] = t[[index[node_id] for node_id in self.rep_nodes[self.rep_cells].tolist()]]
+        self.stale[bucket, from_cell] = False
+        return True
+
+    def recompute(self, max_rows: int = None) -> int:
+        '''
+        Recompute stale rows, at most max_rows of them (all if None), so invalidated buckets are whole again
+
+        Returns number of rows recomputed
+        '''
+
+        if self.graph is None:
+            return 0
+        rows = np.argwhere(self.stale)[:max_rows].tolist()
+        for bucket, from_cell in rows:
+            self.recompute_row(bucket, from_cell)
+        return len(rows)
+
+    def estimate(self, start_coords, end_coords, time: dt.datetime) -> float:
+        '''
+        Estimated travel time in minutes between two coordinates at a given time
+        '''
+
+        return self.cell_time(Grid.idx2cell(Grid.coord2idx(start_coords)), Grid.idx2cell(Grid.coord2idx(end_coords)), time)
+
+
+class CellIsochrones:
+    '''
+    Which Grid cells can reach each cell within a set of time thresholds, for each hour bucket, as bitsets over cells
+    (bit i of a row is cell i, np.packbits little bit order: NUM_CELLS / 8 bytes per row), built from a CellTravelTimes table
+        - travel_times: CellTravelTimes
+        - minutes: ascending thresholds
+
+    reach[bucket, k, to_cell] has the bits of every from_cell with times[bucket, from_cell, to_cell] <= minutes[k].
+    Unknown times (cells without nodes) are counted as reachable, so a pruned cell is always one known to be further
+    than the threshold, and so are stale rows (invalidated by traffic, not recomputed yet). Buckets with no known
+    times at all (not precomputed, or invalidated) are marked not computed until they are refreshed again.
+    '''
+
+    def __init__(self, travel_times: CellTravelTimes, minutes: tuple = ISOCHRONE_MINUTES) -> None:
+        self.travel_times = travel_times
+        self.minutes = tuple(minutes)
+        self.reach = np.zeros((classes.NUM_BUCKETS, len(self.minutes), NUM_CELLS, (NUM_CELLS + 7) // 8), dtype = np.uint8)
+        self.computed = np.zeros(classes.NUM_BUCKETS, dtype = bool)
+        self.refresh()
+
+    def refresh(self, buckets = None) -> None:
+        '''
+        Rebuild the bitsets of the given hour buckets (all if None) from the travel time table, e.g. after invalidating it
+        '''
+
+        for bucket in range(classes.NUM_BUCKETS) if buckets is None else buckets:
+            times = self.travel_times.times[bucket].T # [to_cell, from_cell]
+            unknown = np.isnan(times) | self.travel_times.stale[bucket]
+            self.computed[bucket] = not unknown.all()
+            for k, minutes in enumerate(self.minutes):
+                self.reach[bucket, k] = np.packbits(unknown | (times <= minutes), axis = -1, bitorder = 'little')
+
+    def candidate_cells(self, to_cell: int, bucket: int, k: int, occupied: np.ndarray) -> np.ndarray:
+        '''
+        Cells that reach to_cell within minutes[k] in an hour bucket, intersected with a bitset of cells (e.g. cells with drivers)
+
+        Returns flat cell indices, ascending
+        '''
+
+        return np.flatnonzero(np.unpackbits(self.reach[bucket, k, to_cell] & occupied, count = NUM_CELLS, bitorder = 'little'))
+
+
+if __name__ == '__main__':
+    import time
+    import T5
+
+    START = time.time()
+    T5.initialize()
+    table = CellTravelTimes.precompute(T5.PARTITION, verbose = True, component = T5.GRAPH.main_component)
+    table.save()
+    print(f'Saved travel time table to {DEFAULT_PATH} in {time.time() - START} seconds')